@@ -0,0 +1,373 @@
+"""NumPy batch engine: many games stepped at once.
+
+A BatchGame holds N games as arrays, with pieces numbered as in compact.py
+(color index * 3 + size - 1):
+    reserve      (N, 12)          pieces left in each game's reserve
+    stars        (N, S, 12)       star pieces in each system slot, as counts
+    ships        (N, S, P, 12)    ships in each system slot, as counts per player and piece
+    owner        (N, S)           player index + 1 for homeworlds, 0 for neutral systems
+    active       (N, S)           slot holds a system
+    system_ids   (N, S)           the system's id, as game.py numbers them
+    system_count (N,)             ids handed out so far
+    current      (N,)             index into players of the player to move
+S is max_systems and P the number of players.  Ships and stars are counts, so their order
+within a system isn't kept; the rules don't depend on it.
+
+The action methods (construct, move, trade, attack, catastrophe, setup) apply one action in
+each of the given games, which must be distinct, and assume it is legal, like game.py's.
+The *_mask methods give legality of every construct, move, trade, attack and catastrophe
+in every game in one step, following the same rules as game.generate_legal_turns (no
+sacrifice; it isn't vectorized).  random_step plays a uniformly random masked action in
+every game.
+
+from_gamestates/to_gamestate convert to and from GAMESTATE dicts.
+"""
+
+import numpy as np
+
+from compact import (
+    GREEN,
+    BLUE,
+    YELLOW,
+    RED,
+    PIECE_COUNT,
+    PIECE_KEYS,
+    piece_from_dict,
+    piece_to_dict,
+)
+from game import (
+    GAMESTATE,
+    NO_OWNER,
+    History,
+    rebuild_indexes,
+)
+
+
+# a neutral system needs a star and a ship, so 36 pieces allow at most 2 homeworlds + 17
+MAX_SYSTEMS = 20
+COUNT = np.int16
+
+PIECE_COLOR = np.arange(PIECE_COUNT) // 3
+PIECE_SIZE = np.arange(PIECE_COUNT) % 3
+# (12, 4) and (12, 3) one-hot matrices: piece counts @ COLOR_OF gives color counts
+COLOR_OF = (PIECE_COLOR[:, None] == np.arange(4)[None, :]).astype(COUNT)
+SIZE_OF = (PIECE_SIZE[:, None] == np.arange(3)[None, :]).astype(COUNT)
+# (12, 4): the piece a ship of each piece becomes when traded for each color
+TRADE_PIECE = np.arange(4)[None, :] * 3 + PIECE_SIZE[:, None]
+
+
+class BatchGame(object):
+
+    def __init__(self, n: int, players: tuple=(1, 2), pieces_per_type: int=3, max_systems: int=MAX_SYSTEMS):
+        self.players = tuple(players)
+        player_count = len(self.players)
+        self.reserve = np.full((n, PIECE_COUNT), pieces_per_type, dtype=COUNT)
+        self.stars = np.zeros((n, max_systems, PIECE_COUNT), dtype=COUNT)
+        self.ships = np.zeros((n, max_systems, player_count, PIECE_COUNT), dtype=COUNT)
+        self.owner = np.zeros((n, max_systems), dtype=COUNT)
+        self.active = np.zeros((n, max_systems), dtype=bool)
+        self.system_ids = np.zeros((n, max_systems), dtype=np.int32)
+        self.system_count = np.zeros(n, dtype=np.int32)
+        self.current = np.zeros(n, dtype=COUNT)
+
+    @property
+    def size(self) -> int:
+        return self.reserve.shape[0]
+
+    ##################
+    # Derived arrays
+    ##################
+
+    def own_ships(self) -> np.ndarray:
+        """(N, S, 12) ships of the player to move."""
+        return self.ships[np.arange(self.size), :, self.current]
+
+    def colors_present(self) -> np.ndarray:
+        """(N, S, 4) colors on any star or ship."""
+        return (self.stars @ COLOR_OF + self.ships.sum(axis=2) @ COLOR_OF) > 0
+
+    def star_sizes(self) -> np.ndarray:
+        """(N, S, 3) star sizes present."""
+        return (self.stars @ SIZE_OF) > 0
+
+    ##################
+    # Legality masks
+    ##################
+
+    def construct_mask(self) -> np.ndarray:
+        """(N, S, 4): construct in system slot with color."""
+        own_colors = (self.own_ships() @ COLOR_OF) > 0
+        green = self.colors_present()[:, :, GREEN]
+        reserve_colors = (self.reserve @ COLOR_OF) > 0
+        return own_colors & green[:, :, None] & reserve_colors[:, None, :]
+
+    def move_mask(self) -> np.ndarray:
+        """(N, S, 12, S): move own ship of piece from system slot to system slot."""
+        own = self.own_ships() > 0
+        yellow = self.colors_present()[:, :, YELLOW]
+        sizes = self.star_sizes()
+        shared = (sizes[:, :, None, :] & sizes[:, None, :, :]).any(axis=-1)
+        targets = self.active[:, None, :] & ~shared
+        return (own & yellow[:, :, None])[:, :, :, None] & targets[:, :, None, :]
+
+    def move_new_mask(self) -> np.ndarray:
+        """(N, S, 12, 12): move own ship of piece from system slot to a new system with star piece."""
+        own = self.own_ships() > 0
+        yellow = self.colors_present()[:, :, YELLOW]
+        new_stars = (self.reserve > 0)[:, None, :] & ~self.star_sizes()[:, :, PIECE_SIZE]
+        return (own & yellow[:, :, None])[:, :, :, None] & new_stars[:, :, None, :]
+
+    def trade_mask(self) -> np.ndarray:
+        """(N, S, 12, 4): trade own ship of piece in system slot for color."""
+        own = self.own_ships() > 0
+        blue = self.colors_present()[:, :, BLUE]
+        available = (self.reserve[:, TRADE_PIECE] > 0) & (PIECE_COLOR[:, None] != np.arange(4)[None, :])
+        return (own & blue[:, :, None])[:, :, :, None] & available[:, None, :, :]
+
+    def attack_mask(self) -> np.ndarray:
+        """(N, S, P, 12): attack player's ship of piece in system slot."""
+        own_sizes = (self.own_ships() @ SIZE_OF) > 0
+        # own ship at least as large as each size
+        reach = np.flip(np.logical_or.accumulate(np.flip(own_sizes, axis=-1), axis=-1), axis=-1)
+        red = self.colors_present()[:, :, RED]
+        enemy = self.ships > 0
+        enemy[np.arange(self.size), :, self.current] = False
+        return enemy & (reach[:, :, PIECE_SIZE] & red[:, :, None])[:, :, None, :]
+
+    def catastrophe_mask(self) -> np.ndarray:
+        """(N, S, 4): catastrophe in system slot for color."""
+        counts = self.stars @ COLOR_OF + self.ships.sum(axis=2) @ COLOR_OF
+        return self.active[:, :, None] & (counts >= 4)
+
+    def losers(self) -> np.ndarray:
+        """(N, P): player has no ship of their own at their homeworld (or no homeworld)."""
+        player_count = len(self.players)
+        holding = np.zeros((self.size, player_count), dtype=bool)
+        for player in range(player_count):
+            home = self.active & (self.owner == player + 1)
+            holding[:, player] = (home & (self.ships[:, :, player, :].sum(axis=-1) > 0)).any(axis=1)
+        return ~holding
+
+    ##################
+    # Actions
+    ##################
+
+    def _free_slots(self, games: np.ndarray) -> np.ndarray:
+        free = ~self.active[games]
+        if not free.any(axis=1).all():
+            raise ValueError("No free system slot; raise max_systems.")
+        return free.argmax(axis=1)
+
+    def _new_system(self, games: np.ndarray, owner: np.ndarray) -> np.ndarray:
+        slots = self._free_slots(games)
+        self.active[games, slots] = True
+        self.owner[games, slots] = owner
+        self.system_count[games] += 1
+        self.system_ids[games, slots] = self.system_count[games]
+        return slots
+
+    def _destroy(self, games: np.ndarray, slots: np.ndarray) -> type(None):
+        """Removes systems, returning their stars and ships to the reserve."""
+        self.reserve[games] += self.stars[games, slots] + self.ships[games, slots].sum(axis=1)
+        self.stars[games, slots] = 0
+        self.ships[games, slots] = 0
+        self.owner[games, slots] = NO_OWNER
+        self.active[games, slots] = False
+
+    def _destroy_if_abandoned(self, games: np.ndarray, slots: np.ndarray) -> type(None):
+        abandoned = (self.owner[games, slots] == NO_OWNER) & (self.ships[games, slots].sum(axis=(1, 2)) == 0)
+        self._destroy(games[abandoned], slots[abandoned])
+
+    def construct(self, games, slots, colors) -> type(None):
+        """Builds the smallest ship of color available in the reserve."""
+        games, slots, colors = np.asarray(games), np.asarray(slots), np.asarray(colors)
+        choices = colors[:, None] * 3 + np.arange(3)[None, :]
+        available = self.reserve[games[:, None], choices] > 0
+        has = available.any(axis=1)
+        games, slots = games[has], slots[has]
+        pieces = choices[has, available[has].argmax(axis=1)]
+        self.reserve[games, pieces] -= 1
+        self.ships[games, slots, self.current[games], pieces] += 1
+
+    def move(self, games, slots, pieces, targets) -> type(None):
+        """Moves a ship of the player to move.  A target is a system slot, or ~piece
+        (negative, as in compact.new_system) for a new system with that star."""
+        games, slots, pieces, targets = np.asarray(games), np.asarray(slots), np.asarray(pieces), np.asarray(targets)
+        players = self.current[games]
+        self.ships[games, slots, players, pieces] -= 1
+        self._destroy_if_abandoned(games, slots)
+
+        new = targets < 0
+        if new.any():
+            new_games = games[new]
+            stars = ~targets[new]
+            self.reserve[new_games, stars] -= 1
+            new_slots = self._new_system(new_games, NO_OWNER)
+            self.stars[new_games, new_slots, stars] += 1
+            targets = targets.copy()
+            targets[new] = new_slots
+        self.ships[games, targets, players, pieces] += 1
+
+    def trade(self, games, slots, pieces, colors) -> type(None):
+        games, slots, pieces, colors = np.asarray(games), np.asarray(slots), np.asarray(pieces), np.asarray(colors)
+        players = self.current[games]
+        new_pieces = colors * 3 + pieces % 3
+        self.ships[games, slots, players, pieces] -= 1
+        self.reserve[games, pieces] += 1
+        self.reserve[games, new_pieces] -= 1
+        self.ships[games, slots, players, new_pieces] += 1
+
+    def attack(self, games, slots, owners, pieces) -> type(None):
+        """owners are player indexes of the ships taken."""
+        games, slots, owners, pieces = np.asarray(games), np.asarray(slots), np.asarray(owners), np.asarray(pieces)
+        self.ships[games, slots, owners, pieces] -= 1
+        self.ships[games, slots, self.current[games], pieces] += 1
+
+    def catastrophe(self, games, slots, colors) -> type(None):
+        games, slots, colors = np.asarray(games), np.asarray(slots), np.asarray(colors)
+        of_color = PIECE_COLOR[None, :] == colors[:, None]
+        stars = self.stars[games, slots]
+        gone = (stars * ~of_color).sum(axis=1) == 0
+        self._destroy(games[gone], slots[gone])
+
+        games, slots, of_color = games[~gone], slots[~gone], of_color[~gone]
+        stars = self.stars[games, slots]
+        ships = self.ships[games, slots]
+        self.reserve[games] += stars * of_color + (ships * of_color[:, None, :]).sum(axis=1)
+        self.stars[games, slots] = stars * ~of_color
+        self.ships[games, slots] = ships * ~of_color[:, None, :]
+        self._destroy_if_abandoned(games, slots)
+
+    def setup(self, games, star_pieces, ship_pieces) -> type(None):
+        """star_pieces is (len(games), 2)."""
+        games, star_pieces, ship_pieces = np.asarray(games), np.asarray(star_pieces), np.asarray(ship_pieces)
+        players = self.current[games]
+        slots = self._new_system(games, players + 1)
+        # one column at a time, so two equal stars both count
+        for column in range(star_pieces.shape[1]):
+            self.reserve[games, star_pieces[:, column]] -= 1
+            self.stars[games, slots, star_pieces[:, column]] += 1
+        self.reserve[games, ship_pieces] -= 1
+        self.ships[games, slots, players, ship_pieces] += 1
+
+    def end_turn(self, games=None) -> type(None):
+        """Hands the turn to the next player in the given games (all by default)."""
+        if games is None:
+            games = slice(None)
+        self.current[games] = (self.current[games] + 1) % len(self.players)
+
+    ##################
+    # Random play
+    ##################
+
+    def random_setup(self, rng: np.random.Generator, games=None) -> type(None):
+        """The player to move in each game sets up with random pieces from the reserve."""
+        games = np.arange(self.size) if games is None else np.asarray(games)
+        pieces = np.empty((len(games), 3), dtype=np.int64)
+        pending = np.ones(len(games), dtype=bool)
+        while pending.any():
+            pieces[pending] = rng.integers(0, PIECE_COUNT, size=(pending.sum(), 3))
+            needed = np.zeros((len(games), PIECE_COUNT), dtype=COUNT)
+            for column in range(3):
+                np.add.at(needed, (np.arange(len(games)), pieces[:, column]), 1)
+            pending = (needed > self.reserve[games]).any(axis=1)
+        self.setup(games, pieces[:, :2], pieces[:, 2])
+
+    def random_step(self, rng: np.random.Generator, games=None) -> np.ndarray:
+        """Plays one uniformly random legal construct, move, trade, attack or catastrophe in
+        each game (passing where there is none) and ends the turn.
+        Returns the (N, P) losers array afterwards."""
+        games = np.arange(self.size) if games is None else np.asarray(games)
+        masks = [self.construct_mask(), self.move_mask(), self.move_new_mask(), self.trade_mask(),
+                 self.attack_mask(), self.catastrophe_mask()]
+        flat = np.concatenate([mask[games].reshape(len(games), -1) for mask in masks], axis=1)
+        scores = np.where(flat, rng.random(flat.shape), -1.0)
+        choice = scores.argmax(axis=1)
+        playing = flat[np.arange(len(games)), choice]
+
+        start = 0
+        for mask, apply in zip(masks, (self._apply_construct, self._apply_move, self._apply_move_new,
+                                       self._apply_trade, self._apply_attack, self._apply_catastrophe)):
+            shape = mask.shape[1:]
+            width = int(np.prod(shape))
+            picked = playing & (choice >= start) & (choice < start + width)
+            if picked.any():
+                apply(games[picked], np.unravel_index(choice[picked] - start, shape))
+            start += width
+
+        self.end_turn(games)
+        return self.losers()
+
+    def _apply_construct(self, games, index):
+        self.construct(games, index[0], index[1])
+
+    def _apply_move(self, games, index):
+        self.move(games, index[0], index[1], index[2])
+
+    def _apply_move_new(self, games, index):
+        self.move(games, index[0], index[1], ~index[2])
+
+    def _apply_trade(self, games, index):
+        self.trade(games, index[0], index[1], index[2])
+
+    def _apply_attack(self, games, index):
+        self.attack(games, index[0], index[1], index[2])
+
+    def _apply_catastrophe(self, games, index):
+        self.catastrophe(games, index[0], index[1])
+
+
+##################
+# GAMESTATE adapter
+##################
+
+
+def from_gamestates(games: list, max_systems: int=MAX_SYSTEMS) -> BatchGame:
+    """BatchGame holding the given GAMESTATEs, which must have the same players."""
+    batch = BatchGame(len(games), games[0]["players"], max_systems=max_systems)
+    player_index = {player: index for index, player in enumerate(batch.players)}
+    for row, game in enumerate(games):
+        if tuple(game["players"]) != batch.players:
+            raise ValueError("All games in a batch must have the same players.")
+        batch.reserve[row] = [game["reserve"][key] for key in PIECE_KEYS]
+        for slot, (system_id, system) in enumerate(game["systems"].items()):
+            batch.active[row, slot] = True
+            batch.system_ids[row, slot] = system_id
+            owner = system["star"]["owner"]
+            batch.owner[row, slot] = NO_OWNER if owner == NO_OWNER else player_index[owner] + 1
+            for piece in system["star"]["pieces"]:
+                batch.stars[row, slot, piece_from_dict(piece)] += 1
+            for ship in system["ships"]:
+                batch.ships[row, slot, player_index[ship["owner"]], piece_from_dict(ship["piece"])] += 1
+        batch.system_count[row] = game["system_count"]
+        batch.current[row] = player_index[game["current_player"]]
+    return batch
+
+
+def to_gamestate(batch: BatchGame, row: int) -> GAMESTATE:
+    """GAMESTATE for one game of a batch.  Systems come out in id order, and stars and
+    ships within a system in piece order."""
+    players = batch.players
+    systems = {}
+    for slot in np.argsort(np.where(batch.active[row], batch.system_ids[row], np.iinfo(np.int32).max)):
+        if not batch.active[row, slot]:
+            break
+        owner = int(batch.owner[row, slot])
+        stars = [piece_to_dict(piece) for piece in range(PIECE_COUNT)
+                 for _ in range(batch.stars[row, slot, piece])]
+        ships = [{"owner": players[player], "piece": piece_to_dict(piece)}
+                 for player in range(len(players)) for piece in range(PIECE_COUNT)
+                 for _ in range(batch.ships[row, slot, player, piece])]
+        systems[int(batch.system_ids[row, slot])] = {
+            "star": {"owner": NO_OWNER if owner == NO_OWNER else players[owner - 1], "pieces": stars},
+            "ships": ships
+        }
+    return rebuild_indexes({
+        "reserve": {key: int(count) for key, count in zip(PIECE_KEYS, batch.reserve[row])},
+        "systems": systems,
+        "players": list(players),
+        "current_player": players[batch.current[row]],
+        "history": History(),
+        "system_count": int(batch.system_count[row]),
+        "owner_count": len(players)
+    })
@@ -0,0 +1,319 @@
+"""Engine benchmarks.
+
+usage: python benchmark.py [--output FILE] [--save-baseline] [--baseline [FILE]]
+                           [--threshold T] [--levels off,full] [--quick]
+
+Measures, at each validation level (see validation.py; "off" is the engine without schema
+checks, "full" with all of them):
+    - every validator in ACTION_VALIDATORS, on legal args in mid-game states (and a new
+      game, for setup),
+    - every action in ACTION_METHODS, applied with apply_action and taken back with undo,
+    - interpret_bot_input end to end, on a fresh copy of the state each call, without the
+      legality cache (see legality_cache.py),
+    - check_player_lost,
+    - full games between bundled bots, as turns/sec and games/sec, each game starting
+      with an empty legality cache.
+Mid-game states come from seeded random games, sampled until every action has cases
+(see sample_positions), so every run measures the same work and none is left out.
+Every benchmark is warmed up first, then the best of several runs is reported; rule
+benchmarks repeat their cases until each run has taken MIN_SECONDS.
+
+Results are written as JSON ({"meta": {...}, "results": {level: {name: {...}}}}).  With
+--baseline, each result's rate is compared to the baseline's, and the script exits with
+status 1 if any is more than --threshold (a fraction) slower, or missing.
+
+Rates depend on the machine, so no baseline is shipped.  Make one on the machine that will
+run the comparisons, before the change to be measured:
+    python benchmark.py --save-baseline
+which writes benchmark_baseline.json; after the change,
+    python benchmark.py --baseline
+compares against it.  --baseline FILE compares against any other results file.
+"""
+
+import argparse
+import contextlib
+import copy
+import gc
+import io
+import json
+import platform
+import random
+import sys
+import time
+
+from game import (
+    ACTION_METHODS,
+    ACTION_VALIDATORS,
+    apply_action,
+    create_game,
+    following_player,
+    generate_legal_turns,
+    apply_turn,
+    undo,
+)
+from legality_cache import (
+    CACHE as LEGALITY_CACHE,
+)
+from main import (
+    check_player_lost,
+    interpret_bot_input,
+    play_game,
+)
+from validation import (
+    OFF,
+    FULL,
+    set_validation_level,
+)
+
+
+GAME_PAIRS = (("simple_test", "simple_test_b"), ("random_play", "random_play"))
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_BASELINE = "benchmark_baseline.json"
+# each timed run lasts at least this long; the best of REPEAT runs is reported
+MIN_SECONDS = 0.2
+REPEAT = 5
+# sampling stops with an error past this many states
+MAX_STATES = 2000
+# generating every sacrifice of a crowded position takes seconds; sampling needs a few
+SAMPLING_SACRIFICE_LIMIT = 16
+
+
+def _random_turn(game, rng: random.Random) -> list:
+    """A random legal turn, or None.  The action is picked first, then its args, and
+    sacrifices and catastrophes only when nothing else is legal: picking uniformly among
+    turns would almost always sacrifice (they are by far the most numerous) and end the
+    game within a few turns, before fleets ever meet to attack."""
+    by_action = {}
+    for action, args in generate_legal_turns(game, SAMPLING_SACRIFICE_LIMIT):
+        by_action.setdefault(action, []).append(args)
+    if not by_action:
+        return None
+    actions = sorted(set(by_action) - {"sacrifice", "catastrophe"}) or sorted(by_action)
+    action = rng.choice(actions)
+    return [action, rng.choice(by_action[action])]
+
+
+def _midgame_positions(seed: int, min_turn: int, max_turn: int):
+    """Yields states from random games, each taken between min_turn and max_turn turns in,
+    with at least one legal non-setup turn to play."""
+    rng = random.Random(seed)
+    while True:
+        game = create_game(first_player=rng.choice([1, 2]))
+        stop = rng.randint(min_turn, max_turn)
+        for turn_number in range(stop):
+            turn = _random_turn(game, rng)
+            if turn is None:
+                break
+            apply_turn(game, turn, following_player(game))
+            if turn_number >= 2 and check_player_lost.unchecked(game):
+                break
+        else:
+            yield game
+
+
+def _add_cases(cases: dict, game, per_state: int, rng: random.Random) -> type(None):
+    """Adds up to per_state legal args for each action to cases (action -> [(state, args)])."""
+    by_action = {}
+    for action, args in generate_legal_turns(game, SAMPLING_SACRIFICE_LIMIT):
+        by_action.setdefault(action, []).append(args)
+    for action, candidates in by_action.items():
+        for args in rng.sample(candidates, min(per_state, len(candidates))):
+            cases[action].append((game, args))
+
+
+def sample_positions(count: int, per_state: int=5, seed: int=0, min_turn: int=6, max_turn: int=30) -> (list, dict):
+    """(states, cases): at least count mid-game states, and legal args for every action in
+    ACTION_METHODS sampled from them (setups from a new game), at least per_state of each.
+    States are added until every action has its cases; raises RuntimeError if MAX_STATES
+    aren't enough, rather than leave an action out of the suite."""
+    rng = random.Random(seed)
+    cases = {action: [] for action in ACTION_METHODS}
+    states = []
+    previous_level = set_validation_level(OFF)
+    try:
+        _add_cases(cases, create_game(), per_state, rng)
+        for game in _midgame_positions(seed, min_turn, max_turn):
+            missing = [action for action, found in cases.items() if len(found) < per_state]
+            if len(states) >= count and not missing:
+                break
+            if len(states) >= MAX_STATES:
+                raise RuntimeError("{} random states give fewer than {} cases of {}.".format(
+                    MAX_STATES, per_state, ", ".join(missing)))
+            states.append(game)
+            _add_cases(cases, game, per_state, rng)
+    finally:
+        set_validation_level(previous_level)
+    return states, cases
+
+
+def _pass(function, items: list, prepare) -> float:
+    """Seconds to call function(item) for every item; prepare(items), if given, makes fresh
+    items first, outside the timing."""
+    if prepare is not None:
+        items = prepare(items)
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return time.perf_counter() - start
+
+
+def _timed(function, items: list, repeat: int, prepare=None) -> dict:
+    """Best of repeat runs of function over items, after a warm-up pass.  Each run makes
+    passes over items until it has taken MIN_SECONDS; garbage collection is off while
+    timing, as in timeit."""
+    _pass(function, items, prepare)
+    best = None
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            passes = 0
+            seconds = 0.0
+            while seconds < MIN_SECONDS:
+                seconds += _pass(function, items, prepare)
+                passes += 1
+            if best is None or seconds / passes < best[1] / best[0]:
+                best = (passes, seconds)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    passes, seconds = best
+    calls = passes * len(items)
+    return {"calls": calls, "seconds": seconds, "per_second": calls / seconds if seconds else 0.0}
+
+
+def bench_rules(states: list, cases: dict, repeat: int) -> dict:
+    results = {}
+    for action, validator in ACTION_VALIDATORS.items():
+        if cases[action]:
+            results["validate_" + action] = _timed(lambda case: validator(case[0], case[1]), cases[action], repeat)
+
+    for action in ACTION_METHODS:
+        if cases[action]:
+            results["action_" + action] = _timed(
+                lambda case: undo(case[0], apply_action(case[0], action, case[1])), cases[action], repeat)
+
+    turns = [(game, [action, args]) for action, action_cases in cases.items() for game, args in action_cases]
+    # turns change the state they are played on; copying is part of the setup, not of what is measured
+    results["interpret_bot_input"] = _timed(
+        lambda case: interpret_bot_input(case[0], case[1], None), turns, repeat,
+        lambda turns: [(copy.deepcopy(game), copy.deepcopy(turn)) for game, turn in turns])
+
+    results["check_player_lost"] = _timed(check_player_lost, states, repeat)
+    return results
+
+
+def _play_games(first: str, second: str, games: int, seed: int) -> int:
+    turns = 0
+    # the bundled bots print as they play
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index in range(games):
+            # each game starts with the legality cache as a fresh process has it; otherwise
+            # replaying the same seeded games would mostly time cache hits
+            LEGALITY_CACHE.clear()
+            summary = play_game(first, second, seed=seed + index, log_file=None, max_turns=300, verbose=False)
+            turns += summary["turns"]
+    return turns
+
+
+def bench_games(games: int, seed: int, repeat: int) -> dict:
+    """Best of repeat runs of the same seeded games, after a warm-up game."""
+    results = {}
+    for first, second in GAME_PAIRS:
+        _play_games(first, second, 1, seed)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            turns = _play_games(first, second, games, seed)
+            seconds = time.perf_counter() - start
+            if best is None or seconds < best:
+                best = seconds
+        results["game_{}_vs_{}".format(first, second)] = {
+            "calls": turns, "seconds": best, "per_second": turns / best if best else 0.0,
+            "games_per_second": games / best if best else 0.0}
+    return results
+
+
+def run(levels: list, quick: bool=False, seed: int=0) -> dict:
+    states, cases = sample_positions(10 if quick else 40, seed=seed)
+    repeat = 1 if quick else REPEAT
+    games = 2 if quick else 10
+
+    results = {}
+    for level in levels:
+        previous_level = set_validation_level(level)
+        try:
+            results[level] = bench_rules(states, cases, repeat)
+            results[level].update(bench_games(games, seed, repeat))
+        finally:
+            set_validation_level(previous_level)
+    return {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(),
+                 "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "quick": quick, "seed": seed},
+        "results": results
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float=DEFAULT_THRESHOLD) -> (list, list):
+    """Returns (rows, regressions): a (level, name, baseline rate, current rate, change) row
+    for every benchmark in the baseline at the levels current measured, and the rows more
+    than threshold slower.  A benchmark missing from current counts as a regression, with
+    a rate of 0."""
+    rows = []
+    regressions = []
+    for level, results in current["results"].items():
+        for name, before in baseline["results"].get(level, {}).items():
+            if not before["per_second"]:
+                continue
+            result = results.get(name)
+            after = result["per_second"] if result is not None else 0.0
+            change = after / before["per_second"] - 1
+            row = (level, name, before["per_second"], after, change)
+            rows.append(row)
+            if change < -threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def format_results(report: dict) -> str:
+    lines = ["{:<6} {:<36} {:>10} {:>14}".format("level", "benchmark", "calls", "per second")]
+    for level, results in report["results"].items():
+        for name, result in results.items():
+            lines.append("{:<6} {:<36} {:>10} {:>14.1f}".format(level, name, result["calls"], result["per_second"]))
+    return "\n".join(lines)
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the game engine.")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="also write the results to " + DEFAULT_BASELINE)
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE, default=None,
+                        help="results file to compare against (default " + DEFAULT_BASELINE + ")")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown (as a fraction) that counts as a regression")
+    parser.add_argument("--levels", default="{},{}".format(OFF, FULL), help="validation levels to measure")
+    parser.add_argument("--quick", action="store_true", help="fewer states and games, and one run of each benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    report = run(args.levels.split(","), args.quick, args.seed)
+    for path in [args.output] + ([DEFAULT_BASELINE] if args.save_baseline else []):
+        with open(path, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    print(format_results(report))
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    rows, regressions = compare(report, baseline, args.threshold)
+    print()
+    for level, name, before, after, change in rows:
+        print("{:<6} {:<36} {:>14.1f} -> {:>14.1f} {:>+8.1%}{}".format(
+            level, name, before, after, change, "  REGRESSION" if (level, name, before, after, change) in regressions else ""))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,89 @@
+"""Per-game bot instances.
+
+A bot is a module in bots/.  A module that defines
+
+    new_game(player_id: int, seed: int) -> object with take_turn(game, message) -> list
+
+gets a fresh object for every game, so one process (or one thread, or one event loop) can
+play any number of games with the same bot at once; per-game state lives on the object.
+seed is for the bot's own random.Random; it may be None.
+
+A take_turn that also takes a time_left argument is told the seconds it may use on the move
+(None for no limit), as the engine's clock sees it: bots should answer well within it, since
+the time to send the state and the turn counts too.  Engines call bots through
+turn_function, which leaves time_left out for bots that don't take it.
+
+Legacy modules, with a module-level take_turn and per-game state in module globals, are
+wrapped in a ModuleBot: every game gets its own copy of the module, executed fresh and
+never put in sys.modules, so games don't see each other's globals.
+"""
+
+from importlib import (
+    import_module,
+)
+from importlib.util import (
+    find_spec,
+    module_from_spec,
+)
+from inspect import (
+    signature,
+)
+import random
+
+
+BOT_PATH = "bots."
+
+
+def module_copy(name: str):
+    """A newly executed copy of bots/<name>.py, independent of the imported one."""
+    spec = find_spec(BOT_PATH + name)
+    if spec is None:
+        raise ImportError("No bot named {!r}.".format(name))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ModuleBot(object):
+    """A legacy take_turn module as a per-game bot.  If the module uses the random
+    module, its copy gets a random.Random(seed) in its place."""
+
+    def __init__(self, name: str, player_id: int, seed: int=None):
+        self.name = name
+        self.player_id = player_id
+        self.module = module_copy(name)
+        if getattr(self.module, "random", None) is random:
+            self.module.random = random.Random(seed)
+
+    def __repr__(self):
+        return "ModuleBot({!r}, player_id={})".format(self.name, self.player_id)
+
+    def take_turn(self, game: dict, message: str) -> list:
+        return self.module.take_turn(game, message)
+
+
+def player_seed(seed: int, player_id: int) -> int:
+    """Seed for player_id's bot in a game seeded with seed (None for None)."""
+    if seed is None:
+        return None
+    return random.Random("{}:{}".format(seed, player_id)).getrandbits(32)
+
+
+def new_game(name: str, player_id: int, seed: int=None):
+    """The bot named name, ready for a new game as player_id."""
+    module = import_module(BOT_PATH + name)
+    if hasattr(module, "new_game"):
+        return module.new_game(player_id, seed)
+    return ModuleBot(name, player_id, seed)
+
+
+def turn_function(bot):
+    """bot's take_turn as a function of (game, message, time_left)."""
+    take_turn = bot.take_turn
+    try:
+        timed = "time_left" in signature(take_turn).parameters
+    except (TypeError, ValueError):
+        timed = False
+    if timed:
+        return lambda game, message, time_left=None: take_turn(game, message, time_left=time_left)
+    return lambda game, message, time_left=None: take_turn(game, message)
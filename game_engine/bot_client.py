@@ -0,0 +1,87 @@
+"""Connects a bundled bot to a game server (server.py).
+
+usage: python bot_client.py BOT [--host H] [--port P] [--unix PATH] [--games K]
+
+Plays bots/BOT.py on the server until the server closes the connection, with a bot
+instance per game (see bot_api.py), so --games can be raised for any bot.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from bot_process import (
+    Games,
+)
+import protocol
+from protocol import (
+    MAX_MESSAGE,
+    read_message,
+    write_message,
+)
+from server import (
+    DEFAULT_PORT,
+)
+
+
+async def run_client(bot: str, host: str=None, port: int=None, unix_path: str=None, games: int=1,
+                     verbose: bool=True) -> dict:
+    """Plays on the server until it disconnects, returns {"games", "wins", "losses", "draws"}."""
+    if unix_path is not None:
+        reader, writer = await asyncio.open_unix_connection(unix_path, limit=MAX_MESSAGE)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_MESSAGE)
+    games_in_play = Games(bot)
+    players = {}
+    record = {"games": 0, "wins": 0, "losses": 0, "draws": 0}
+    await write_message(writer, protocol.hello(bot, games))
+    try:
+        while True:
+            message = await read_message(reader)
+            if message is None:
+                break
+            reply = games_in_play.handle(message)
+            if reply is not None:
+                await write_message(writer, reply)
+            if message["type"] == "start":
+                players[message["game"]] = message["player"]
+            elif message["type"] == "end":
+                player = players.pop(message["game"], None)
+                record["games"] += 1
+                if message["winner"] == player:
+                    record["wins"] += 1
+                elif player in message["losers"]:
+                    record["losses"] += 1
+                else:
+                    record["draws"] += 1
+                if verbose:
+                    print("game {game}: {reason}".format(**message), file=sys.stderr)
+            elif message["type"] == "error":
+                print("server: {}".format(message["message"]), file=sys.stderr)
+    except ConnectionError:
+        # the server went away
+        pass
+    finally:
+        writer.close()
+    return record
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Play a bot on a game server.")
+    parser.add_argument("bot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", default=None, help="Unix socket path, instead of TCP")
+    parser.add_argument("--games", type=int, default=1, help="games to play at once")
+    args = parser.parse_args(argv)
+
+    try:
+        record = asyncio.run(run_client(args.bot, args.host, args.port, args.unix, args.games))
+    except KeyboardInterrupt:
+        return 0
+    print("{games} games: {wins} wins, {losses} losses, {draws} draws".format(**record))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
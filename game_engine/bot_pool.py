@@ -0,0 +1,184 @@
+"""Bots in persistent processes, kept warm across games.
+
+A ProcessBot is one bot process that speaks protocol.py over its stdin/stdout.  By default
+it runs a bundled bot through bot_process.py, but any command speaking the protocol works,
+so a bot can bring its own interpreter.  It plays games one after another; a crash, a
+blocking call or a print in the bot stays in its process.
+
+A BotPool hands out idle ProcessBots by bot name and takes them back after each game, so
+processes (and whatever the bot loaded) are started once, not once per game.  A process
+that timed out or died is not reused; the next acquire starts a new one.
+"""
+
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+from bot_worker import (
+    BotError,
+    BotTimeout,
+)
+import protocol
+from protocol import (
+    ProtocolError,
+    decode,
+    write_message_to,
+)
+
+
+SHIM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_process.py")
+
+
+def bundled_command(name: str) -> list:
+    """Command running bots/<name>.py through the bot_process.py shim."""
+    return [sys.executable, SHIM, name]
+
+
+class ProcessBot(object):
+    """One bot process.  Replies are read by a thread (one per process, not per game)
+    so take_turn can wait for them with a timeout."""
+
+    def __init__(self, name: str, command: list=None, stderr=None):
+        self.name = name
+        self.command = command or bundled_command(name)
+        self.games = 0
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=stderr)
+        self._replies = queue.Queue()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def __repr__(self):
+        return "ProcessBot({!r}, pid={})".format(self.name, self._process.pid)
+
+    def _read(self) -> type(None):
+        for line in self._process.stdout:
+            try:
+                self._replies.put(decode(line))
+            except ProtocolError as exc:
+                print("bot {}: {}".format(self.name, exc), file=sys.stderr)
+        # end of output: the process exited
+        self._replies.put(None)
+
+    def _send(self, message: dict) -> type(None):
+        try:
+            write_message_to(self._process.stdin, message)
+        except (BrokenPipeError, OSError) as exc:
+            raise BotError("bot {} process died: {!r}".format(self.name, exc))
+
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    def start_game(self, player: int, players: list, seed: int=None) -> type(None):
+        self.games += 1
+        self._send(protocol.start(self.games, player, players, seed))
+
+    def end_game(self, summary: dict) -> type(None):
+        if self.alive():
+            self._send(protocol.end(self.games, summary))
+
+    def take_turn(self, game: dict, message: str, timeout: float=None) -> (list, dict):
+        """Asks the bot for a turn, returns (turn, stats) like BotWorker.take_turn.
+        Raises BotTimeout if it takes longer than timeout seconds (the process is stopped),
+        or BotError if the bot raised or died."""
+        wall_start = time.perf_counter()
+        self._send(protocol.turn_request(self.games, game, message, timeout))
+        while True:
+            remaining = None if timeout is None else max(0.0, wall_start + timeout - time.perf_counter())
+            try:
+                reply = self._replies.get(timeout=remaining)
+            except queue.Empty:
+                self.close(force=True)
+                raise BotTimeout("bot {} did not answer within {:.3f}s".format(self.name, timeout))
+            if reply is None:
+                raise BotError("bot {} process exited with {}".format(self.name, self._process.wait()))
+            # anything else is left over from an earlier game
+            if reply.get("game") == self.games and reply["type"] in ("turn", "error"):
+                break
+        stats = {"wall": time.perf_counter() - wall_start, "cpu": 0.0, "max_rss_kb": None}
+        stats.update(reply.get("stats") or {})
+        if reply["type"] == "error":
+            raise BotError(reply["message"])
+        return reply["turn"], stats
+
+    def close(self, force: bool=False) -> type(None):
+        if not force:
+            # end of input is the shim's signal to exit
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self._process.wait(1)
+            except subprocess.TimeoutExpired:
+                pass
+        if self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(1)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        for stream in (self._process.stdin, self._process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class BotPool(object):
+    """Idle ProcessBots by bot name.  commands maps bot names to commands for bots
+    that don't run through the shim; stderr is passed to every process."""
+
+    def __init__(self, commands: dict=None, stderr=None):
+        self.commands = commands or {}
+        self.stderr = stderr
+        self.started = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _spawn(self, name: str) -> ProcessBot:
+        # starting the process is slow, so only the count is kept under the lock
+        bot = ProcessBot(name, self.commands.get(name), self.stderr)
+        with self._lock:
+            self.started += 1
+        return bot
+
+    def prespawn(self, name: str, count: int) -> type(None):
+        """Starts count processes for name ahead of the games that will use them."""
+        bots = [self._spawn(name) for _ in range(count)]
+        with self._lock:
+            self._idle.setdefault(name, []).extend(bots)
+
+    def acquire(self, name: str) -> ProcessBot:
+        with self._lock:
+            idle = self._idle.get(name, [])
+            while idle:
+                bot = idle.pop()
+                if bot.alive():
+                    return bot
+                bot.close()
+        return self._spawn(name)
+
+    def release(self, bot: ProcessBot) -> type(None):
+        if not bot.alive():
+            bot.close()
+            return
+        with self._lock:
+            self._idle.setdefault(bot.name, []).append(bot)
+
+    def close(self) -> type(None):
+        with self._lock:
+            bots = [bot for idle in self._idle.values() for bot in idle]
+            self._idle.clear()
+        for bot in bots:
+            bot.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,88 @@
+"""Runs a bundled bot as its own process, speaking protocol.py over stdin/stdout.
+
+usage: python bot_process.py BOT
+
+The shim that lets any bot in bots/ play out of process (see bot_pool.py).  It plays
+games for as long as stdin stays open, with a new bot instance (bot_api.new_game) for
+every "start", kept until that game's "end".  stdout carries only protocol messages:
+anything the bot prints goes to stderr.
+"""
+
+import sys
+import time
+
+from bot_api import (
+    new_game,
+    turn_function,
+)
+from bot_worker import (
+    peak_memory_kb,
+)
+import protocol
+from protocol import (
+    read_message_from,
+    request_state,
+    write_message_to,
+)
+
+
+def answer(take_turn, request: dict) -> dict:
+    """Reply to a turn request from take_turn (see bot_api.turn_function), with the CPU
+    time it used."""
+    cpu_start = time.process_time()
+    try:
+        turn = take_turn(request_state(request), request["message"], request.get("time_left"))
+    except Exception as exc:
+        return protocol.error(repr(exc), request["game"])
+    stats = {"cpu": time.process_time() - cpu_start, "max_rss_kb": peak_memory_kb()}
+    return protocol.turn_reply(request["game"], turn, stats)
+
+
+class Games(object):
+    """Bot instances' turn functions by game id, for one bot name."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.bots = {}
+
+    def handle(self, message: dict) -> dict:
+        """Handles a message from the engine, returns the reply to send or None."""
+        if message["type"] == "start":
+            self.bots[message["game"]] = turn_function(new_game(self.name, message["player"], message.get("seed")))
+        elif message["type"] == "end":
+            self.bots.pop(message["game"], None)
+        elif message["type"] == "turn":
+            take_turn = self.bots.get(message["game"])
+            if take_turn is None:
+                # no start seen: play the side to move
+                take_turn = self.bots[message["game"]] = turn_function(
+                    new_game(self.name, request_state(message)["current_player"]))
+            return answer(take_turn, message)
+        return None
+
+
+def serve(bot: str, stdin, stdout) -> type(None):
+    """Answers requests from stdin until it closes."""
+    games = Games(bot)
+    while True:
+        message = read_message_from(stdin)
+        if message is None:
+            break
+        reply = games.handle(message)
+        if reply is not None:
+            write_message_to(stdout, reply)
+
+
+def main(argv: list) -> int:
+    if len(argv) != 1:
+        print(__doc__, file=sys.stderr)
+        return 2
+    stdout = sys.stdout.buffer
+    # keep bot prints out of the protocol
+    sys.stdout = sys.stderr
+    serve(argv[0], sys.stdin.buffer, stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
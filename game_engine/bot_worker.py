@@ -0,0 +1,175 @@
+"""Running bots under time controls, with resource accounting.
+
+A BotWorker runs one bot in its own process and asks it for turns over a pipe, so a bot
+that runs out of time can be stopped.  Every turn is measured: wall time (as seen by the
+engine), CPU time used by the bot, and the bot process' peak resident memory.
+
+Clock keeps per-player time for a game from a TimeControl: an optional limit per move,
+an optional total per game, and an increment added to the total after every move.
+"""
+
+import multiprocessing
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows; peak memory is reported as None there
+    resource = None
+
+from bot_api import (
+    new_game,
+    turn_function,
+)
+
+
+class BotTimeout(Exception):
+    """The bot did not answer within its time."""
+
+
+class BotError(Exception):
+    """The bot raised an exception or its process died."""
+
+
+def peak_memory_kb() -> int:
+    """Peak resident memory of this process in KiB, or None where unknown."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def timed_call(function, *args) -> (object, dict):
+    """Calls function(*args) in this process, returns (result, stats).
+    stats: {"wall": seconds, "cpu": seconds of this thread, "max_rss_kb": peak memory of this process}
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    result = function(*args)
+    stats = {
+        "wall": time.perf_counter() - wall_start,
+        "cpu": time.thread_time() - cpu_start,
+        "max_rss_kb": peak_memory_kb()
+    }
+    return result, stats
+
+
+##################
+# Worker process
+##################
+
+
+def _serve(bot_name: str, player_id: int, seed: int, conn) -> type(None):
+    """Worker process loop: receives (game, message, time_left), answers ("ok", turn, stats)
+    or ("error", message, stats), until it receives None."""
+    take_turn = turn_function(new_game(bot_name, player_id, seed))
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        game, message, time_left = request
+        cpu_start = time.process_time()
+        try:
+            turn = take_turn(game, message, time_left)
+            reply = ["ok", turn]
+        except Exception as exc:
+            reply = ["error", repr(exc)]
+        reply.append({"cpu": time.process_time() - cpu_start, "max_rss_kb": peak_memory_kb()})
+        conn.send(tuple(reply))
+    conn.close()
+
+
+class BotWorker(object):
+    """One bot, in its own process, for the length of a game."""
+
+    def __init__(self, bot_name: str, player_id: int=None, seed: int=None):
+        self.bot_name = bot_name
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(bot_name, player_id, seed, child_conn),
+                                                daemon=True)
+        self._process.start()
+        child_conn.close()
+
+    def take_turn(self, game: dict, message: str, timeout: float=None) -> (list, dict):
+        """Asks the bot for a turn, returns (turn, stats) like timed_call.
+        Raises BotTimeout if it takes longer than timeout seconds (the worker is stopped),
+        or BotError if the bot raised or died."""
+        wall_start = time.perf_counter()
+        try:
+            self._conn.send((game, message, timeout))
+            if not self._conn.poll(timeout):
+                self.close(force=True)
+                raise BotTimeout("bot {} did not answer within {:.3f}s".format(self.bot_name, timeout))
+            status, value, stats = self._conn.recv()
+        except (EOFError, BrokenPipeError, ConnectionResetError) as exc:
+            raise BotError("bot {} process died: {!r}".format(self.bot_name, exc))
+        stats["wall"] = time.perf_counter() - wall_start
+        if status == "error":
+            raise BotError(value)
+        return value, stats
+
+    def close(self, force: bool=False) -> type(None):
+        if self._process.is_alive() and not force:
+            try:
+                self._conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self._process.join(1)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join(1)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+##################
+# Clocks
+##################
+
+
+class TimeControl(object):
+    """move_time: seconds allowed per move (None for no limit).
+    game_time: seconds each player has for the whole game (None for no limit).
+    increment: seconds added to a player's game time after each of their moves."""
+
+    def __init__(self, move_time: float=None, game_time: float=None, increment: float=0.0):
+        self.move_time = move_time
+        self.game_time = game_time
+        self.increment = increment
+
+    def __repr__(self):
+        return "TimeControl(move_time={}, game_time={}, increment={})".format(
+            self.move_time, self.game_time, self.increment)
+
+
+class Clock(object):
+    """Remaining time per player under a TimeControl."""
+
+    def __init__(self, time_control: TimeControl, players: list):
+        self.time_control = time_control
+        self.remaining = {player: time_control.game_time for player in players}
+
+    def budget(self, player: int) -> float:
+        """Seconds player may use on the current move, or None for no limit."""
+        limits = [limit for limit in (self.time_control.move_time, self.remaining[player]) if limit is not None]
+        if not limits:
+            return None
+        return max(0.0, min(limits))
+
+    def charge(self, player: int, seconds: float) -> type(None):
+        """Takes seconds off player's game time."""
+        if self.remaining[player] is not None:
+            self.remaining[player] -= seconds
+
+    def end_move(self, player: int) -> type(None):
+        """Adds the increment once player has completed a move."""
+        if self.remaining[player] is not None:
+            self.remaining[player] += self.time_control.increment
@@ -0,0 +1,274 @@
+"""Alpha-beta search bot.
+
+Negamax alpha-beta with iterative deepening over whole turns, on the dict engine itself:
+turns come from game.generate_legal_turns, which only generates legal ones, and are
+played with apply_turn/undo (ACTION_METHODS) without being validated again, so the search
+follows the engine's rules exactly.  Schema checks are off while searching, in the
+searching thread only (see validation.validation_level).  A crowded position can have
+tens of thousands of sacrifice turns, so only the first SACRIFICE_LIMIT of each ship's are
+searched, and listing a node's turns checks the deadline as it goes.
+
+Turns are ordered with the transposition table's best turn first, then by action
+(captures and catastrophes before quieter turns).  The table is a fixed-size array indexed
+by the position's zobrist hash.  A slot is replaced when the new entry was searched at
+least as deep, or the old one is left from an earlier move.  Each game's AlphaBetaBot has
+its own table.
+
+MOVE_TIME is the most time a move searches for, in seconds; under a clock, a move searches
+for at most TIME_FRACTION of the time the engine gives it (see bot_api.py), leaving the
+rest for sending the state and the turn.  With BOOK set to the path of an opening book
+(see opening_book.py), turns found in the book are played without searching.  Every
+search keeps nodes per second and table hit rate in last_stats; set REPORT to True to also
+print them to stderr.
+"""
+
+import sys
+import time
+
+from game import (
+    GAMESTATE,
+    NO_OWNER,
+    apply_turn,
+    following_player,
+    generate_legal_turns,
+    undo,
+)
+import opening_book
+from state_view import (
+    thaw,
+)
+from validation import (
+    OFF,
+    validation_level,
+)
+
+
+MOVE_TIME = 1.0
+TIME_FRACTION = 0.5
+BOOK = None
+MAX_DEPTH = 8
+# sacrifice turns searched per sacrificed ship (see game.generate_legal_turns)
+SACRIFICE_LIMIT = 64
+CHECK_EVERY = 64
+TT_SIZE = 1 << 16
+REPORT = False
+
+WIN = 100000
+EXACT, LOWER, UPPER = range(3)
+ACTION_ORDER = {"attack": 0, "catastrophe": 1, "sacrifice": 2, "construct": 3, "trade": 4, "move": 5, "setup": 6}
+
+# stats of the last search: {"depth", "nodes", "seconds", "nodes_per_second", "tt_probes", "tt_hits", "tt_hit_rate"}
+last_stats = {}
+
+
+class _Timeout(Exception):
+    pass
+
+
+class TranspositionTable(object):
+    """Fixed number of slots; each holds (hash, depth, value, flag, best turn, generation)."""
+
+    def __init__(self, size: int=TT_SIZE):
+        self.size = size
+        self.slots = [None] * size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self) -> type(None):
+        self.generation += 1
+        self.probes = 0
+        self.hits = 0
+
+    def get(self, key: int):
+        self.probes += 1
+        entry = self.slots[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def put(self, key: int, depth: int, value: float, flag: int, best_turn: list) -> type(None):
+        index = key % self.size
+        old = self.slots[index]
+        if old is None or old[0] == key or depth >= old[1] or old[5] != self.generation:
+            self.slots[index] = (key, depth, value, flag, best_turn, self.generation)
+
+
+def _losers(game: GAMESTATE) -> list:
+    """Same rule as main.check_player_lost, without the schema check."""
+    return [player for player in game["players"]
+            if game["homeworlds"].get(player) is None or
+            player not in game["systems"][game["homeworlds"][player]]["counts"]["owners"]]
+
+
+def end_value(player: int, losers: list, players: list, ply: int) -> float:
+    """Score for player of a turn ply plies into the search that ended the game; ply makes
+    quicker wins score higher.  Everyone losing at once (a catastrophe at both homeworlds,
+    say) is a draw, as the engine scores it."""
+    if player not in losers:
+        return WIN - ply
+    if len(losers) < len(players):
+        return -(WIN - ply)
+    return 0
+
+
+def evaluate(game: GAMESTATE, player: int) -> float:
+    """Static score of game for player: ship sizes, ships at home, colors (abilities)
+    held and how varied and how safe from catastrophes homeworlds are, own minus
+    everyone else's."""
+    score = 0.0
+    for system in game["systems"].values():
+        home = system["star"]["owner"]
+        if home != NO_OWNER:
+            counts = system["counts"]
+            value = 0.5 * (len(counts["colors"]) + len(counts["star_sizes"]))
+            # one piece away from a catastrophe at home
+            value -= 2 * sum(1 for count in counts["colors"].values() if count >= 3)
+            score += value if home == player else -value
+        for ship in system["ships"]:
+            value = ship["piece"]["size"]
+            if ship["owner"] == home:
+                # defending a homeworld
+                value += 1
+            score += value if ship["owner"] == player else -value
+        for owner, _ in system["counts"]["owner_colors"]:
+            score += 0.5 if owner == player else -0.5
+    return score
+
+
+def _ordered(turns: list, best_turn: list) -> list:
+    turns.sort(key=lambda turn: ACTION_ORDER[turn[0]] if turn else len(ACTION_ORDER))
+    if best_turn is not None:
+        for index, turn in enumerate(turns):
+            if turn == best_turn:
+                turns.insert(0, turns.pop(index))
+                break
+    return turns
+
+
+class _Search(object):
+
+    def __init__(self, game: GAMESTATE, deadline: float, table: TranspositionTable):
+        self.game = game
+        self.deadline = deadline
+        self.table = table
+        self.nodes = 0
+        self.setup_done = all(player in game["homeworlds"] for player in game["players"])
+
+    def negamax(self, depth: int, alpha: float, beta: float, ply: int, setup_done: bool) -> (float, list):
+        game = self.game
+        self.nodes += 1
+        if time.perf_counter() > self.deadline:
+            raise _Timeout()
+
+        player = game["current_player"]
+        if depth == 0:
+            return evaluate(game, player), None
+
+        key = game["hash"]
+        entry = self.table.get(key)
+        best_turn = None
+        if entry is not None:
+            _, entry_depth, value, flag, best_turn, _ = entry
+            if entry_depth >= depth and ply > 0:
+                if flag == EXACT or (flag == LOWER and value >= beta) or (flag == UPPER and value <= alpha):
+                    return value, best_turn
+
+        turns = []
+        for turn in generate_legal_turns(game, SACRIFICE_LIMIT):
+            turns.append(turn)
+            # a crowded position has thousands of turns; don't overrun the deadline listing them
+            if not len(turns) % CHECK_EVERY and time.perf_counter() > self.deadline:
+                raise _Timeout()
+        if not turns:
+            # pass
+            turns = [[]]
+        original_alpha = alpha
+        best_value = -WIN * 2
+        best = None
+        for turn in _ordered(turns, best_turn):
+            record = apply_turn(game, turn, following_player(game))
+            try:
+                child_setup_done = setup_done or all(other in game["homeworlds"] for other in game["players"])
+                losers = _losers(game) if setup_done else []
+                if losers:
+                    value = end_value(player, losers, game["players"], ply)
+                else:
+                    value = -self.negamax(depth - 1, -beta, -alpha, ply + 1, child_setup_done)[0]
+            finally:
+                undo(game, record)
+            if value > best_value:
+                best_value = value
+                best = turn
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            flag = UPPER
+        elif best_value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.put(key, depth, best_value, flag, best)
+        return best_value, best
+
+
+def search(game: GAMESTATE, move_time: float=MOVE_TIME, max_depth: int=MAX_DEPTH,
+           table: TranspositionTable=None) -> list:
+    """Returns the best turn found by iterative deepening within move_time seconds.
+    game is searched in place and restored before returning."""
+    table = table or TranspositionTable()
+    table.new_search()
+    start = time.perf_counter()
+    search_state = _Search(game, start + move_time, table)
+    best_turn = None
+    depth_done = 0
+    with validation_level(OFF):
+        for depth in range(1, max_depth + 1):
+            try:
+                _, turn = search_state.negamax(depth, -WIN * 2, WIN * 2, 0, search_state.setup_done)
+            except _Timeout:
+                break
+            best_turn = turn
+            depth_done = depth
+
+    seconds = time.perf_counter() - start
+    last_stats.clear()
+    last_stats.update({"depth": depth_done, "nodes": search_state.nodes, "seconds": seconds,
+                       "nodes_per_second": search_state.nodes / seconds if seconds else 0.0,
+                       "tt_probes": table.probes, "tt_hits": table.hits,
+                       "tt_hit_rate": table.hits / table.probes if table.probes else 0.0})
+    if REPORT:
+        print("alphabeta: depth {depth}, {nodes} nodes in {seconds:.2f}s ({nodes_per_second:.0f}/s), "
+              "tt hit rate {tt_hit_rate:.1%}".format(**last_stats), file=sys.stderr)
+
+    if best_turn is None:
+        # not even depth 1 finished in time
+        best_turn = next(generate_legal_turns(game), [])
+    return best_turn
+
+
+class AlphaBetaBot(object):
+    """Keeps its transposition table between moves; entries from earlier moves are the
+    first to be replaced."""
+
+    def __init__(self, player_id: int, seed: int=None):
+        self.player_id = player_id
+        self.table = TranspositionTable()
+
+    def take_turn(self, game: GAMESTATE, message: str, time_left: float=None) -> list:
+        if message:
+            raise ValueError(message)
+        if BOOK is not None:
+            turn = opening_book.open_book(BOOK).choose(game)
+            if turn is not None:
+                return turn
+        move_time = MOVE_TIME if time_left is None else min(MOVE_TIME, time_left * TIME_FRACTION)
+        # searched in place, so on a copy of the engine's (read-only) state
+        return search(thaw(game), move_time=move_time, table=self.table)
+
+
+def new_game(player_id: int, seed: int=None) -> AlphaBetaBot:
+    return AlphaBetaBot(player_id, seed)
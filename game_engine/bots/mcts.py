@@ -0,0 +1,185 @@
+"""Monte Carlo tree search bot.
+
+Searches with UCT over compact.py states: the tree expands every legal turn (but only the
+first SACRIFICE_LIMIT sacrifices of each ship, of which a crowded position has tens of
+thousands), and each iteration finishes with a random playout (compact.random_turn) of up
+to ROLLOUT_TURNS turns.  Playouts run on the compact engine with no schema checks and no history, so their
+throughput is what sets the bot's strength; every search reports playouts per second.
+
+MOVE_TIME is the most time a move searches for, in seconds; under a clock, a move searches
+for at most TIME_FRACTION of the time the engine gives it (see bot_api.py), leaving the
+rest for sending the state and the turn.  With BOOK set to the path of an opening book
+(see opening_book.py), turns found in the book are played without searching.  Set REPORT
+to True to print search stats to stderr after every search.
+"""
+
+import math
+import random
+import sys
+import time
+
+import compact
+import opening_book
+from game import (
+    GAMESTATE,
+    generate_legal_turns,
+)
+
+
+MOVE_TIME = 1.0
+TIME_FRACTION = 0.5
+BOOK = None
+ROLLOUT_TURNS = 80
+# sacrifice turns expanded per sacrificed ship (see compact.legal_turns)
+SACRIFICE_LIMIT = 64
+EXPLORATION = 1.4
+REPORT = False
+
+# stats of the last search: {"playouts", "seconds", "playouts_per_second", "tree_size"}
+last_stats = {}
+
+
+class Node(object):
+    __slots__ = ("parent", "turn", "mover", "children", "untried", "visits", "wins")
+
+    def __init__(self, parent, turn, mover: int):
+        self.parent = parent
+        self.turn = turn
+        # player who played turn to reach this node
+        self.mover = mover
+        self.children = []
+        self.untried = None
+        self.visits = 0
+        # from the point of view of mover
+        self.wins = 0.0
+
+    def select_child(self):
+        log_visits = math.log(self.visits)
+        return max(self.children,
+                   key=lambda child: child.wins / child.visits + EXPLORATION * math.sqrt(log_visits / child.visits))
+
+
+def _next_player(game: compact.CompactGame) -> int:
+    players = game.players
+    return players[(players.index(game.current_player) + 1) % len(players)]
+
+
+def _setup_done(game: compact.CompactGame) -> bool:
+    return all(compact.has_homeworld(game, player) for player in game.players)
+
+
+def _play(game: compact.CompactGame, turn: list, setup_done: bool):
+    """Plays turn in place and passes the turn on.  Returns (setup_done, losers)."""
+    if turn is not None:
+        compact.ACTION_METHODS[turn[0]](game, *turn[1])
+    losers = []
+    if setup_done:
+        losers = compact.losers(game)
+    elif turn is not None and turn[0] == "setup":
+        setup_done = _setup_done(game)
+    if not losers:
+        game.current_player = _next_player(game)
+    return setup_done, losers
+
+
+def _score(game: compact.CompactGame, losers: list, player: int) -> float:
+    """1 for a win, 0 for a loss, 0.5 for a draw or unfinished playout."""
+    if not losers:
+        return 0.5
+    if player in losers:
+        return 0.0
+    remaining = [other for other in game.players if other not in losers]
+    return 1.0 if len(remaining) == 1 and player in remaining else 0.5
+
+
+def search(root_game: compact.CompactGame, move_time: float=MOVE_TIME, iterations: int=None, rng=random) -> list:
+    """Returns the compact turn with the most visits after move_time seconds
+    (or after iterations playouts), or None if there is no legal turn."""
+    start = time.perf_counter()
+    deadline = start + move_time
+    root_setup_done = _setup_done(root_game)
+    root = Node(None, None, _next_player(root_game))
+    root.untried = compact.legal_turns(root_game, sacrifice_limit=SACRIFICE_LIMIT)
+    if not root.untried:
+        return None
+    if len(root.untried) == 1:
+        return root.untried[0]
+
+    playouts = 0
+    tree_size = 1
+    while (playouts < iterations) if iterations is not None else (time.perf_counter() < deadline):
+        game = root_game.copy()
+        setup_done = root_setup_done
+        losers = []
+        node = root
+
+        # selection
+        while not node.untried and node.children:
+            node = node.select_child()
+            setup_done, losers = _play(game, node.turn, setup_done)
+
+        # expansion
+        if not losers:
+            if node.untried is None:
+                node.untried = compact.legal_turns(game, sacrifice_limit=SACRIFICE_LIMIT)
+            if node.untried:
+                turn = node.untried.pop(rng.randrange(len(node.untried)))
+                mover = game.current_player
+                setup_done, losers = _play(game, turn, setup_done)
+                child = Node(node, turn, mover)
+                node.children.append(child)
+                node = child
+                tree_size += 1
+
+        # playout
+        for _ in range(ROLLOUT_TURNS):
+            if losers:
+                break
+            setup_done, losers = _play(game, compact.random_turn(game, rng), setup_done)
+
+        # backpropagation
+        while node is not None:
+            node.visits += 1
+            node.wins += _score(game, losers, node.mover)
+            node = node.parent
+        playouts += 1
+
+    seconds = time.perf_counter() - start
+    last_stats.clear()
+    last_stats.update({"playouts": playouts, "seconds": seconds,
+                       "playouts_per_second": playouts / seconds if seconds else 0.0, "tree_size": tree_size})
+    if REPORT:
+        print("mcts: {playouts} playouts in {seconds:.2f}s ({playouts_per_second:.0f}/s), "
+              "{tree_size} nodes".format(**last_stats), file=sys.stderr)
+
+    if not root.children:
+        return root.untried[0]
+    return max(root.children, key=lambda child: child.visits).turn
+
+
+class MCTSBot(object):
+
+    def __init__(self, player_id: int, seed: int=None):
+        self.player_id = player_id
+        self.rng = random.Random(seed)
+
+    def take_turn(self, game: GAMESTATE, message: str, time_left: float=None) -> list:
+        if message:
+            # shouldn't happen, search only plays legal turns; fall back to any legal turn
+            return next(generate_legal_turns(game), [])
+
+        if BOOK is not None:
+            turn = opening_book.open_book(BOOK).choose(game, rng=self.rng)
+            if turn is not None:
+                return turn
+        move_time = MOVE_TIME if time_left is None else min(MOVE_TIME, time_left * TIME_FRACTION)
+        turn = search(compact.from_gamestate(game), move_time=move_time, rng=self.rng)
+        if turn is None:
+            # no legal turn: pass
+            return []
+        action, args = turn
+        return [action, list(compact.args_to_dict(action, args))]
+
+
+def new_game(player_id: int, seed: int=None) -> MCTSBot:
+    return MCTSBot(player_id, seed)
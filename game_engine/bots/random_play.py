@@ -0,0 +1,31 @@
+import random
+
+from game import (
+    GAMESTATE,
+    generate_legal_turns,
+)
+from validation import (
+    schema,
+)
+
+
+class RandomBot(object):
+    """Plays a uniformly random legal turn, or passes if there is none."""
+
+    def __init__(self, player_id: int, seed: int=None):
+        self.player_id = player_id
+        self.rng = random.Random(seed)
+
+    @schema
+    def take_turn(self, game: GAMESTATE, message: str) -> list:
+        if message:
+            raise ValueError(message)
+
+        turns = list(generate_legal_turns(game))
+        if not turns:
+            return []
+        return self.rng.choice(turns)
+
+
+def new_game(player_id: int, seed: int=None) -> RandomBot:
+    return RandomBot(player_id, seed)
@@ -56,11 +56,10 @@ def take_turn(game: GAMESTATE, message: str) -> list:
     if message:
         raise ValueError(message)
 
-    global turn_count
+    global turn_count, ship_count, homeworld_id
     turn_count += 1
 
     if turn_count == 1:
-        global homeworld_id
         systems = [(sid, sys) for sid, sys in game["systems"].items() if sys["star"]["owner"] == game["current_player"]]
         homeworld_id = systems[0][0]
 
@@ -91,7 +90,6 @@ def take_turn(game: GAMESTATE, message: str) -> list:
                 if check_color_in_reserve(game, color)[0]:
                     if color in color_ships_at_hw:
                         move += ["construct", (homeworld_id, color)]
-                        global ship_count
                         ship_count += 1
                     else:
                         for ship in ships_at_homeworld:
@@ -0,0 +1,138 @@
+"""Canonical position keys, independent of system ids, system order and ship order.
+
+canonical_key(game) is a short bytes key that two states share exactly when they are the
+same position: same player to move, players, reserve, and the same systems with the same
+stars and ships.  System ids, game["system_count"], the order of game["systems"], ship and
+star piece order, hashes and history don't take part.  Use it to dedupe positions across
+games, or to look positions up in books and caches built from other games.
+
+Layout, one byte per item (pieces and ships as in compact.py):
+    current player, number of players, players, the 12 reserve counts,
+    then every system, in canonical order:
+        star owner, number of star pieces, sorted star pieces, number of ships, sorted ships
+Canonical order sorts systems by their own bytes.  Systems with equal bytes are identical,
+so which of them comes first doesn't matter.
+
+Turns name systems by id, so a turn stored under a canonical key has to be relabelled:
+canonical_form returns the key with an IdMap, which numbers systems 1..n in canonical
+order and translates turns both ways.  Works on GAMESTATE dicts, compact.CompactGame and
+persistent.State.
+"""
+
+import compact
+from compact import (
+    COLOR_INDEX,
+    OWNER_SHIFT,
+    CompactGame,
+)
+import persistent
+
+
+PIECE_BYTES = {(color, size): COLOR_INDEX[color] * 3 + size - 1 for color in COLOR_INDEX for size in (1, 2, 3)}
+KEY_BYTES = {key: index for index, key in enumerate(compact.PIECE_KEYS)}
+
+
+def _gamestate_systems(game: dict) -> (list, list, list):
+    ids = []
+    encoded = []
+    for system_id, system in game["systems"].items():
+        stars = sorted(PIECE_BYTES[piece["color"], piece["size"]] for piece in system["star"]["pieces"])
+        ships = sorted(ship["owner"] << OWNER_SHIFT | PIECE_BYTES[ship["piece"]["color"], ship["piece"]["size"]]
+                       for ship in system["ships"])
+        ids.append(system_id)
+        encoded.append(bytes([system["star"]["owner"], len(stars)] + stars + [len(ships)] + ships))
+    header = [game["current_player"], len(game["players"])] + list(game["players"])
+    header += [game["reserve"][key] for key in compact.PIECE_KEYS]
+    return header, ids, encoded
+
+
+def _compact_systems(game: CompactGame) -> (list, list, list):
+    ids = []
+    encoded = []
+    for system_id, system in game.systems.items():
+        stars = sorted(system.stars)
+        ships = sorted(system.ships)
+        ids.append(system_id)
+        encoded.append(bytes([system.owner, len(stars)] + stars + [len(ships)] + ships))
+    header = [game.current_player, len(game.players)] + list(game.players) + list(game.reserve)
+    return header, ids, encoded
+
+
+def _persistent_systems(state: persistent.State) -> (list, list, list):
+    ids = []
+    encoded = []
+    for system_id, system in state.systems.items():
+        stars = sorted(KEY_BYTES[key] for key in system.stars)
+        ships = sorted(owner << OWNER_SHIFT | KEY_BYTES[key] for owner, key in system.ships)
+        ids.append(system_id)
+        encoded.append(bytes([system.owner, len(stars)] + stars + [len(ships)] + ships))
+    header = [state.current_player, len(state.players)] + list(state.players) + list(state.reserve)
+    return header, ids, encoded
+
+
+def _parts(game):
+    if isinstance(game, CompactGame):
+        return _compact_systems(game) + (game.system_count,)
+    if isinstance(game, persistent.State):
+        return _persistent_systems(game) + (game.system_count,)
+    return _gamestate_systems(game) + (game["system_count"],)
+
+
+def canonical_key(game) -> bytes:
+    header, _, encoded = _parts(game)[:3]
+    encoded.sort()
+    return bytes(header) + b"".join(encoded)
+
+
+def canonical_form(game) -> (bytes, "IdMap"):
+    """Returns (canonical_key(game), IdMap for game)."""
+    header, ids, encoded, system_count = _parts(game)
+    order = sorted(range(len(ids)), key=encoded.__getitem__)
+    key = bytes(header) + b"".join(encoded[index] for index in order)
+    return key, IdMap([ids[index] for index in order], system_count)
+
+
+class IdMap(object):
+    """Translates system ids between a position and its canonical form, where systems are
+    numbered 1..n in canonical order.  Systems a turn creates (moves to new systems)
+    get ids after system_count in the position and after n in the canonical form, in the
+    order they are created, so turns that create and then use a system translate too."""
+
+    def __init__(self, order: list, system_count: int):
+        self.to_ids = {system_id: index + 1 for index, system_id in enumerate(order)}
+        self.from_ids = {index + 1: system_id for index, system_id in enumerate(order)}
+        # position id - canonical id, for systems created after the position
+        self.offset = system_count - len(order)
+
+    def to_canonical(self, system_id: int) -> int:
+        canonical_id = self.to_ids.get(system_id)
+        return canonical_id if canonical_id is not None else system_id - self.offset
+
+    def from_canonical(self, canonical_id: int) -> int:
+        system_id = self.from_ids.get(canonical_id)
+        return system_id if system_id is not None else canonical_id + self.offset
+
+    def turn_to_canonical(self, turn: list) -> list:
+        return _relabel_turn(turn, self.to_canonical)
+
+    def turn_from_canonical(self, turn: list) -> list:
+        return _relabel_turn(turn, self.from_canonical)
+
+
+def _relabel_args(action: str, args, convert) -> list:
+    args = list(args)
+    if action == "setup":
+        return args
+    args[0] = convert(args[0])
+    if action == "move" and isinstance(args[2], int):
+        args[2] = convert(args[2])
+    elif action == "sacrifice":
+        args[2] = [[sub_action, _relabel_args(sub_action, sub_args, convert)] for sub_action, sub_args in args[2]]
+    return args
+
+
+def _relabel_turn(turn: list, convert) -> list:
+    relabelled = []
+    for index in range(0, len(turn), 2):
+        relabelled += [turn[index], _relabel_args(turn[index], turn[index + 1], convert)]
+    return relabelled
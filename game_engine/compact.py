@@ -0,0 +1,570 @@
+"""Compact, array-backed game state.
+
+Pieces are small ints (color index * 3 + size - 1), so the reserve is a 12 byte bytearray
+indexed by piece, stars are lists of pieces and ships are pieces packed together with their
+owner (owner << 4 | piece).  Systems are __slots__ objects.
+
+game.py still runs on GAMESTATE dicts: this is not its core, but a second implementation
+of the rules for code that needs speed over schema checks (bots/mcts.py playouts,
+canonical.py, training_data.py).  The action functions here follow the same rules as
+game.py's ACTION_METHODS, but take compact arguments and do no schema checks.  Like
+game.py's, they assume the action has already been validated.  tests/test_compact_parity.py
+plays both engines side by side to keep their rules, turn generation and states in step;
+a rules change goes into both.
+
+from_gamestate/to_gamestate convert to and from GAMESTATE dicts, so bots written against
+GAMESTATE (see bots/simple_test.py) can be shown a dict version of a compact game, and
+apply_turn runs their dict-shaped turns against it.
+"""
+
+from game import (
+    COLORS_BY_KEY,
+    GAMESTATE,
+    NO_OWNER,
+    History,
+    rebuild_indexes,
+)
+
+
+# Same order as the keys of RESERVE, so piece ids follow the reserve's layout.
+COLOR_ORDER = COLORS_BY_KEY
+COLOR_INDEX = {color: index for index, color in enumerate(COLOR_ORDER)}
+GREEN, BLUE, YELLOW, RED = range(4)
+
+PIECE_COUNT = 12
+PIECE_KEYS = tuple(color[0] + str(size) for color in COLOR_ORDER for size in (1, 2, 3))
+OWNER_SHIFT = 4
+PIECE_MASK = (1 << OWNER_SHIFT) - 1
+
+
+def piece_id(color: int, size: int) -> int:
+    return color * 3 + size - 1
+
+
+def piece_color(piece: int) -> int:
+    return piece // 3
+
+
+def piece_size(piece: int) -> int:
+    return piece % 3 + 1
+
+
+def ship_id(owner: int, piece: int) -> int:
+    return owner << OWNER_SHIFT | piece
+
+
+def ship_owner(ship: int) -> int:
+    return ship >> OWNER_SHIFT
+
+
+def ship_piece(ship: int) -> int:
+    return ship & PIECE_MASK
+
+
+def new_system(piece: int) -> int:
+    """Move target for a new system with the given star.
+    Existing system ids are positive, so new systems are encoded as ~piece (always negative)."""
+    return ~piece
+
+
+##################
+# State
+##################
+
+
+class System:
+    __slots__ = ("owner", "stars", "ships")
+
+    def __init__(self, owner: int, stars: list, ships: list):
+        self.owner = owner
+        self.stars = stars
+        self.ships = ships
+
+    def copy(self):
+        return System(self.owner, self.stars[:], self.ships[:])
+
+    def __eq__(self, other):
+        return (isinstance(other, System) and self.owner == other.owner and
+                self.stars == other.stars and self.ships == other.ships)
+
+    def __repr__(self):
+        return "System(owner={}, stars={}, ships={})".format(self.owner, self.stars, self.ships)
+
+
+class CompactGame:
+    __slots__ = ("reserve", "systems", "players", "current_player", "system_count", "owner_count")
+
+    def __init__(self, reserve: bytearray, systems: dict, players: tuple, current_player: int,
+                 system_count: int, owner_count: int):
+        self.reserve = reserve
+        self.systems = systems
+        self.players = players
+        self.current_player = current_player
+        self.system_count = system_count
+        self.owner_count = owner_count
+
+    def copy(self):
+        """Independent copy; much cheaper than deepcopying a GAMESTATE."""
+        return CompactGame(self.reserve[:],
+                           {system_id: system.copy() for system_id, system in self.systems.items()},
+                           self.players,
+                           self.current_player,
+                           self.system_count,
+                           self.owner_count)
+
+    def __eq__(self, other):
+        return (isinstance(other, CompactGame) and self.reserve == other.reserve and
+                self.systems == other.systems and self.players == other.players and
+                self.current_player == other.current_player and self.system_count == other.system_count and
+                self.owner_count == other.owner_count)
+
+
+def new_game(players: tuple=(1, 2), current_player: int=1, pieces_per_type: int=3) -> CompactGame:
+    return CompactGame(bytearray([pieces_per_type] * PIECE_COUNT), {}, tuple(players), current_player,
+                       0, len(players))
+
+
+##################
+# Action methods
+# Same rules as game.py, compact arguments.  All assume validation has already happened.
+##################
+
+
+def construct(game: CompactGame, system_id: int, color: int) -> CompactGame:
+    """Build a ship of smallest size of color in system."""
+    reserve = game.reserve
+    base = color * 3
+    for piece in range(base, base + 3):
+        if reserve[piece]:
+            reserve[piece] -= 1
+            game.systems[system_id].ships.append(game.current_player << OWNER_SHIFT | piece)
+            break
+    return game
+
+
+def move(game: CompactGame, from_system: int, ship: int, to_system: int) -> CompactGame:
+    """Moves ship from from_system to to_system (an existing id, or new_system(piece))."""
+    _remove_ship(game, from_system, ship)
+
+    if to_system < 0:
+        piece = ~to_system
+        game.reserve[piece] -= 1
+        game.system_count += 1
+        game.systems[game.system_count] = System(NO_OWNER, [piece], [ship])
+    else:
+        game.systems[to_system].ships.append(ship)
+    return game
+
+
+def trade(game: CompactGame, system_id: int, ship: int, color: int) -> CompactGame:
+    """Destroys ship and creates a new ship of the same size, but specified color."""
+    ships = game.systems[system_id].ships
+    ships.remove(ship)
+    piece = ship & PIECE_MASK
+    new_piece = color * 3 + piece % 3
+    game.reserve[piece] += 1
+    game.reserve[new_piece] -= 1
+    ships.append(game.current_player << OWNER_SHIFT | new_piece)
+    return game
+
+
+def attack(game: CompactGame, system_id: int, ship: int) -> CompactGame:
+    """Changes the owner of ship to be the current player."""
+    ships = game.systems[system_id].ships
+    ships[ships.index(ship)] = game.current_player << OWNER_SHIFT | ship & PIECE_MASK
+    return game
+
+
+def sacrifice(game: CompactGame, system_id: int, ship: int, subsequent_actions: list) -> CompactGame:
+    """subsequent_actions is a list of (action, args) with compact args."""
+    game.reserve[ship & PIECE_MASK] += 1
+    _remove_ship(game, system_id, ship)
+
+    for action, args in subsequent_actions:
+        ACTION_METHODS[action](game, *args)
+    return game
+
+
+def catastrophe(game: CompactGame, system_id: int, color: int) -> CompactGame:
+    """Destroys all stars and ships of color in system.
+    If no star remains, the whole system is destroyed."""
+    system = game.systems[system_id]
+    reserve = game.reserve
+    remaining_stars = [piece for piece in system.stars if piece // 3 != color]
+    if not remaining_stars:
+        _destroy_system(game, system_id)
+        return game
+
+    for piece in system.stars:
+        if piece // 3 == color:
+            reserve[piece] += 1
+    system.stars = remaining_stars
+
+    remaining_ships = []
+    for ship in system.ships:
+        piece = ship & PIECE_MASK
+        if piece // 3 == color:
+            reserve[piece] += 1
+        else:
+            remaining_ships.append(ship)
+    system.ships = remaining_ships
+    if not remaining_ships and system.owner == NO_OWNER:
+        _destroy_system(game, system_id)
+    return game
+
+
+def setup(game: CompactGame, star_pieces: list, ship_piece: int) -> CompactGame:
+    """Establish a homeworld for the current player."""
+    for piece in star_pieces:
+        game.reserve[piece] -= 1
+    game.reserve[ship_piece] -= 1
+    game.system_count += 1
+    game.systems[game.system_count] = System(game.current_player, list(star_pieces),
+                                             [game.current_player << OWNER_SHIFT | ship_piece])
+    return game
+
+
+ACTION_METHODS = {
+    "construct": construct,
+    "move": move,
+    "attack": attack,
+    "trade": trade,
+    "catastrophe": catastrophe,
+    "sacrifice": sacrifice,
+    "setup": setup
+}
+
+
+def _remove_ship(game: CompactGame, system_id: int, ship: int):
+    """Removes one ship, returning an abandoned neutral system to the reserve."""
+    system = game.systems[system_id]
+    system.ships.remove(ship)
+    if not system.ships and system.owner == NO_OWNER:
+        _destroy_system(game, system_id)
+
+
+def _destroy_system(game: CompactGame, system_id: int):
+    system = game.systems.pop(system_id)
+    reserve = game.reserve
+    for piece in system.stars:
+        reserve[piece] += 1
+    for ship in system.ships:
+        reserve[ship & PIECE_MASK] += 1
+
+
+##################
+# Turn generation
+# Compact counterpart of game.generate_legal_turns, for searches and rollouts.
+##################
+
+COLOR_ACTIONS = {GREEN: "construct", BLUE: "trade", YELLOW: "move", RED: "attack"}
+
+
+class _Position:
+    """Per-system facts turn generation needs, computed in one pass over the game."""
+    __slots__ = ("player", "colors", "star_sizes", "own", "enemy", "color_counts", "reserve_pieces")
+
+    def __init__(self, game: CompactGame):
+        player = game.current_player
+        self.player = player
+        self.colors = {}
+        self.star_sizes = {}
+        # system id -> distinct pieces of the current player's ships
+        self.own = {}
+        # system id -> distinct ships of other players
+        self.enemy = {}
+        self.color_counts = {}
+        for system_id, system in game.systems.items():
+            counts = [0, 0, 0, 0]
+            own = []
+            enemy = []
+            for ship in system.ships:
+                piece = ship & PIECE_MASK
+                counts[piece // 3] += 1
+                if ship >> OWNER_SHIFT == player:
+                    if piece not in own:
+                        own.append(piece)
+                elif ship not in enemy:
+                    enemy.append(ship)
+            for piece in system.stars:
+                counts[piece // 3] += 1
+            self.colors[system_id] = {color for color in range(4) if counts[color]}
+            self.star_sizes[system_id] = {piece % 3 for piece in system.stars}
+            self.own[system_id] = own
+            self.enemy[system_id] = enemy
+            self.color_counts[system_id] = counts
+        self.reserve_pieces = [piece for piece in range(PIECE_COUNT) if game.reserve[piece]]
+
+
+def _construct_args(game, pos, sacrifice):
+    for system_id, own in pos.own.items():
+        if not own or not (sacrifice or GREEN in pos.colors[system_id]):
+            continue
+        own_colors = []
+        for piece in own:
+            if piece // 3 not in own_colors:
+                own_colors.append(piece // 3)
+        for color in own_colors:
+            if any(piece // 3 == color for piece in pos.reserve_pieces):
+                yield (system_id, color)
+
+
+def _move_args(game, pos, sacrifice):
+    owner = pos.player << OWNER_SHIFT
+    for from_id, own in pos.own.items():
+        if not own or not (sacrifice or YELLOW in pos.colors[from_id]):
+            continue
+        from_sizes = pos.star_sizes[from_id]
+        targets = [to_id for to_id, sizes in pos.star_sizes.items()
+                   if to_id != from_id and not from_sizes & sizes]
+        targets.extend(~piece for piece in pos.reserve_pieces if piece % 3 not in from_sizes)
+        for piece in own:
+            for to_id in targets:
+                yield (from_id, owner | piece, to_id)
+
+
+def _trade_args(game, pos, sacrifice):
+    owner = pos.player << OWNER_SHIFT
+    for system_id, own in pos.own.items():
+        if not own or not (sacrifice or BLUE in pos.colors[system_id]):
+            continue
+        for piece in own:
+            for new_piece in pos.reserve_pieces:
+                if new_piece % 3 == piece % 3 and new_piece != piece:
+                    yield (system_id, owner | piece, new_piece // 3)
+
+
+def _attack_args(game, pos, sacrifice):
+    for system_id, enemy in pos.enemy.items():
+        own = pos.own[system_id]
+        if not enemy or not own or not (sacrifice or RED in pos.colors[system_id]):
+            continue
+        largest = max(piece % 3 for piece in own)
+        for ship in enemy:
+            if (ship & PIECE_MASK) % 3 <= largest:
+                yield (system_id, ship)
+
+
+def _catastrophe_args(game, pos, sacrifice):
+    for system_id, counts in pos.color_counts.items():
+        for color in range(4):
+            if counts[color] >= 4:
+                yield (system_id, color)
+
+
+def _setup_args(game, pos):
+    available = pos.reserve_pieces
+    reserve = game.reserve
+    for first in range(len(available)):
+        for second in range(first, len(available)):
+            stars = [available[first], available[second]]
+            for ship in available:
+                needed = stars + [ship]
+                if all(reserve[piece] >= needed.count(piece) for piece in needed):
+                    yield (stars, ship)
+
+
+_ARG_GENERATORS = {
+    "construct": _construct_args,
+    "move": _move_args,
+    "trade": _trade_args,
+    "attack": _attack_args,
+    "catastrophe": _catastrophe_args,
+}
+
+
+def _action_sequences(game, action, count, limit=None):
+    """Every list of count (action, args) pairs playable in a row after a sacrifice, or
+    only the first limit of them."""
+    if count == 0:
+        return [[]]
+    sequences = []
+    for args in list(_ARG_GENERATORS[action](game, _Position(game), True)):
+        if limit is not None and len(sequences) >= limit:
+            break
+        after = ACTION_METHODS[action](game.copy(), *args)
+        rest_limit = None if limit is None else limit - len(sequences)
+        for rest in _action_sequences(after, action, count - 1, rest_limit):
+            sequences.append([(action, args)] + rest)
+    return sequences
+
+
+def _sacrifice_candidates(game, pos):
+    """(system id, ship) for each distinct ship the current player could sacrifice."""
+    owner = pos.player << OWNER_SHIFT
+    return [(system_id, owner | piece) for system_id, own in pos.own.items() for piece in own]
+
+
+def _sacrificed(game, system_id, ship):
+    """A copy of game after the first half of a sacrifice."""
+    after = game.copy()
+    after.reserve[ship & PIECE_MASK] += 1
+    _remove_ship(after, system_id, ship)
+    return after
+
+
+def has_homeworld(game: CompactGame, player: int) -> bool:
+    return any(system.owner == player for system in game.systems.values())
+
+
+def legal_turns(game: CompactGame, sacrifices: bool=True, sacrifice_limit: int=None) -> list:
+    """Every legal turn for the current player as [action, compact args], in the same order
+    as game.generate_legal_turns.  sacrifices=False leaves out sacrifices, which are by far
+    the most numerous and most expensive to enumerate; with a sacrifice_limit, only the
+    first sacrifice_limit are listed for each ship, as in game.generate_legal_turns."""
+    pos = _Position(game)
+    if not has_homeworld(game, pos.player):
+        return [["setup", args] for args in _setup_args(game, pos)]
+
+    turns = []
+    for action in ("construct", "move", "trade", "attack", "catastrophe"):
+        turns.extend([action, args] for args in _ARG_GENERATORS[action](game, pos, False))
+    if sacrifices:
+        for system_id, ship in _sacrifice_candidates(game, pos):
+            piece = ship & PIECE_MASK
+            after = _sacrificed(game, system_id, ship)
+            for actions in _action_sequences(after, COLOR_ACTIONS[piece // 3], piece % 3 + 1, sacrifice_limit):
+                turns.append(["sacrifice", (system_id, ship, actions)])
+    return turns
+
+
+def random_turn(game: CompactGame, rng) -> list:
+    """A random legal turn, cheaply: each non-sacrifice turn and each sacrificeable ship is
+    equally likely to be picked, and a sacrifice's actions are then picked one at a time.
+    Returns None if the current player has no legal turn."""
+    turns = legal_turns(game, sacrifices=False)
+    pos = _Position(game)
+    candidates = _sacrifice_candidates(game, pos) if turns and turns[0][0] != "setup" else []
+    while turns or candidates:
+        pick = rng.randrange(len(turns) + len(candidates))
+        if pick < len(turns):
+            return turns[pick]
+        system_id, ship = candidates.pop(pick - len(turns))
+        piece = ship & PIECE_MASK
+        action = COLOR_ACTIONS[piece // 3]
+        after = _sacrificed(game, system_id, ship)
+        actions = []
+        for _ in range(piece % 3 + 1):
+            options = list(_ARG_GENERATORS[action](after, _Position(after), True))
+            if not options:
+                break
+            args = rng.choice(options)
+            ACTION_METHODS[action](after, *args)
+            actions.append((action, args))
+        else:
+            return ["sacrifice", (system_id, ship, actions)]
+    return None
+
+
+def losers(game: CompactGame) -> list:
+    """Players with no ship of their own at their homeworld (or no homeworld).
+    Only meaningful once every player has set up."""
+    holding = set()
+    for system in game.systems.values():
+        if system.owner != NO_OWNER:
+            owner = system.owner
+            if any(ship >> OWNER_SHIFT == owner for ship in system.ships):
+                holding.add(owner)
+    return [player for player in game.players if player not in holding]
+
+
+##################
+# GAMESTATE adapter
+##################
+
+
+def piece_from_dict(piece: dict) -> int:
+    return COLOR_INDEX[piece["color"]] * 3 + piece["size"] - 1
+
+
+def piece_to_dict(piece: int) -> dict:
+    return {"color": COLOR_ORDER[piece // 3], "size": piece % 3 + 1}
+
+
+def ship_from_dict(ship: dict) -> int:
+    return ship["owner"] << OWNER_SHIFT | piece_from_dict(ship["piece"])
+
+
+def ship_to_dict(ship: int) -> dict:
+    return {"owner": ship >> OWNER_SHIFT, "piece": piece_to_dict(ship & PIECE_MASK)}
+
+
+def from_gamestate(game: GAMESTATE) -> CompactGame:
+    """Compact copy of a GAMESTATE.  History is not carried over."""
+    reserve = bytearray(game["reserve"][key] for key in PIECE_KEYS)
+    systems = {}
+    for system_id, system in game["systems"].items():
+        systems[system_id] = System(system["star"]["owner"],
+                                    [piece_from_dict(piece) for piece in system["star"]["pieces"]],
+                                    [ship_from_dict(ship) for ship in system["ships"]])
+    return CompactGame(reserve, systems, tuple(game["players"]), game["current_player"],
+                       game["system_count"], game["owner_count"])
+
+
+def to_gamestate(game: CompactGame, history: list=None) -> GAMESTATE:
+    """GAMESTATE dict for a compact game, for bots and code written against GAMESTATE."""
+    systems = {}
+    for system_id, system in game.systems.items():
+        systems[system_id] = {
+            "star": {"owner": system.owner, "pieces": [piece_to_dict(piece) for piece in system.stars]},
+            "ships": [ship_to_dict(ship) for ship in system.ships]
+        }
+    return rebuild_indexes({
+        "reserve": dict(zip(PIECE_KEYS, game.reserve)),
+        "systems": systems,
+        "players": list(game.players),
+        "current_player": game.current_player,
+        "history": History(history or ()),
+        "system_count": game.system_count,
+        "owner_count": game.owner_count
+    })
+
+
+def args_from_dict(action: str, args) -> tuple:
+    """Converts dict-shaped action args (as bots send them) to compact args."""
+    if action == "construct" or action == "catastrophe":
+        return (args[0], COLOR_INDEX[args[1]])
+    if action == "move":
+        to_system = args[2]
+        if isinstance(to_system, dict):
+            to_system = new_system(piece_from_dict(to_system["new_piece"]))
+        return (args[0], ship_from_dict(args[1]), to_system)
+    if action == "trade":
+        return (args[0], ship_from_dict(args[1]), COLOR_INDEX[args[2]])
+    if action == "attack":
+        return (args[0], ship_from_dict(args[1]))
+    if action == "sacrifice":
+        return (args[0], ship_from_dict(args[1]),
+                [(sub_action, args_from_dict(sub_action, sub_args)) for sub_action, sub_args in args[2]])
+    if action == "setup":
+        return ([piece_from_dict(piece) for piece in args[0]], piece_from_dict(args[1]))
+    raise ValueError("Unknown action {!r}.".format(action))
+
+
+def args_to_dict(action: str, args) -> tuple:
+    """Converts compact action args to the dict shape bots send."""
+    if action == "construct" or action == "catastrophe":
+        return (args[0], COLOR_ORDER[args[1]])
+    if action == "move":
+        to_system = args[2]
+        if to_system < 0:
+            to_system = {"new_piece": piece_to_dict(~to_system)}
+        return (args[0], ship_to_dict(args[1]), to_system)
+    if action == "trade":
+        return (args[0], ship_to_dict(args[1]), COLOR_ORDER[args[2]])
+    if action == "attack":
+        return (args[0], ship_to_dict(args[1]))
+    if action == "sacrifice":
+        return (args[0], ship_to_dict(args[1]),
+                [(sub_action, list(args_to_dict(sub_action, sub_args))) for sub_action, sub_args in args[2]])
+    if action == "setup":
+        return ([piece_to_dict(piece) for piece in args[0]], piece_to_dict(args[1]))
+    raise ValueError("Unknown action {!r}.".format(action))
+
+
+def apply_turn(game: CompactGame, turn: list) -> CompactGame:
+    """Applies a dict-shaped bot turn (["action", args, ...]) without validation."""
+    for index in range(0, len(turn), 2):
+        action = turn[index]
+        ACTION_METHODS[action](game, *args_from_dict(action, turn[index + 1]))
+    return game
@@ -8,7 +8,6 @@ from functools import (
 )
 
 from py_types.runtime import (
-    schema,
     SchemaOr,
     typecheck,
 )
@@ -18,42 +17,66 @@ from py_types.type_defs import (
     TypedDict,
 )
 
+from state_view import (
+    is_view,
+    thaw,
+)
+import system_counts
+import zobrist
+from validation import (
+    FULL,
+    schema,
+    check_schema,
+    get_validation_level,
+)
+
 ##################
 # Types / Schemas
 ##################
 
 #TODO: move owner out of star and into system
 
+COLORS = ("red", "green", "blue", "yellow")
+# order colors appear in RESERVE's keys
+COLORS_BY_KEY = ("green", "blue", "yellow", "red")
+SIZES = (1, 2, 3)
+ACTIONS = ("construct",
+           "move",
+           "trade",
+           "attack",
+           "sacrifice",
+           "catastrophe")
+
+# allowed_values lets compiled schemas (see validation.py) check these by membership.
+
 @typecheck
 def check_color(color: str) -> bool:
-    return color in ("red", "green", "blue", "yellow")
+    return color in COLORS
 
 class Color(metaclass=ValidatedType):
     type_members = [str]
     validators = [check_color]
+    allowed_values = COLORS
 
 
 @typecheck
 def check_size(size: int) -> bool:
-    return size in (1, 2, 3)
+    return size in SIZES
 
 class Size(metaclass=ValidatedType):
     type_members = [int]
     validators = [check_size]
+    allowed_values = SIZES
 
 
 @typecheck
 def check_action(action: str) -> bool:
-    return action in ("construct",
-                      "move",
-                      "trade",
-                      "attack",
-                      "sacrifice",
-                      "catastrophe")
+    return action in ACTIONS
 
 class Action(metaclass=ValidatedType):
     type_members = [str]
     validators = [check_action]
+    allowed_values = ACTIONS
 
 
 OwnerId = int
@@ -80,7 +103,11 @@ STAR = {
 }
 SYSTEM = {
     "star": STAR,
-    "ships": [SHIP]
+    "ships": [SHIP],
+    # see zobrist.py
+    "hash": int,
+    # see system_counts.py
+    "counts": dict
 }
 # type_key, quantity
 RESERVE = {
@@ -98,8 +125,85 @@ RESERVE = {
     "r3": int
 }
 
-ACTION_ARGS = [SchemaOr(int, str, dict)]
-EVENT = [str, [SchemaOr(str, (ACTION_ARGS))]]
+# lists cover setup's star pieces and sacrifice's subsequent actions
+ACTION_ARGS = [SchemaOr(int, str, dict, list)]
+# ["p1", turn] for turns, ["END", message] when the game ends.
+# (py_types, which bots use, only understands SchemaOr at the top of a list member.)
+EVENT = SchemaOr([str, [SchemaOr(str, ACTION_ARGS)]], [str, str])
+
+
+class History(list):
+    """Append-only list of EVENTs.
+
+    Remembers how many of its events have been checked against EVENT, so schema checks
+    of GAMESTATE["history"] (see validation.py) only look at events appended since the
+    last check instead of the whole game.  At the "full" validation level events are
+    checked as they are appended.  Anything other than append/extend is allowed, but
+    forgets what has been checked.
+    """
+    item_schema = EVENT
+    validated = 0
+
+    def append(self, event):
+        if get_validation_level() == FULL and self.validated == len(self):
+            check_schema(EVENT, event, name="event")
+            super().append(event)
+            self.validated = len(self)
+        else:
+            super().append(event)
+
+    def extend(self, events):
+        for event in events:
+            self.append(event)
+
+    def __iadd__(self, events):
+        self.extend(events)
+        return self
+
+    def pending_validation(self):
+        """Returns (index of the first unchecked event, unchecked events)."""
+        return self.validated, self[self.validated:]
+
+    def mark_validated(self):
+        self.validated = len(self)
+
+    # Everything below can change events that were already checked.
+
+    def __setitem__(self, index, value):
+        self.validated = 0
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        self.validated = 0
+        super().__delitem__(index)
+
+    def __imul__(self, count):
+        self.validated = 0
+        return super().__imul__(count)
+
+    def insert(self, index, event):
+        self.validated = 0
+        super().insert(index, event)
+
+    def pop(self, *args):
+        self.validated = 0
+        return super().pop(*args)
+
+    def remove(self, event):
+        self.validated = 0
+        super().remove(event)
+
+    def clear(self):
+        self.validated = 0
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self.validated = 0
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self.validated = 0
+        super().reverse()
 
 GAMESTATE = {
     "reserve": RESERVE,
@@ -107,9 +211,14 @@ GAMESTATE = {
     "systems": dict,
     "players": [OwnerId],
     "current_player": OwnerId,
+    # a History when created by the engine; plain lists are checked in full
     "history": [EVENT],
     "system_count": int,
-    "owner_count": int
+    "owner_count": int,
+    # zobrist hash of the position, kept current by the action methods
+    "hash": int,
+    # player -> id of their homeworld system, kept current by the action methods
+    "homeworlds": dict
 }
 
 CONSTRUCT_ARGS = [ExistingSystemId, Color]
@@ -123,6 +232,16 @@ SACRIFICE_ARGS = [ExistingSystemId, SHIP, [(Action, ACTION_ARGS)]]
 CATASTROPHE_ARGS = [ExistingSystemId, Color]
 SETUP_ARGS = [[PIECE], PIECE]
 
+ACTION_ARGS_SCHEMAS = {
+    "construct": CONSTRUCT_ARGS,
+    "move": MOVE_ARGS,
+    "trade": TRADE_ARGS,
+    "attack": ATTACK_ARGS,
+    "sacrifice": SACRIFICE_ARGS,
+    "catastrophe": CATASTROPHE_ARGS,
+    "setup": SETUP_ARGS
+}
+
 
 ###################
 # Utility methods
@@ -145,10 +264,9 @@ def check_player_has_ship(game: GAMESTATE, system_id: int, player_ship: SHIP) ->
     if not validate_system_id(game, system_id):
         return (False, "System id {} is not valid.".format(system_id))
 
-    ship_pieces_in_system = [ship["piece"] for ship in game["systems"][system_id]["ships"] if ship["owner"] == player_ship["owner"]]
-    for piece in ship_pieces_in_system:
-        if piece["color"] == player_ship["piece"]["color"] and piece["size"] == player_ship["piece"]["size"]:
-            return (True, "")
+    ship_key = (player_ship["owner"], player_ship["piece"]["color"], player_ship["piece"]["size"])
+    if ship_key in game["systems"][system_id]["counts"]["ships"]:
+        return (True, "")
 
     return (False, "Ship {} owned by {} not found in system.".format(player_ship, player_ship["owner"]))
 
@@ -178,16 +296,14 @@ def check_color_in_reserve(game: GAMESTATE, color: Color) -> (bool, str):
 @schema
 def get_colors_in_system(game: GAMESTATE, system: SystemId) -> [Color]:
     """Get colors in system present on any ships and any stars."""
-    all_ship_colors = [ship["piece"]["color"] for ship in game["systems"][system]["ships"]]
-    all_star_colors = [piece["color"] for piece in game["systems"][system]["star"]["pieces"]]
-    return set(all_ship_colors + all_star_colors)
+    return set(game["systems"][system]["counts"]["colors"])
 
 
 @schema
 def get_colors_in_system_for_player(game: GAMESTATE, player: OwnerId, system: SystemId) -> [Color]:
     """Get colors in system present on ships a player owns.  Does not include stars."""
-    all_colors = {ship["piece"]["color"] for ship in game["systems"][system]["ships"] if ship["owner"] == player}
-    return list(all_colors)
+    owner_colors = game["systems"][system]["counts"]["owner_colors"]
+    return [color for color in COLORS if (player, color) in owner_colors]
 
 
 @schema
@@ -238,12 +354,11 @@ def validate_construct(game: GAMESTATE, args: CONSTRUCT_ARGS, sacrifice: bool=Fa
     if not check_color_in_reserve(game, color)[0]:
         return (False, "Not enough pieces of color {} in reserve.".format(color))
 
-    colors_in_system = get_colors_in_system(game, system_id)
-    owned_colors_in_system = get_colors_in_system_for_player(game, game["current_player"], system_id)
-    if color not in owned_colors_in_system:
+    counts = game["systems"][system_id]["counts"]
+    if (game["current_player"], color) not in counts["owner_colors"]:
         return (False, "Current player does not own a ship of color {} in system {}.".format(color, system_id))
 
-    if not sacrifice and "green" not in colors_in_system:
+    if not sacrifice and "green" not in counts["colors"]:
         return (False, "There is no green ability in system {}.".format(system_id))
 
     return (True, "")
@@ -268,22 +383,19 @@ def validate_move(game: GAMESTATE, args: MOVE_ARGS, sacrifice: bool=False) -> (b
     if ship["owner"] != game["current_player"]:
         return (False, "Current player does not own given ship.")
 
-    if not check_player_has_ship(game, from_system_id, ship):
+    if not check_player_has_ship(game, from_system_id, ship)[0]:
         return (False, "Current player does not have a ship of given piece in system {}.".format(from_system_id))
 
-    from_system = game["systems"][from_system_id]
+    from_counts = game["systems"][from_system_id]["counts"]
     if isinstance(to_system_id, int):
-        to_system = game["systems"][to_system_id]
+        to_star_sizes = game["systems"][to_system_id]["counts"]["star_sizes"]
     else:
-        to_system = {"star": {"owner": 0, "pieces": [to_system_id["new_piece"]]}, "ships": []}
+        to_star_sizes = (to_system_id["new_piece"]["size"],)
 
-    from_star_sizes = {star["size"] for star in from_system["star"]["pieces"]}
-    to_star_sizes = {star["size"] for star in to_system["star"]["pieces"]}
-    if len(from_star_sizes.intersection(to_star_sizes)) > 0:
+    if any(size in from_counts["star_sizes"] for size in to_star_sizes):
         return (False, "Target system {} has a star of the same size as origin system {}.".format(to_system_id, from_system_id))
 
-    colors_in_system = get_colors_in_system(game, from_system_id)
-    if not sacrifice and "yellow" not in colors_in_system:
+    if not sacrifice and "yellow" not in from_counts["colors"]:
         return (False, "There is no yellow ability in system {}.".format(from_system_id))
 
     return (True, "")
@@ -300,15 +412,16 @@ def validate_trade(game: GAMESTATE, args: TRADE_ARGS, sacrifice: bool=False) ->
 
     if not validate_system_id(game, system_id):
         return (False, "System id {} is not valid.".format(system_id))
+    if ship["owner"] != game["current_player"]:
+        return (False, "Current player does not own given ship.")
+    if not check_player_has_ship(game, system_id, ship)[0]:
+        return (False, "Current player does not have a ship of given piece in system {}.".format(system_id))
 
     new_piece = {"color": color, "size": ship["piece"]["size"]}
     if not check_piece_in_reserve(game, new_piece):
-        print(new_piece)
-        print(game["reserve"][create_piece_key(new_piece)])
         return (False, "No pieces in reserve to trade with.")
 
-    colors_in_system = get_colors_in_system(game, system_id)
-    if not sacrifice and "blue" not in colors_in_system:
+    if not sacrifice and "blue" not in game["systems"][system_id]["counts"]["colors"]:
         return (False, "There is no blue ability in system {}.".format(system_id))
 
     return (True, "")
@@ -324,17 +437,17 @@ def validate_attack(game: GAMESTATE, args: ATTACK_ARGS, sacrifice: bool=False) -
 
     if not validate_system_id(game, system_id):
         return (False, "System id {} is not valid.".format(system_id))
-    if ship[0] == game["current_player"]:
+    if ship["owner"] == game["current_player"]:
         return (False, "Current player already owns target ship.")
+    if not check_player_has_ship(game, system_id, ship)[0]:
+        return (False, "Target ship {} not found in system {}.".format(ship, system_id))
 
+    counts = game["systems"][system_id]["counts"]
     target_size = ship["piece"]["size"]
-    player_ships = get_ships_in_system_for_player(game, game["current_player"], system_id)
-    is_larger_size = {_ship["piece"]["size"] >= target_size for _ship in player_ships}
-    if not any(list(is_larger_size)):
+    if not any((game["current_player"], size) in counts["owner_sizes"] for size in SIZES if size >= target_size):
         return (False, "Current player does not have a ship large enough to attack target ship.")
 
-    colors_in_system = get_colors_in_system(game, system_id)
-    if not sacrifice and "red" not in colors_in_system:
+    if not sacrifice and "red" not in counts["colors"]:
         return (False, "There is no red ability in system {}.".format(system_id))
 
     return (True, "")
@@ -351,7 +464,9 @@ def validate_sacrifice(game: GAMESTATE, args: SACRIFICE_ARGS) -> (bool, str):
 
     if not validate_system_id(game, system_id):
         return (False, "System id {} is not valid.".format(system_id))
-    if not check_player_has_ship(game, system_id, ship):
+    if ship["owner"] != game["current_player"]:
+        return (False, "Current player does not own given ship.")
+    if not check_player_has_ship(game, system_id, ship)[0]:
         return (False, "Current player does not have a ship of given piece in system {}.".format(system_id))
 
     valid_action_types = [COLOR_ACTIONS[ship["piece"]["color"]], "catastrophe"]
@@ -361,16 +476,24 @@ def validate_sacrifice(game: GAMESTATE, args: SACRIFICE_ARGS) -> (bool, str):
         return (False, "Number of subsequent actions does not match the size of the sacrificed ship. " +
                        "Expected: {}, Given: {}".format(available_action_count, action_count))
 
-    for action_args in subsequent_actions:
-        action, a_args = action_args
-        # tell action checks this is a sacrifice action
-        a_args += [True]
-        if action not in valid_action_types:
-            return (False, "Given action {} is not valid, expected one of {}.".format(action, valid_action_types))
-
-        action_validation = ACTION_VALIDATORS[action](a_args)
-        if not action_validation[0]:
-            return (False, "Action {} with args {} is not valid: {}".format(action, a_args, action_validation[1]))
+    # Each action is checked against the state left by the sacrifice and the actions before it.
+    # They are tried out on game itself, and taken back before returning.
+    record = _journaled(game, _sacrifice_ship, system_id, ship)
+    try:
+        for action, a_args in subsequent_actions:
+            if action not in valid_action_types:
+                return (False, "Given action {} is not valid, expected one of {}.".format(action, valid_action_types))
+
+            if action == "catastrophe":
+                action_validation = validate_catastrophe(game, a_args)
+            else:
+                # tell action checks this is a sacrifice action
+                action_validation = ACTION_VALIDATORS[action](game, a_args, sacrifice=True)
+            if not action_validation[0]:
+                return (False, "Action {} with args {} is not valid: {}".format(action, a_args, action_validation[1]))
+            record.extend(apply_action(game, action, a_args))
+    finally:
+        undo(game, record)
 
     return (True, "")
 
@@ -386,16 +509,7 @@ def validate_catastrophe(game: GAMESTATE, args: CATASTROPHE_ARGS) -> (bool, str)
     if not validate_system_id(game, system_id):
         return (False, "System id {} is not valid.".format(system_id))
 
-    def count_color(count, value):
-        if value == color:
-            return count + 1
-        else:
-            return count
-
-    ships = get_ships_in_system(game, system_id)
-    ships_of_color = reduce(count_color, [ship["piece"]["color"] for ship in ships], 0)
-    stars_of_color = reduce(count_color, [piece["color"] for piece in game["systems"][system_id]["star"]["pieces"]], 0)
-    if ships_of_color + stars_of_color < 4:
+    if color not in game["systems"][system_id]["counts"]["overpopulated"]:
         return (False, "That color is not overpopulated in system {}".format(system_id))
 
     return (True, "")
@@ -414,9 +528,8 @@ def validate_setup(game: GAMESTATE, args: SETUP_ARGS) -> (bool, str):
         if game["reserve"][key] < all_piece_keys.count(key):
             return (False, "Not enough pieces of type {} remaining to do setup.".format(key))
 
-    for _, system in game["systems"].items():
-        if system["star"]["owner"] == game["current_player"]:
-            return (False, "Current player has already completed setup.")
+    if game["current_player"] in game["homeworlds"]:
+        return (False, "Current player has already completed setup.")
 
     return (True, "")
 
@@ -432,6 +545,46 @@ ACTION_VALIDATORS = {
 }
 
 
+##################
+# Game state
+##################
+
+
+def create_game(players: [OwnerId]=(1, 2), first_player: OwnerId=1, pieces_per_type: int=3) -> GAMESTATE:
+    """Returns the state of a new game, before any setup."""
+    game = {
+        "reserve": {key: pieces_per_type for key in RESERVE},
+        "systems": {},
+        "players": list(players),
+        "current_player": first_player,
+        "history": History(),
+        "system_count": 0,
+        "owner_count": len(players)
+    }
+    return rebuild_indexes(game)
+
+
+def rebuild_indexes(game: dict) -> GAMESTATE:
+    """Computes everything the engine derives from the board and keeps current as it plays:
+    the zobrist hashes, every system's counts and the homeworld index.
+    Needed for states that weren't built by the engine's action methods."""
+    zobrist.rehash(game)
+    system_counts.recount(game)
+    game["homeworlds"] = {system["star"]["owner"]: system_id for system_id, system in game["systems"].items()
+                          if system["star"]["owner"] != NO_OWNER}
+    return game
+
+
+@schema
+def set_current_player(game: GAMESTATE, player: OwnerId) -> GAMESTATE:
+    """Hand the turn to player.  Use this rather than assigning game["current_player"],
+    so the position hash stays current."""
+    game["hash"] = (game["hash"] - zobrist.TO_MOVE_KEYS[game["current_player"]] +
+                    zobrist.TO_MOVE_KEYS[player]) & zobrist.MASK
+    game["current_player"] = player
+    return game
+
+
 ##################
 # Action methods
 # All assume validation has already happened.
@@ -445,12 +598,10 @@ def construct(game: GAMESTATE, system: SystemId, color: Color) -> GAMESTATE:
     all_size_amounts = [(key, game["reserve"][key]) for key in all_size_keys if game["reserve"][key] > 0]
 
     if all_size_amounts:
-        key, amount = all_size_amounts[0]
-        game["reserve"][key] = amount - 1
-        game["systems"][system]["ships"].append({"owner":game["current_player"],
-                                                 "piece": {"color":color,
-                                                           "size": int(key[1])}
-                                                })
+        key, _ = all_size_amounts[0]
+        piece = {"color": color, "size": int(key[1])}
+        game = _remove_piece_from_reserve(game, piece)
+        game = _add_ship(game, system, {"owner": game["current_player"], "piece": piece})
 
     return game
 
@@ -461,25 +612,16 @@ def move(game: GAMESTATE, from_system: ExistingSystemId, ship: SHIP, to_system:
     no other ships.
     Checks for whether homeworlds are destroyed are only done at the end of the turn, outside actions.
     """
-    from_ships = game["systems"][from_system]["ships"]
-    from_ships = [s for s in from_ships if s != ship]
-    game["systems"][from_system]["ships"] = from_ships
-
-    if not from_ships and game["systems"][from_system]["star"]["owner"] == NO_OWNER:
-        piece = game["systems"][from_system]["star"]["piece"]
-        piece_key = piece["color"][0] + str(piece["size"])
-        game["reserve"][piece_key] += 1
-        del game["systems"][from_system]
+    game = _remove_ship(game, from_system, ship)
+    game = _destroy_if_abandoned(game, from_system)
 
     if isinstance(to_system, dict):
         piece = to_system["new_piece"]
-        star = {"owner": NO_OWNER, "pieces": [piece]}
-        system = {"star": star, "ships": [ship]}
-        game["system_count"] += 1
-        new_id = game["system_count"]
-        game["systems"][new_id] = system
+        game = _remove_piece_from_reserve(game, piece)
+        game, new_id = _add_system(game, NO_OWNER, [piece])
+        game = _add_ship(game, new_id, ship)
     else:
-        game["systems"][to_system]["ships"].append(ship)
+        game = _add_ship(game, to_system, ship)
 
     return game
 
@@ -487,16 +629,14 @@ def move(game: GAMESTATE, from_system: ExistingSystemId, ship: SHIP, to_system:
 @schema
 def trade(game: GAMESTATE, system: SystemId, ship: SHIP, color: Color) -> GAMESTATE:
     """Destroys the given ship and creates a new ship of the same size, but specified color."""
-    sys_ships = game["systems"][system]["ships"]
-    sys_ships = [s for s in sys_ships if s != ship]
-    game["systems"][system]["ships"] = sys_ships
+    game = _remove_ship(game, system, ship)
 
     new_piece = {"size": ship["piece"]["size"], "color": color}
     game = _add_piece_to_reserve(game, ship["piece"])
     game = _remove_piece_from_reserve(game, new_piece)
 
     new_ship = {"owner": game["current_player"], "piece": new_piece}
-    sys_ships.append(new_ship)
+    game = _add_ship(game, system, new_ship)
 
     return game
 
@@ -504,17 +644,15 @@ def trade(game: GAMESTATE, system: SystemId, ship: SHIP, color: Color) -> GAMEST
 @schema
 def attack(game: GAMESTATE, system: SystemId, ship: SHIP) -> GAMESTATE:
     """Changes the owner of ship to be the current player."""
-    sys_ship = [s for s in game["systems"][system]["ships"] if s == ship]
-    sys_ship["owner"] = game["current_player"]
+    captured = {"owner": game["current_player"], "piece": ship["piece"]}
+    game = _replace_ship(game, system, ship, captured)
 
     return game
 
 
 @schema
 def sacrifice(game: GAMESTATE, system: SystemId, ship: SHIP, subsequent_actions: [(Action, ACTION_ARGS)]) -> GAMESTATE:
-    sys = game["systems"][system]
-    sys["ships"] = [sh for sh in sys["ships"] if sh != ship]
-    game = _add_piece_to_reserve(game, ship["piece"])
+    game = _sacrifice_ship(game, system, ship)
 
     for action, args in subsequent_actions:
         method = ACTION_METHODS[action]
@@ -525,33 +663,24 @@ def sacrifice(game: GAMESTATE, system: SystemId, ship: SHIP, subsequent_actions:
 
 @schema
 def catastrophe(game: GAMESTATE, system: SystemId, color: Color) -> GAMESTATE:
-    """If system has one star of the specified color, destroys all ships.
-    Otherwise, destroys all ships of the specified color."""
+    """Destroys all stars and ships of the specified color in system.
+    If no star remains, the whole system is destroyed."""
     sys = game["systems"][system]
-    remaining_stars = [p for p in sys["star"]["pieces"] if p["color"] != color]
-    if not remaining_stars:
-        for p in sys["star"]["pieces"]:
-            game = _add_piece_to_reserve(game, p)
-        for s in sys["ships"]:
-            game = _add_piece_to_reserve(game, s["piece"])
-        del game["systems"][system]
-    elif len(remaining_stars) != len(sys["star"]["pieces"]):
-        for star in sys["star"]["pieces"]:
-            if star not in remaining_stars:
-                game = _add_piece_to_reserve(game, star)
-        game["systems"][system]["star"]["pieces"] = remaining_stars
-
-        remaining_ships = [sh for sh in get_ships_in_system(game, system) if sh["piece"]["color"] != color]
-        lost_ships = [sh for sh in get_ships_in_system(game, system) if sh["piece"]["color"] == color]
-        for sh in lost_ships:
-            game = _add_piece_to_reserve(game, sh)
-        game["systems"][system]["ships"] = remaining_ships
-    else:
-        remaining_ships = [sh for sh in get_ships_in_system(game, system) if sh["piece"]["color"] != color]
-        lost_ships = [sh for sh in get_ships_in_system(game, system) if sh["piece"]["color"] == color]
-        for sh in lost_ships:
-            game = _add_piece_to_reserve(game, sh["piece"])
-        game["systems"][system]["ships"] = remaining_ships
+    lost_stars = [p for p in sys["star"]["pieces"] if p["color"] == color]
+    if len(lost_stars) == len(sys["star"]["pieces"]):
+        return _destroy_system(game, system)
+
+    if lost_stars:
+        remaining_stars = [p for p in sys["star"]["pieces"] if p["color"] != color]
+        game = _set_star_pieces(game, system, remaining_stars)
+        for star in lost_stars:
+            game = _add_piece_to_reserve(game, star)
+
+    lost_ships = [sh for sh in get_ships_in_system(game, system) if sh["piece"]["color"] == color]
+    for sh in lost_ships:
+        game = _remove_ship(game, system, sh)
+        game = _add_piece_to_reserve(game, sh["piece"])
+    game = _destroy_if_abandoned(game, system)
 
     return game
 
@@ -559,14 +688,11 @@ def catastrophe(game: GAMESTATE, system: SystemId, color: Color) -> GAMESTATE:
 @schema
 def setup(game: GAMESTATE, star_pieces: [PIECE], ship_piece: PIECE) -> GAMESTATE:
     """Takes pieces and alters gamestate to establish a homeworld for current player."""
-    star = {"owner": game["current_player"], "pieces": star_pieces}
     for piece in star_pieces:
         game = _remove_piece_from_reserve(game, piece)
-    ship = {"owner": game["current_player"], "piece": ship_piece}
     game = _remove_piece_from_reserve(game, ship_piece)
-    system = {"star": star, "ships": [ship]}
-    game["system_count"] += 1
-    game["systems"][game["system_count"]] = system
+    game, system_id = _add_system(game, game["current_player"], list(star_pieces))
+    game = _add_ship(game, system_id, {"owner": game["current_player"], "piece": ship_piece})
 
     return game
 
@@ -582,16 +708,297 @@ ACTION_METHODS = {
 }
 
 
+##################
+# Make / unmake
+# For search: apply actions in place and take them back, instead of copying the game.
+##################
+
+# A list of (primitive, args) calls that reverse an action, most recent last.
+UNDO_RECORD = list
+
+
+@schema
+def apply_action(game: GAMESTATE, action: str, args: ACTION_ARGS) -> UNDO_RECORD:
+    """Applies one action in place like ACTION_METHODS, and returns a record for undo."""
+    return _journaled(game, ACTION_METHODS[action], *args)
+
+
+def _journaled(game, function, *args):
+    """Calls function(game, *args) with an undo journal open, returns the journal."""
+    journal = []
+    outer = game.get(_JOURNAL)
+    game[_JOURNAL] = journal
+    try:
+        function(game, *args)
+    finally:
+        if outer is None:
+            del game[_JOURNAL]
+        else:
+            game[_JOURNAL] = outer
+            outer.extend(journal)
+    return journal
+
+
+@schema
+def apply_turn(game: GAMESTATE, turn: list, next_player: SchemaOr(type(None), OwnerId)=None) -> UNDO_RECORD:
+    """Applies every action in a bot turn (["action", args, ...]), then hands the turn to
+    next_player if given.  Returns one record for undo covering all of it."""
+    record = []
+    for index in range(0, len(turn), 2):
+        record.extend(apply_action(game, turn[index], turn[index + 1]))
+    if next_player is not None:
+        record.append((set_current_player, (game["current_player"],)))
+        game = set_current_player(game, next_player)
+    return record
+
+
+@schema
+def undo(game: GAMESTATE, record: UNDO_RECORD) -> GAMESTATE:
+    """Restores game to exactly what it was before the action(s) that produced record:
+    reserve, systems (including ones that were destroyed, in their place), ship order,
+    system_count and hashes."""
+    outer = game.pop(_JOURNAL, None)
+    try:
+        for inverse, args in reversed(record):
+            inverse(game, *args)
+    finally:
+        if outer is not None:
+            game[_JOURNAL] = outer
+    return game
+
+
+def following_player(game: GAMESTATE) -> OwnerId:
+    """The player after the current one, in game["players"] order."""
+    players = game["players"]
+    return players[(players.index(game["current_player"]) + 1) % len(players)]
+
+
+###################
+# Turn generation
+###################
+
+
+class _Position(object):
+    """What turn generation needs to know about a state, computed in one pass over it."""
+
+    def __init__(self, game):
+        player = game["current_player"]
+        self.player = player
+        # system id -> colors on any ship or star
+        self.colors = {}
+        # system id -> sizes of star pieces
+        self.star_sizes = {}
+        # system id -> distinct pieces of the current player's ships, as (color, size)
+        self.own_pieces = {}
+        # system id -> distinct other players' ships, as (owner, color, size)
+        self.enemy_ships = {}
+        # system id -> {color: number of ships and stars of that color}
+        self.color_counts = {}
+        for system_id, system in game["systems"].items():
+            own = []
+            enemy = []
+            for ship in system["ships"]:
+                color = ship["piece"]["color"]
+                if ship["owner"] == player:
+                    own_piece = (color, ship["piece"]["size"])
+                    if own_piece not in own:
+                        own.append(own_piece)
+                else:
+                    enemy_ship = (ship["owner"], color, ship["piece"]["size"])
+                    if enemy_ship not in enemy:
+                        enemy.append(enemy_ship)
+            counts = system["counts"]
+            # copied: turn generation applies and undoes actions while these are in use
+            self.colors[system_id] = set(counts["colors"])
+            self.star_sizes[system_id] = set(counts["star_sizes"])
+            self.own_pieces[system_id] = own
+            self.enemy_ships[system_id] = enemy
+            self.color_counts[system_id] = dict(counts["colors"])
+
+        # pieces left in the reserve, as (color, size), in reserve order
+        self.reserve_pieces = [(color, size) for color in COLORS_BY_KEY for size in SIZES
+                               if game["reserve"][color[0] + str(size)] > 0]
+        self.has_homeworld = player in game["homeworlds"]
+
+
+def _ship(owner, color, size):
+    return {"owner": owner, "piece": {"color": color, "size": size}}
+
+
+def _construct_args(game, pos, sacrifice):
+    for system_id, own in pos.own_pieces.items():
+        if not own or not (sacrifice or "green" in pos.colors[system_id]):
+            continue
+        own_colors = []
+        for color, _ in own:
+            if color not in own_colors:
+                own_colors.append(color)
+        for color in own_colors:
+            if any(piece_color == color for piece_color, _ in pos.reserve_pieces):
+                yield (system_id, color)
+
+
+def _move_args(game, pos, sacrifice):
+    for from_id, own in pos.own_pieces.items():
+        if not own or not (sacrifice or "yellow" in pos.colors[from_id]):
+            continue
+        from_sizes = pos.star_sizes[from_id]
+        targets = [to_id for to_id, sizes in pos.star_sizes.items()
+                   if to_id != from_id and not from_sizes & sizes]
+        new_stars = [(color, size) for color, size in pos.reserve_pieces if size not in from_sizes]
+        for color, size in own:
+            for to_id in targets:
+                yield (from_id, _ship(pos.player, color, size), to_id)
+            for star_color, star_size in new_stars:
+                yield (from_id, _ship(pos.player, color, size),
+                       {"new_piece": {"color": star_color, "size": star_size}})
+
+
+def _trade_args(game, pos, sacrifice):
+    for system_id, own in pos.own_pieces.items():
+        if not own or not (sacrifice or "blue" in pos.colors[system_id]):
+            continue
+        for color, size in own:
+            for new_color, new_size in pos.reserve_pieces:
+                if new_size == size and new_color != color:
+                    yield (system_id, _ship(pos.player, color, size), new_color)
+
+
+def _attack_args(game, pos, sacrifice):
+    for system_id, enemy in pos.enemy_ships.items():
+        own = pos.own_pieces[system_id]
+        if not enemy or not own or not (sacrifice or "red" in pos.colors[system_id]):
+            continue
+        largest = max(size for _, size in own)
+        for owner, color, size in enemy:
+            if size <= largest:
+                yield (system_id, _ship(owner, color, size))
+
+
+def _catastrophe_args(game, pos, sacrifice):
+    for system_id, counts in pos.color_counts.items():
+        for color in COLORS_BY_KEY:
+            if counts.get(color, 0) >= 4:
+                yield (system_id, color)
+
+
+def _setup_args(game, pos):
+    available = pos.reserve_pieces
+    for first in range(len(available)):
+        for second in range(first, len(available)):
+            stars = [available[first], available[second]]
+            for ship in available:
+                needed = stars + [ship]
+                if all(game["reserve"][color[0] + str(size)] >= needed.count((color, size))
+                       for color, size in needed):
+                    yield ([{"color": color, "size": size} for color, size in stars],
+                           {"color": ship[0], "size": ship[1]})
+
+
+_ARG_GENERATORS = {
+    "construct": _construct_args,
+    "move": _move_args,
+    "trade": _trade_args,
+    "attack": _attack_args,
+    "catastrophe": _catastrophe_args,
+}
+
+
+def _action_sequences(game, action, count, limit=None):
+    """Returns every list of count (action, args) pairs that can be played in a row after a sacrifice,
+    or only the first limit of them.  Candidates are played on game and undone; game is unchanged on return."""
+    if count == 0:
+        return [[]]
+    sequences = []
+    for args in list(_ARG_GENERATORS[action](game, _Position(game), True)):
+        if limit is not None and len(sequences) >= limit:
+            break
+        record = apply_action(game, action, args)
+        try:
+            rest_limit = None if limit is None else limit - len(sequences)
+            for rest in _action_sequences(game, action, count - 1, rest_limit):
+                sequences.append([(action, list(args))] + rest)
+        finally:
+            undo(game, record)
+    return sequences
+
+
+def _sacrifice_args(game, pos, limit=None):
+    if pos.own_pieces and is_view(game):
+        # candidates are tried out on the state itself
+        game = thaw(game)
+    for system_id, own in pos.own_pieces.items():
+        for color, size in own:
+            ship = _ship(pos.player, color, size)
+            record = _journaled(game, _sacrifice_ship, system_id, ship)
+            try:
+                sequences = _action_sequences(game, COLOR_ACTIONS[color], size, limit)
+            finally:
+                undo(game, record)
+            for actions in sequences:
+                yield (system_id, _ship(pos.player, color, size), actions)
+
+
+@schema
+def generate_legal_turns(game: GAMESTATE, sacrifice_limit: SchemaOr(type(None), int)=None):
+    """Yields every legal turn for the current player, in the format bots return:
+    ["action", args]
+
+    Before the current player has a homeworld, only setups (two stars and a ship) are generated.
+    Afterwards: constructs, moves (including to new systems from the reserve), trades, attacks,
+    catastrophes, and sacrifices followed by every sequence of actions they allow.
+    Ships of identical owner and piece in the same system are only offered once.
+    Catastrophes are offered as turns of their own; they may also be added to any other turn.
+    Sacrifices are by far the most numerous turns (tens of thousands in a crowded position);
+    with a sacrifice_limit, only the first sacrifice_limit are generated for each ship.
+    """
+    pos = _Position(game)
+    if not pos.has_homeworld:
+        for args in _setup_args(game, pos):
+            yield ["setup", args]
+        return
+
+    for action in ("construct", "move", "trade", "attack", "catastrophe"):
+        for args in _ARG_GENERATORS[action](game, pos, False):
+            yield [action, args]
+    for args in _sacrifice_args(game, pos, sacrifice_limit):
+        yield ["sacrifice", args]
+
+
 ################
 # Action utils
 # should not be exposed to clients
 ################
 
 
+@schema
+def _sacrifice_ship(game: GAMESTATE, system_id: ExistingSystemId, ship: SHIP) -> GAMESTATE:
+    """First half of a sacrifice: the ship goes back to the reserve."""
+    game = _remove_ship(game, system_id, ship)
+    game = _add_piece_to_reserve(game, ship["piece"])
+    game = _destroy_if_abandoned(game, system_id)
+    return game
+
+
+# Every change to systems and the reserve goes through these, so they are the one place
+# to keep anything derived from the board in step.  While an undo journal is open (see
+# apply_action) each one also records the primitive call that reverses it.
+
+_JOURNAL = "undo_journal"
+
+
+def _record(game, inverse, *args):
+    journal = game.get(_JOURNAL)
+    if journal is not None:
+        journal.append((inverse, args))
+
+
 @schema
 def _add_piece_to_reserve(game: GAMESTATE, piece: PIECE) -> GAMESTATE:
     piece_key = create_piece_key(piece)
     game["reserve"][piece_key] += 1
+    game["hash"] = (game["hash"] + zobrist.RESERVE_KEYS[piece_key]) & zobrist.MASK
+    _record(game, _remove_piece_from_reserve, piece)
     return game
 
 
@@ -599,4 +1006,143 @@ def _add_piece_to_reserve(game: GAMESTATE, piece: PIECE) -> GAMESTATE:
 def _remove_piece_from_reserve(game: GAMESTATE, piece: PIECE) -> GAMESTATE:
     piece_key = create_piece_key(piece)
     game["reserve"][piece_key] -= 1
+    game["hash"] = (game["hash"] - zobrist.RESERVE_KEYS[piece_key]) & zobrist.MASK
+    _record(game, _add_piece_to_reserve, piece)
+    return game
+
+
+def _rehash_system(game, system, delta):
+    """Adds delta to a system's hash and updates the game hash to match."""
+    old = system["hash"]
+    new = (old + delta) & zobrist.MASK
+    system["hash"] = new
+    game["hash"] = (game["hash"] - zobrist.mix(old) + zobrist.mix(new)) & zobrist.MASK
+
+
+@schema
+def _add_ship(game: GAMESTATE, system_id: ExistingSystemId, ship: SHIP, index: int=-1) -> GAMESTATE:
+    """Adds ship at index in the system's ship list, or at the end."""
+    system = game["systems"][system_id]
+    ships = system["ships"]
+    if index < 0:
+        index = len(ships)
+    ships.insert(index, ship)
+    system_counts.add_ship(system["counts"], ship)
+    _rehash_system(game, system, zobrist.ship_key(ship))
+    _record(game, _remove_ship, system_id, ship, index)
+    return game
+
+
+@schema
+def _remove_ship(game: GAMESTATE, system_id: ExistingSystemId, ship: SHIP, index: int=-1) -> GAMESTATE:
+    """Removes the ship at index, or the first ship equal to ship.
+    Identical ships elsewhere in the list are kept."""
+    system = game["systems"][system_id]
+    ships = system["ships"]
+    if index < 0:
+        index = ships.index(ship)
+    removed = ships.pop(index)
+    system_counts.add_ship(system["counts"], removed, -1)
+    _rehash_system(game, system, -zobrist.ship_key(removed))
+    _record(game, _add_ship, system_id, removed, index)
+    return game
+
+
+@schema
+def _replace_ship(game: GAMESTATE, system_id: ExistingSystemId, ship: SHIP, new_ship: SHIP, index: int=-1) -> GAMESTATE:
+    """Replaces the ship at index, or the first ship equal to ship, with new_ship."""
+    system = game["systems"][system_id]
+    ships = system["ships"]
+    if index < 0:
+        index = ships.index(ship)
+    old_ship = ships[index]
+    ships[index] = new_ship
+    system_counts.add_ship(system["counts"], old_ship, -1)
+    system_counts.add_ship(system["counts"], new_ship)
+    _rehash_system(game, system, zobrist.ship_key(new_ship) - zobrist.ship_key(old_ship))
+    _record(game, _replace_ship, system_id, new_ship, old_ship, index)
+    return game
+
+
+@schema
+def _set_star_pieces(game: GAMESTATE, system_id: ExistingSystemId, pieces: [PIECE]) -> GAMESTATE:
+    system = game["systems"][system_id]
+    old_pieces = system["star"]["pieces"]
+    delta = sum(zobrist.star_key(piece) for piece in pieces)
+    delta -= sum(zobrist.star_key(piece) for piece in old_pieces)
+    system["star"]["pieces"] = pieces
+    for piece in old_pieces:
+        system_counts.add_star(system["counts"], piece, -1)
+    for piece in pieces:
+        system_counts.add_star(system["counts"], piece)
+    _rehash_system(game, system, delta)
+    _record(game, _set_star_pieces, system_id, old_pieces)
+    return game
+
+
+@schema
+def _set_system_count(game: GAMESTATE, system_count: int) -> GAMESTATE:
+    _record(game, _set_system_count, game["system_count"])
+    game["system_count"] = system_count
+    return game
+
+
+@schema
+def _insert_system(game: GAMESTATE, system_id: ExistingSystemId, system: dict) -> GAMESTATE:
+    """Puts a system under system_id, keeping game["systems"] in id order."""
+    systems = game["systems"]
+    later = [(other_id, systems.pop(other_id)) for other_id in list(systems) if other_id > system_id]
+    systems[system_id] = system
+    systems.update(later)
+    if system["star"]["owner"] != NO_OWNER:
+        game["homeworlds"][system["star"]["owner"]] = system_id
+    game["hash"] = (game["hash"] + zobrist.mix(system["hash"])) & zobrist.MASK
+    _record(game, _delete_system, system_id)
+    return game
+
+
+@schema
+def _delete_system(game: GAMESTATE, system_id: ExistingSystemId) -> GAMESTATE:
+    """Takes a system off the board as is; its pieces are not returned to the reserve."""
+    system = game["systems"].pop(system_id)
+    if system["star"]["owner"] != NO_OWNER:
+        del game["homeworlds"][system["star"]["owner"]]
+    game["hash"] = (game["hash"] - zobrist.mix(system["hash"])) & zobrist.MASK
+    _record(game, _insert_system, system_id, system)
+    return game
+
+
+@schema
+def _add_system(game: GAMESTATE, owner: OwnerId, star_pieces: [PIECE]) -> (GAMESTATE, int):
+    """Creates an empty system, returns (game, new system id)."""
+    system_id = game["system_count"] + 1
+    game = _set_system_count(game, system_id)
+    system = {"star": {"owner": owner, "pieces": star_pieces}, "ships": []}
+    system["hash"] = zobrist.system_hash(system)
+    system["counts"] = system_counts.count_system(system)
+    game = _insert_system(game, system_id, system)
+    return game, system_id
+
+
+@schema
+def _destroy_system(game: GAMESTATE, system_id: ExistingSystemId) -> GAMESTATE:
+    """Removes a system, returning its stars and ships to the reserve."""
+    system = game["systems"][system_id]
+    while system["ships"]:
+        ship = system["ships"][-1]
+        game = _remove_ship(game, system_id, ship, len(system["ships"]) - 1)
+        game = _add_piece_to_reserve(game, ship["piece"])
+    for piece in system["star"]["pieces"]:
+        game = _add_piece_to_reserve(game, piece)
+    game = _delete_system(game, system_id)
+    return game
+
+
+@schema
+def _destroy_if_abandoned(game: GAMESTATE, system_id: ExistingSystemId) -> GAMESTATE:
+    """Neutral systems with no ships left return to the reserve.
+    Empty homeworlds are kept; check_player_lost deals with them."""
+    system = game["systems"][system_id]
+    if not system["ships"] and system["star"]["owner"] == NO_OWNER:
+        game = _destroy_system(game, system_id)
     return game
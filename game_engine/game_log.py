@@ -0,0 +1,142 @@
+"""Streaming, crash-safe game logs.
+
+A game log is a JSON lines file with one record per line:
+    {"type": "header", "version": 1, "bots": {...}, "seed": ..., "first_player": ..., "players": [...]}
+    {"type": "turn", "turn": 1, "player": 1, "actions": ["setup", [...]]}
+    ...
+    {"type": "keyframe", "turn": 20, "state": {...}}
+    ...
+    {"type": "end", "turns": ..., "losers": [...], "winner": ..., "reason": "..."}
+    {"type": "index", "turns": [byte offset of turn 1, ...], "keyframes": [[turn, byte offset], ...], "end": ...}
+    {"type": "trailer", "index":         1234}
+
+A keyframe holds the full state (see serialization.py, without history) after that many
+turns, with the next player to move; one is written for turn 0 and then every
+keyframe_every turns.  The index and the fixed-width trailer pointing at it are written
+on close, so replay.py can seek straight to a turn.  Logs without them (cut short by a
+crash) are indexed by scanning.
+
+Records are written whole, so a log cut short by a crash is still readable up to the last
+complete line; read_game_log skips a trailing partial line.  Writes are buffered and
+flushed every flush_every records and/or every flush_interval seconds, and always on
+the end record and on close.
+"""
+
+import json
+import os
+import time
+
+from serialization import (
+    encode_game,
+)
+
+LOG_VERSION = 1
+KEYFRAME_EVERY = 20
+TRAILER = '{{"type":"trailer","index":{:>20}}}\n'
+TRAILER_SIZE = len(TRAILER.format(0))
+
+
+class GameLogWriter(object):
+    """Appends records to a game log.
+
+    flush_every: write buffered records to the file after this many records (1 = every turn).
+    flush_interval: also write them once this many seconds have passed since the last write.
+    fsync: also ask the OS to put flushed records on disk, for logs that must survive
+           a machine crash rather than a process crash.
+    keyframe_every: turns between keyframes written by checkpoint (None for none).
+    """
+
+    def __init__(self, path: str, flush_every: int=1, flush_interval: float=None, fsync: bool=False,
+                 keyframe_every: int=KEYFRAME_EVERY):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.keyframe_every = keyframe_every
+        self._file = open(path, "w", encoding="utf-8")
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        # byte offset the next record will be written at; records are ASCII (json's
+        # default ensure_ascii), so characters are bytes
+        self._offset = 0
+        self._index = {"type": "index", "turns": [], "keyframes": [], "end": None}
+
+    def write(self, record: dict) -> type(None):
+        # bot input is untrusted and may hold things JSON can't encode; log their repr
+        line = json.dumps(record, separators=(",", ":"), default=repr) + "\n"
+        if record["type"] == "turn":
+            self._index["turns"].append(self._offset)
+        elif record["type"] == "keyframe":
+            self._index["keyframes"].append([record["turn"], self._offset])
+        elif record["type"] == "end":
+            self._index["end"] = self._offset
+        self._offset += len(line)
+        self._buffer.append(line)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+        elif self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_header(self, bots: dict, seed: int, first_player: int, players: list, **extra) -> type(None):
+        record = {"type": "header", "version": LOG_VERSION, "bots": bots, "seed": seed,
+                  "first_player": first_player, "players": players}
+        record.update(extra)
+        self.write(record)
+
+    def write_turn(self, turn_number: int, player: int, actions: list, **extra) -> type(None):
+        record = {"type": "turn", "turn": turn_number, "player": player, "actions": actions}
+        record.update(extra)
+        self.write(record)
+
+    def write_keyframe(self, turn_number: int, game: dict) -> type(None):
+        self.write({"type": "keyframe", "turn": turn_number, "state": encode_game(game, include_history=False)})
+
+    def checkpoint(self, turn_number: int, game: dict) -> type(None):
+        """Call with the state after turn_number turns, once the next player is set.
+        Writes a keyframe if one is due."""
+        if self.keyframe_every and turn_number % self.keyframe_every == 0:
+            self.write_keyframe(turn_number, game)
+
+    def write_end(self, turns: int, losers: list, winner: int, reason: str) -> type(None):
+        self.write({"type": "end", "turns": turns, "losers": losers, "winner": winner, "reason": reason})
+        self.flush()
+
+    def flush(self) -> type(None):
+        if self._buffer:
+            self._file.write("".join(self._buffer))
+            self._buffer = []
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+
+    def close(self) -> type(None):
+        """Writes the index and trailer, and closes the file."""
+        if not self._file.closed:
+            index_offset = self._offset
+            self.write(self._index)
+            self._buffer.append(TRAILER.format(index_offset))
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_game_log(path: str):
+    """Yields the records of a game log.  A partial last line (from a crash) is skipped."""
+    with open(path, "r", encoding="utf-8") as log:
+        for line in log:
+            if not line.endswith("\n"):
+                break
+            yield json.loads(line)
+
+
+def read_turns(path: str):
+    """Yields (player, actions) for every turn in a game log."""
+    for record in read_game_log(path):
+        if record["type"] == "turn":
+            yield record["player"], record["actions"]
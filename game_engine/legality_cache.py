@@ -0,0 +1,83 @@
+"""Memoized legality checks.
+
+A LegalityCache remembers what ACTION_VALIDATORS said about (position, action, args), in
+a bounded LRU.  The position part of the key is the zobrist hash (see zobrist.py) plus
+each system's id and hash: the zobrist hash alone leaves system ids out, and args refer to
+systems by id.  Any change to the board changes the key, so entries never go stale; they
+just stop being asked for and fall out of the LRU.
+
+interpret_bot_input checks turns through CACHE, so a bot resubmitting the same turn (or
+the same first actions) against an unchanged state skips the rules.  Search bots probing
+candidate actions can use CACHE.validate, or a cache of their own.
+"""
+
+from collections import (
+    OrderedDict,
+)
+
+from game import (
+    ACTION_VALIDATORS,
+    GAMESTATE,
+)
+
+
+DEFAULT_SIZE = 1 << 14
+
+
+def position_key(game: GAMESTATE) -> tuple:
+    return (game["hash"], tuple((system_id, system["hash"]) for system_id, system in game["systems"].items()))
+
+
+def _freeze(value):
+    """A hashable copy of args.  Dicts are tagged so they can't equal a list of pairs."""
+    if isinstance(value, dict):
+        return (dict, tuple(sorted((key, _freeze(item)) for key, item in value.items())))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    hash(value)
+    return value
+
+
+class LegalityCache(object):
+
+    def __init__(self, size: int=DEFAULT_SIZE):
+        self.size = size
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def validate(self, game: GAMESTATE, action: str, args) -> (bool, str):
+        """ACTION_VALIDATORS[action](game, args), from the cache when possible."""
+        try:
+            key = (position_key(game), action, _freeze(args))
+        except TypeError:
+            # unhashable args (a set, say); let the validator say what is wrong with them
+            self.misses += 1
+            return ACTION_VALIDATORS[action](game, args)
+
+        results = self._results
+        result = results.get(key)
+        if result is not None:
+            results.move_to_end(key)
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        result = ACTION_VALIDATORS[action](game, args)
+        results[key] = result
+        if len(results) > self.size:
+            results.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def clear(self) -> type(None):
+        self._results.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self._results), "max_size": self.size, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+CACHE = LegalityCache()
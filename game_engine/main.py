@@ -5,70 +5,148 @@
 #      hard as fuck to maintain is what it is
 
 from importlib import (
-    import_module
+    import_module,
+    reload,
 )
 import random
 import sys
 
 from py_types.runtime import (
-    schema,
     SchemaOr,
     typecheck,
 )
 
+from bot_api import (
+    BOT_PATH,
+    new_game,
+    player_seed,
+    turn_function,
+)
+from bot_pool import (
+    BotPool,
+)
+from bot_worker import (
+    BotError,
+    BotTimeout,
+    BotWorker,
+    Clock,
+    TimeControl,
+    timed_call,
+)
+from game_log import (
+    KEYFRAME_EVERY,
+    GameLogWriter,
+)
 from game import (
     GAMESTATE,
-    ACTION_METHODS,
+    ACTION_ARGS_SCHEMAS,
     ACTION_VALIDATORS,
-
+    apply_action,
+    create_game,
+    set_current_player,
+    undo,
+)
+from legality_cache import (
+    CACHE as LEGALITY_CACHE,
+    LegalityCache,
+)
+from state_view import (
+    unwrap,
+    view,
+)
+from training_data import (
+    DatasetWriter,
+)
+from validation import (
+    schema,
+    checks_boundary,
+    compile_schema,
 )
 
 
-BOT_PATH = "bots."
-LOG_FILE = "last_game.log"
+LOG_FILE = "last_game.jsonl"
+DEFAULT_MAX_INVALID_TURNS = 3
 DEBUG = False
 
 
 @schema
 def check_player_lost(game: GAMESTATE) -> SchemaOr(type(None), [int]):
-    """Returns a list of players who have lost, or None."""
-    players_with_homeworlds = []
-    for _, system in game["systems"].items():
-        if system["star"]["owner"] in game["players"]:
-            owned_ships = [ship for ship in system["ships"] if ship["owner"] == system["star"]["owner"]]
-            if owned_ships:
-                players_with_homeworlds.append(system["star"]["owner"])
-
-    players_without = [pl for pl in game["players"] if pl not in players_with_homeworlds]
+    """Returns a list of players who have lost, or None.
+    A player loses when they have no homeworld, or no ships of their own at it."""
+    players_without = []
+    for player in game["players"]:
+        homeworld = game["homeworlds"].get(player)
+        if homeworld is None or player not in game["systems"][homeworld]["counts"]["owners"]:
+            players_without.append(player)
+
     if players_without:
         return players_without
     else:
         return None
 
 
+def check_bot_input(bot_input: list) -> (bool, str):
+    """Returns (True, "") if bot input is shaped like a turn, (False, message) otherwise.
+    Only checks structure against ACTION_ARGS_SCHEMAS; legality is up to the validators.
+    """
+    if not isinstance(bot_input, (list, tuple)) or len(bot_input) % 2 != 0:
+        return (False, "Turn must be a list of alternating actions and args, got {!r}.".format(bot_input))
+
+    pending = list(zip(bot_input[::2], bot_input[1::2]))
+    while pending:
+        action, args = pending.pop()
+        if action not in ACTION_ARGS_SCHEMAS:
+            return (False, "Unknown action {!r}.".format(action))
+        failure = compile_schema(ACTION_ARGS_SCHEMAS[action])(args)
+        if failure is not None:
+            key_path, value, expected = failure
+            return (False, "Args {!r} for action {} do not match schema at {}: expected {}, got {!r}.".format(
+                args, action, key_path, expected, value))
+        if action == "sacrifice":
+            pending.extend(args[2])
+
+    return (True, "")
+
+
 @schema
-def interpret_bot_input(game: GAMESTATE, bot_input: list) -> SchemaOr((bool, str), (bool, GAMESTATE)):
+def interpret_bot_input(game: GAMESTATE, bot_input: list,
+                        cache: SchemaOr(type(None), LegalityCache)=LEGALITY_CACHE
+                        ) -> SchemaOr((bool, str), (bool, GAMESTATE)):
     """Takes bot input and calls the appropriate methods.
     Bots are expected to return a list in this format:
     ["action", (args)]
     where "action" corresponds to a key in ACTION_METHODS
     and args is the appropriate arguments for that method.
+
+    Bot input is untrusted, so its shape is checked at every validation level but "off".
+    Legality checks go through cache (legality_cache.CACHE by default), or straight to
+    ACTION_VALIDATORS if it is None.  If any action is illegal, the ones before it are
+    undone, so a rejected turn leaves game as it was.
     """
+    if checks_boundary():
+        input_check = check_bot_input(bot_input)
+        if not input_check[0]:
+            return input_check
 
+    records = []
     for index, _ in enumerate(bot_input):
         if index % 2 != 0:
             continue
         action = bot_input[index]
         args = bot_input[index + 1]
-        validator = ACTION_VALIDATORS[action]
-        method = ACTION_METHODS[action]
 
-        print(validator)
-        print(args)
-        is_valid = validator(game, args)
+        if DEBUG:
+            print(ACTION_VALIDATORS[action])
+            print(args)
+        if cache is None:
+            is_valid = ACTION_VALIDATORS[action](game, args)
+        else:
+            is_valid = cache.validate(game, action, args)
         if not is_valid[0]:
+            for record in reversed(records):
+                undo(game, record)
             return is_valid
-        game = method(game, *args)
+        records.append(apply_action(game, action, args))
 
     return (True, game)
 
@@ -83,82 +161,221 @@ def next_player(player: int) -> int:
         return 1
 
 
+def load_bot(name: str):
+    """Imports bots/<name>.py, re-running it if it was already imported,
+    so module-level state left over from an earlier game is reset.
+    A bot playing itself is one module shared by both players."""
+    module_name = BOT_PATH + name
+    if module_name in sys.modules:
+        return reload(sys.modules[module_name])
+    return import_module(module_name)
+
+
+def play_game(first_bot: str, second_bot: str, seed: int=None, log_file: str=LOG_FILE,
+              max_turns: int=None, verbose: bool=True, time_control: TimeControl=None,
+              max_invalid_turns: int=DEFAULT_MAX_INVALID_TURNS, keep_history: bool=True, log_flush_every: int=1,
+              log_keyframe_every: int=KEYFRAME_EVERY, pool: BotPool=None, dataset: DatasetWriter=None) -> dict:
+    """Plays one game between two bots (see main), returns a summary:
+    {"bots": {1: first_bot, 2: second_bot}, "seed": seed, "first_player": id,
+     "turns": turns played, "losers": [ids], "winner": id or None, "reason": str,
+     "turn_stats": [{"player", "wall", "cpu", "max_rss_kb", "attempts"} per turn],
+     "resources": {id: {"wall", "cpu", "max_rss_kb", "invalid_turns"}}}
+
+    seed picks who goes first, and also seeds `random` and each bot (see bot_api.py).
+    Every bot gets its own instance for the game, also when a bot plays itself.
+    Bots playing in this process see the game through a read-only view (see state_view.py).
+    A bot that raises forfeits.  The game is a draw after max_turns turns, if given.
+    With a time_control, each bot runs in its own worker process (see bot_worker.py)
+    and loses if it runs out of time; a move's time covers its retries after invalid turns.
+    A bot that gives more than max_invalid_turns invalid turns in a row forfeits (None for
+    no limit).  Every turn played, including one that ends in a forfeit, is in turn_stats.
+    Every turn is streamed to log_file as it is played (see game_log.py), unless log_file
+    is None; log_flush_every sets how many records are buffered between writes, and
+    log_keyframe_every how many turns apart full states are stored for replay.py.
+    With keep_history=False, turns are not kept in gamestate["history"], so memory stays
+    flat over long games; bots then see an empty history.
+    With a pool (see bot_pool.py), each bot plays in a warm process taken from the pool and
+    given back after the game, with or without a time_control.  Those bots get no history.
+    With a dataset (see training_data.py), every position played is added to it, labelled
+    with the outcome once the game is over.
+    """
+    bots = {1: first_bot, 2: second_bot}
+
+    rng = random.Random(seed)
+    if seed is not None:
+        random.seed(seed)
+    bot_seeds = {player: player_seed(seed, player) for player in bots}
+
+    clock = Clock(time_control, list(bots)) if time_control is not None else None
+    if pool is not None:
+        workers = {player: pool.acquire(name) for player, name in bots.items()}
+        for player, worker in workers.items():
+            worker.start_game(player, list(bots), bot_seeds[player])
+    elif time_control is None:
+        player_calls = {player: turn_function(new_game(name, player, bot_seeds[player]))
+                        for player, name in bots.items()}
+        workers = {}
+    else:
+        workers = {player: BotWorker(name, player, bot_seeds[player]) for player, name in bots.items()}
+
+    def request_turn(player, message, budget):
+        if not workers:
+            turn, stats = timed_call(player_calls[player], view(gamestate), message, budget)
+            # turns may hold pieces of the view
+            return unwrap(turn), stats
+        try:
+            return workers[player].take_turn(gamestate, message, budget)
+        except BotTimeout:
+            clock.charge(player, budget)
+            raise
+
+    # random player goes first
+    gamestate = create_game(players=[1, 2])
+    gamestate = set_current_player(gamestate, rng.choice(gamestate["players"]))
+    summary = {"bots": bots, "seed": seed, "first_player": gamestate["current_player"],
+               "turns": 0, "losers": [], "winner": None, "reason": "", "turn_stats": [],
+               "resources": {player: {"wall": 0.0, "cpu": 0.0, "max_rss_kb": None, "invalid_turns": 0}
+                             for player in bots}}
+
+    log = None
+    if log_file is not None:
+        log = GameLogWriter(log_file, flush_every=log_flush_every, keyframe_every=log_keyframe_every)
+        log.write_header(bots, seed, summary["first_player"], list(gamestate["players"]))
+        log.checkpoint(0, gamestate)
+
+    def record(event):
+        if keep_history:
+            gamestate["history"].append(event)
+
+    def account(player, stats):
+        used = summary["resources"][player]
+        used["wall"] += stats["wall"]
+        used["cpu"] += stats["cpu"]
+        if stats["max_rss_kb"] is not None:
+            used["max_rss_kb"] = max(used["max_rss_kb"] or 0, stats["max_rss_kb"])
+        if clock is not None:
+            clock.charge(player, stats["wall"])
+
+    def forfeit(player, reason):
+        summary["losers"] = [player]
+        summary["reason"] = "player {} forfeits, {}".format(player, reason)
+        record(["END", summary["reason"]])
+
+    turn_count = 0
+    try:
+        while max_turns is None or turn_count < max_turns:
+            player = gamestate["current_player"]
+            if dataset is not None:
+                dataset.add_position(gamestate)
+            turn_stats = {"player": player, "wall": 0.0, "cpu": 0.0, "max_rss_kb": None, "attempts": 0}
+            # kept up to date below, so a turn that ends in a forfeit is counted too
+            summary["turn_stats"].append(turn_stats)
+            message = ""
+            # one budget for the whole move: retries after invalid turns use what is left of it
+            budget = clock.budget(player) if clock is not None else None
+            try:
+                while True:
+                    try:
+                        turn, stats = request_turn(player, message, budget)
+                    except BotTimeout:
+                        turn_stats["wall"] += budget
+                        turn_stats["attempts"] += 1
+                        raise
+                    account(player, stats)
+                    if budget is not None:
+                        budget = max(0.0, budget - stats["wall"])
+                    turn_stats["wall"] += stats["wall"]
+                    turn_stats["cpu"] += stats["cpu"]
+                    turn_stats["max_rss_kb"] = stats["max_rss_kb"]
+                    turn_stats["attempts"] += 1
+                    result = interpret_bot_input(gamestate, turn)
+                    if result[0]:
+                        break
+                    summary["resources"][player]["invalid_turns"] += 1
+                    if log is not None:
+                        log.write({"type": "invalid", "player": player, "actions": turn, "message": result[1]})
+                    if max_invalid_turns is not None and turn_stats["attempts"] > max_invalid_turns:
+                        raise BotError("too many invalid turns, last: {}".format(result[1]))
+                    if budget == 0.0:
+                        raise BotTimeout("out of time")
+                    message = result[1]
+            except BotTimeout as exc:
+                forfeit(player, "lost on time: {}".format(exc))
+                break
+            except Exception as exc:
+                forfeit(player, "bot raised {!r}".format(exc))
+                break
+            if clock is not None:
+                clock.end_move(player)
+
+            gamestate = result[1]
+            turn_summary = ["p{}".format(gamestate["current_player"])]
+            turn_summary.append(turn)
+            record(turn_summary)
+            if log is not None:
+                log.write_turn(turn_count + 1, player, turn, wall=turn_stats["wall"], cpu=turn_stats["cpu"])
+
+            if DEBUG:
+                print(turn_summary)
+                print(gamestate)
+
+            turn_count += 1
+            # don't check for lose conditions on setup turns
+            if turn_count > 2:
+                losers = check_player_lost(gamestate)
+                if losers:
+                    summary["losers"] = losers
+                    summary["reason"] = "players {} have lost".format(losers)
+                    record(["END", summary["reason"]])
+                    break
+
+            gamestate = set_current_player(gamestate, next_player(gamestate["current_player"]))
+            if log is not None:
+                log.checkpoint(turn_count, gamestate)
+        else:
+            summary["reason"] = "draw after {} turns".format(turn_count)
+            record(["END", summary["reason"]])
+    finally:
+        summary["turns"] = turn_count
+        remaining = [player for player in gamestate["players"] if player not in summary["losers"]]
+        if summary["losers"] and len(remaining) == 1:
+            summary["winner"] = remaining[0]
+        for worker in workers.values():
+            if pool is None:
+                worker.close()
+                continue
+            try:
+                worker.end_game(summary)
+            except BotError:
+                pass
+            pool.release(worker)
+        if dataset is not None:
+            if summary["reason"]:
+                dataset.end_game(summary["winner"], summary["losers"])
+            else:
+                dataset.abandon_game()
+        if log is not None:
+            # if the game loop itself crashed, reason is empty and the log still ends cleanly
+            log.write_end(turn_count, summary["losers"], summary["winner"], summary["reason"] or "aborted")
+            log.close()
+    if verbose:
+        print("GAME END - {}".format(summary["reason"]))
+    return summary
+
+
 @typecheck
 def main(first_bot: str, second_bot: str) -> type(None):
     """Instantiates game state, loops on bot input.
     won Ugliest Thing Award in 2015
 
-    Bots are expected to be a module string with a function "take_turn"
-    present.
+    Bots are expected to be a module string with a function "new_game"
+    (see bot_api.py) or "take_turn" present.
     expected signature:
     take_turn(game: GAMESTATE, message: str) -> GAMESTATE:
 
     message will contain an error message on the previous input, if any.
     """
-    player_one = import_module(BOT_PATH + first_bot)
-    player_one_turn = player_one.take_turn
-
-    player_two = import_module(BOT_PATH + second_bot)
-    player_two_turn = player_two.take_turn
-
-    player_calls = {1: player_one_turn, 2: player_two_turn}
-
-    gamestate = {
-        "reserve": {
-            "g1": 3,
-            "g2": 3,
-            "g3": 3,
-            "b1": 3,
-            "b2": 3,
-            "b3": 3,
-            "y1": 3,
-            "y2": 3,
-            "y3": 3,
-            "r1": 3,
-            "r2": 3,
-            "r3": 3
-        },
-        "systems": {},
-        "players": [1, 2],
-        "current_player": 1,
-        "history": [],
-        "system_count": 0,
-        "owner_count": 2
-    }
-
-    # random player goes first
-    gamestate["current_player"] = random.choice(gamestate["players"])
-
-    turn_count = 0
-    while True:
-        turn = player_calls[gamestate["current_player"]](gamestate, "")
-        result = interpret_bot_input(gamestate, turn)
-        while not result[0]:
-            turn = player_calls[gamestate["current_player"]](gamestate, result[1])
-            result = interpret_bot_input(gamestate, turn)
-
-        gamestate = result[1]
-        turn_summary = ["p{}".format(gamestate["current_player"])]
-        turn_summary.append(turn)
-        gamestate["history"].append(turn_summary)
-
-        if DEBUG:
-            print(turn_summary)
-            print(gamestate)
-
-        turn_count += 1
-        # don't check for lose conditions on setup turns
-        if turn_count > 2:
-            losers = check_player_lost(gamestate)
-            if losers:
-                gamestate["history"].append(["END", "players {} have lost".format(losers)])
-                print("GAME END - these players have lost: {}".format(losers))
-                break
-
-        gamestate["current_player"] = next_player(gamestate["current_player"])
-
-    with open(LOG_FILE, "w+") as log:
-        log.write(str(gamestate["history"]).replace("], ", "],\n"))
+    play_game(first_bot, second_bot)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,282 @@
+"""Opening book mined from game logs.
+
+usage: python opening_book.py BOOK LOG_FILE...
+
+Adds the games in the logs (see game_log.py) to the opening book BOOK, creating it if
+needed.  Games already in the book, unfinished games and aborted games are skipped.
+
+For every position in the first BOOK_PLIES turns of each game, the book holds the turns
+played from it, with how many games each was played in and how many of those the player
+who played it won or drew.  Positions are keyed by canonical_key (see canonical.py) and
+turns are stored with canonical system ids, so the same opening reached with different
+system ids, or ship orders, shares its entries.
+
+The book is one binary file, read through mmap; looking a position up is a binary search
+over fixed-size records, with no parsing until its turns are wanted:
+    header      MAGIC, then position, move and game counts and the size of the turns
+    games       16 byte digest of every game log in the book, sorted (to skip them later)
+    positions   (16 byte digest of the canonical key, first move, move count), sorted
+    moves       (turn offset, turn length, games, wins, draws), by position, most played first
+    turns       the moves' turns, as JSON
+A BookBuilder loads an existing book, adds games, and writes a new file in place of the
+old one (os.replace), so bots with the old book open keep reading it undisturbed.
+"""
+
+import bisect
+import collections
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+from canonical import (
+    canonical_form,
+)
+import compact
+from replay import (
+    Replay,
+)
+
+
+BOOK_PLIES = 16
+MIN_GAMES = 2
+
+MAGIC = b"HWBOOK1\n"
+HEADER = struct.Struct("<8sIIII")
+DIGEST_SIZE = 16
+POSITION = struct.Struct("<16sII")
+MOVE = struct.Struct("<IIIII")
+
+BookMove = collections.namedtuple("BookMove", ("turn", "games", "wins", "draws"))
+
+
+def position_digest(key: bytes) -> bytes:
+    return hashlib.blake2b(key, digest_size=DIGEST_SIZE).digest()
+
+
+def _encode_turn(turn: list) -> bytes:
+    return json.dumps(turn, separators=(",", ":")).encode("utf-8")
+
+
+def score(move: BookMove) -> float:
+    """Expected score of the player playing move (win 1, draw 1/2), with one won and one
+    lost game added, so rarely played turns don't look better than they are."""
+    return (move.wins + move.draws / 2 + 1) / (move.games + 2)
+
+
+class _Digests(object):
+    """Sequence over the digests of fixed-size records in a map, for bisect."""
+
+    def __init__(self, data, start: int, count: int, record_size: int):
+        self._data = data
+        self._start = start
+        self._count = count
+        self._record_size = record_size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        offset = self._start + index * self._record_size
+        return self._data[offset:offset + DIGEST_SIZE]
+
+
+class OpeningBook(object):
+    """An open book file.  Use as a context manager, or call close."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.position_count, self.move_count, self.game_count, turns_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not an opening book.".format(path))
+        self._games_start = HEADER.size
+        self._positions_start = self._games_start + self.game_count * DIGEST_SIZE
+        self._moves_start = self._positions_start + self.position_count * POSITION.size
+        self._turns_start = self._moves_start + self.move_count * MOVE.size
+        self._games = _Digests(self._map, self._games_start, self.game_count, DIGEST_SIZE)
+        self._positions = _Digests(self._map, self._positions_start, self.position_count, POSITION.size)
+
+    def has_game(self, digest: bytes) -> bool:
+        index = bisect.bisect_left(self._games, digest)
+        return index < self.game_count and self._games[index] == digest
+
+    def _moves(self, digest: bytes) -> list:
+        """BookMoves for a position digest, with the turns still as (offset, length) in the map."""
+        index = bisect.bisect_left(self._positions, digest)
+        if index == self.position_count or self._positions[index] != digest:
+            return []
+        _, first, count = POSITION.unpack_from(self._map, self._positions_start + index * POSITION.size)
+        moves = []
+        for move in range(first, first + count):
+            offset, length, games, wins, draws = MOVE.unpack_from(self._map, self._moves_start + move * MOVE.size)
+            moves.append(BookMove((self._turns_start + offset, length), games, wins, draws))
+        return moves
+
+    def _turn(self, location: tuple) -> list:
+        start, length = location
+        return json.loads(self._map[start:start + length])
+
+    def lookup(self, game) -> list:
+        """BookMoves for the position, most played first, with turns using game's own system
+        ids; [] if the position isn't in the book.  game is a GAMESTATE, compact game or
+        persistent state."""
+        key, ids = canonical_form(game)
+        return [move._replace(turn=ids.turn_from_canonical(self._turn(move.turn)))
+                for move in self._moves(position_digest(key))]
+
+    def choose(self, game, rng=None, min_games: int=MIN_GAMES) -> list:
+        """A book turn for the position, or None to search instead.  Only turns played in at
+        least min_games games are considered: the best scoring one, or with rng, one picked
+        at random in proportion to how often it was played."""
+        key, ids = canonical_form(game)
+        moves = [move for move in self._moves(position_digest(key)) if move.games >= min_games]
+        if not moves:
+            return None
+        if rng is None:
+            move = max(moves, key=score)
+        else:
+            move = rng.choices(moves, weights=[move.games for move in moves])[0]
+        return ids.turn_from_canonical(self._turn(move.turn))
+
+    def entries(self):
+        """Yields (position digest, [BookMove with canonical turn]) for every position."""
+        for index in range(self.position_count):
+            digest = self._positions[index]
+            yield digest, [move._replace(turn=self._turn(move.turn)) for move in self._moves(digest)]
+
+    def game_digests(self):
+        for index in range(self.game_count):
+            yield self._games[index]
+
+    def close(self) -> type(None):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_open_books = {}
+
+
+def open_book(path: str) -> OpeningBook:
+    """A shared OpeningBook for path, reopened when the file is replaced."""
+    stat = os.stat(path)
+    version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    opened = _open_books.get(path)
+    if opened is None or opened[0] != version:
+        if opened is not None:
+            opened[1].close()
+        opened = _open_books[path] = (version, OpeningBook(path))
+    return opened[1]
+
+
+##################
+# Building
+##################
+
+
+def game_digest(path: str) -> bytes:
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(path, "rb") as log:
+        for block in iter(lambda: log.read(1 << 16), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+class BookBuilder(object):
+    """Book entries in memory: {position digest: {turn JSON: [games, wins, draws]}}."""
+
+    def __init__(self, plies: int=BOOK_PLIES):
+        self.plies = plies
+        self.positions = {}
+        self.games = set()
+
+    @classmethod
+    def load(cls, path: str, plies: int=BOOK_PLIES) -> "BookBuilder":
+        """A builder holding the book at path, or an empty one if there is no file there."""
+        builder = cls(plies)
+        if not os.path.exists(path):
+            return builder
+        with OpeningBook(path) as book:
+            builder.games.update(book.game_digests())
+            for digest, moves in book.entries():
+                builder.positions[digest] = {_encode_turn(turn): [games, wins, draws]
+                                             for turn, games, wins, draws in moves}
+        return builder
+
+    def add_log(self, path: str) -> bool:
+        """Adds the game in a log; False if it was skipped."""
+        digest = game_digest(path)
+        if digest in self.games:
+            return False
+        with Replay(path) as replay:
+            end = replay.end
+            if end is None or end["reason"] == "aborted":
+                return False
+            state = compact.from_gamestate(replay.state_at(0))
+            for record in replay.turns(1, min(self.plies, replay.turn_count)):
+                player = record["player"]
+                state.current_player = player
+                key, ids = canonical_form(state)
+                counts = self.positions.setdefault(position_digest(key), {}).setdefault(
+                    _encode_turn(ids.turn_to_canonical(record["actions"])), [0, 0, 0])
+                counts[0] += 1
+                if end["winner"] == player:
+                    counts[1] += 1
+                elif end["winner"] is None and player not in end["losers"]:
+                    counts[2] += 1
+                compact.apply_turn(state, record["actions"])
+        self.games.add(digest)
+        return True
+
+    def write(self, path: str) -> type(None):
+        turns = bytearray()
+        positions = []
+        moves = []
+        for digest in sorted(self.positions):
+            played = sorted(self.positions[digest].items(), key=lambda item: -item[1][0])
+            positions.append(POSITION.pack(digest, len(moves), len(played)))
+            for turn, (games, wins, draws) in played:
+                moves.append(MOVE.pack(len(turns), len(turn), games, wins, draws))
+                turns += turn
+
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as book:
+            book.write(HEADER.pack(MAGIC, len(positions), len(moves), len(self.games), len(turns)))
+            book.write(b"".join(sorted(self.games)))
+            book.write(b"".join(positions))
+            book.write(b"".join(moves))
+            book.write(turns)
+        os.replace(temporary, path)
+
+
+def update_book(book_path: str, log_paths: list, plies: int=BOOK_PLIES) -> int:
+    """Adds the games in log_paths to the book at book_path; returns how many were added."""
+    builder = BookBuilder.load(book_path, plies)
+    added = sum(builder.add_log(path) for path in log_paths)
+    if added or not os.path.exists(book_path):
+        builder.write(book_path)
+    return added
+
+
+def main(argv: list) -> int:
+    if len(argv) < 2:
+        print(__doc__, file=sys.stderr)
+        return 2
+    added = update_book(argv[0], argv[1:])
+    with OpeningBook(argv[0]) as book:
+        print("added {} of {} games; {} now has {} games, {} positions, {} turns".format(
+            added, len(argv) - 1, argv[0], book.game_count, book.position_count, book.move_count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,370 @@
+"""Persistent (immutable, structurally shared) game states.
+
+A State never changes.  The action functions here take a State and return a new one that
+shares everything the action didn't touch with its parent: untouched System objects, the
+reserve if no piece went in or out of it, and the whole history, which is a cons list
+((event, earlier history) pairs, None when empty), so a child's history is one pair in
+front of its parent's.  Branching a search or a what-if analysis costs what the action
+changed, not what the game holds: the changed systems are rebuilt, and the systems dict,
+which only holds references, is copied (a game has a few dozen systems at most).
+
+Pieces are reserve keys ("g1" ... "r3") and ships are (owner, piece key) tuples; a System
+holds its star owner, star pieces and ships as tuples, plus its zobrist hash.  States keep
+the same hashes as game.py (see zobrist.py), so a State and the GAMESTATE it converts to
+hash the same.
+
+The action functions take the same arguments as game.py's ACTION_METHODS (dict ships and
+pieces), follow the same rules, and like them assume the action has been validated.  The
+systems and homeworlds dicts of a State are shared between states and must not be changed;
+only the functions here build new ones.  from_gamestate/to_gamestate convert to and from
+GAMESTATE dicts, for validation and for bots.
+"""
+
+from collections import (
+    namedtuple,
+)
+
+from game import (
+    GAMESTATE,
+    NO_OWNER,
+    History,
+    rebuild_indexes,
+)
+import zobrist
+
+
+PIECE_KEYS = zobrist.PIECE_KEYS
+PIECE_INDEX = {key: index for index, key in enumerate(PIECE_KEYS)}
+COLOR_NAMES = {"g": "green", "b": "blue", "y": "yellow", "r": "red"}
+
+
+System = namedtuple("System", ("owner", "stars", "ships", "hash"))
+
+State = namedtuple("State", ("reserve", "systems", "players", "current_player", "system_count", "owner_count",
+                             "hash", "homeworlds", "history"))
+
+
+def piece_key(piece: dict) -> str:
+    return piece["color"][0] + str(piece["size"])
+
+
+def piece_dict(key: str) -> dict:
+    return {"color": COLOR_NAMES[key[0]], "size": int(key[1])}
+
+
+def ship_tuple(ship: dict) -> tuple:
+    return (ship["owner"], piece_key(ship["piece"]))
+
+
+def ship_dict(ship: tuple) -> dict:
+    return {"owner": ship[0], "piece": piece_dict(ship[1])}
+
+
+def make_system(owner: int, stars: tuple, ships: tuple) -> System:
+    value = zobrist.STAR_OWNER_KEYS[owner]
+    for key in stars:
+        value += zobrist.STAR_KEYS[key]
+    for ship in ships:
+        value += zobrist.SHIP_KEYS[ship]
+    return System(owner, stars, ships, value & zobrist.MASK)
+
+
+##################
+# History
+##################
+
+
+def push_event(state: State, event: list) -> State:
+    """state with event added to the end of its history."""
+    return state._replace(history=(event, state.history))
+
+
+def history_events(state: State) -> list:
+    """The history as a list, oldest event first."""
+    events = []
+    node = state.history
+    while node is not None:
+        events.append(node[0])
+        node = node[1]
+    events.reverse()
+    return events
+
+
+##################
+# Conversion
+##################
+
+
+def from_gamestate(game: GAMESTATE) -> State:
+    systems = {system_id: make_system(system["star"]["owner"],
+                                      tuple(piece_key(piece) for piece in system["star"]["pieces"]),
+                                      tuple(ship_tuple(ship) for ship in system["ships"]))
+               for system_id, system in game["systems"].items()}
+    history = None
+    for event in game["history"]:
+        history = (event, history)
+    return State(tuple(game["reserve"][key] for key in PIECE_KEYS), systems, tuple(game["players"]),
+                 game["current_player"], game["system_count"], game["owner_count"], game["hash"],
+                 dict(game["homeworlds"]), history)
+
+
+def to_gamestate(state: State) -> GAMESTATE:
+    """A new GAMESTATE dict (sharing nothing with state)."""
+    game = {
+        "reserve": {key: state.reserve[index] for index, key in enumerate(PIECE_KEYS)},
+        "systems": {system_id: {"star": {"owner": system.owner, "pieces": [piece_dict(key) for key in system.stars]},
+                                "ships": [ship_dict(ship) for ship in system.ships]}
+                    for system_id, system in state.systems.items()},
+        "players": list(state.players),
+        "current_player": state.current_player,
+        "history": History(history_events(state)),
+        "system_count": state.system_count,
+        "owner_count": state.owner_count
+    }
+    return rebuild_indexes(game)
+
+
+##################
+# Changes
+##################
+
+
+class _Edit(object):
+    """Builds a child of a State, copying the reserve, systems and homeworlds only if
+    the action changes them."""
+
+    def __init__(self, state: State):
+        self.state = state
+        self.reserve = None
+        self.systems = None
+        self.homeworlds = None
+        self.hash = state.hash
+        self.system_count = state.system_count
+        self.player = state.current_player
+
+    def system(self, system_id: int) -> System:
+        return (self.systems if self.systems is not None else self.state.systems)[system_id]
+
+    def in_reserve(self, key: str) -> int:
+        return (self.reserve if self.reserve is not None else self.state.reserve)[PIECE_INDEX[key]]
+
+    def add_to_reserve(self, key: str, count: int=1) -> type(None):
+        if self.reserve is None:
+            self.reserve = list(self.state.reserve)
+        self.reserve[PIECE_INDEX[key]] += count
+        self.hash += count * zobrist.RESERVE_KEYS[key]
+
+    def set_system(self, system_id: int, system: System) -> type(None):
+        if self.systems is None:
+            self.systems = dict(self.state.systems)
+        old = self.systems.get(system_id)
+        if old is not None:
+            self.hash -= zobrist.mix(old.hash)
+        self.systems[system_id] = system
+        self.hash += zobrist.mix(system.hash)
+
+    def add_system(self, owner: int, stars: tuple, ships: tuple) -> int:
+        self.system_count += 1
+        self.set_system(self.system_count, make_system(owner, stars, ships))
+        if owner != NO_OWNER:
+            self._homeworlds()[owner] = self.system_count
+        return self.system_count
+
+    def destroy_system(self, system_id: int) -> type(None):
+        """Takes a system off the board, returning its pieces to the reserve."""
+        system = self.system(system_id)
+        for _, key in system.ships:
+            self.add_to_reserve(key)
+        for key in system.stars:
+            self.add_to_reserve(key)
+        if self.systems is None:
+            self.systems = dict(self.state.systems)
+        del self.systems[system_id]
+        self.hash -= zobrist.mix(system.hash)
+        if system.owner != NO_OWNER:
+            del self._homeworlds()[system.owner]
+
+    def _homeworlds(self) -> dict:
+        if self.homeworlds is None:
+            self.homeworlds = dict(self.state.homeworlds)
+        return self.homeworlds
+
+    def add_ship(self, system_id: int, ship: tuple) -> type(None):
+        system = self.system(system_id)
+        self.set_system(system_id, System(system.owner, system.stars, system.ships + (ship,),
+                                          (system.hash + zobrist.SHIP_KEYS[ship]) & zobrist.MASK))
+
+    def remove_ship(self, system_id: int, ship: tuple) -> type(None):
+        """Removes the first ship equal to ship."""
+        system = self.system(system_id)
+        index = system.ships.index(ship)
+        self.set_system(system_id, System(system.owner, system.stars, system.ships[:index] + system.ships[index + 1:],
+                                          (system.hash - zobrist.SHIP_KEYS[ship]) & zobrist.MASK))
+
+    def replace_ship(self, system_id: int, ship: tuple, new_ship: tuple) -> type(None):
+        system = self.system(system_id)
+        index = system.ships.index(ship)
+        ships = system.ships[:index] + (new_ship,) + system.ships[index + 1:]
+        self.set_system(system_id, System(system.owner, system.stars, ships, (
+            system.hash - zobrist.SHIP_KEYS[ship] + zobrist.SHIP_KEYS[new_ship]) & zobrist.MASK))
+
+    def destroy_if_abandoned(self, system_id: int) -> type(None):
+        system = self.system(system_id)
+        if not system.ships and system.owner == NO_OWNER:
+            self.destroy_system(system_id)
+
+    def done(self) -> State:
+        state = self.state
+        return State(tuple(self.reserve) if self.reserve is not None else state.reserve,
+                     self.systems if self.systems is not None else state.systems,
+                     state.players, state.current_player, self.system_count, state.owner_count,
+                     self.hash & zobrist.MASK,
+                     self.homeworlds if self.homeworlds is not None else state.homeworlds,
+                     state.history)
+
+
+def _construct(edit: _Edit, system_id: int, color: str) -> type(None):
+    for size in (1, 2, 3):
+        key = color[0] + str(size)
+        if edit.in_reserve(key):
+            edit.add_to_reserve(key, -1)
+            edit.add_ship(system_id, (edit.player, key))
+            return
+
+
+def _move(edit: _Edit, from_system: int, ship: dict, to_system) -> type(None):
+    ship = ship_tuple(ship)
+    edit.remove_ship(from_system, ship)
+    edit.destroy_if_abandoned(from_system)
+    if isinstance(to_system, dict):
+        key = piece_key(to_system["new_piece"])
+        edit.add_to_reserve(key, -1)
+        to_system = edit.add_system(NO_OWNER, (key,), ())
+    edit.add_ship(to_system, ship)
+
+
+def _trade(edit: _Edit, system_id: int, ship: dict, color: str) -> type(None):
+    ship = ship_tuple(ship)
+    new_key = color[0] + ship[1][1]
+    edit.remove_ship(system_id, ship)
+    edit.add_to_reserve(ship[1])
+    edit.add_to_reserve(new_key, -1)
+    edit.add_ship(system_id, (edit.player, new_key))
+
+
+def _attack(edit: _Edit, system_id: int, ship: dict) -> type(None):
+    ship = ship_tuple(ship)
+    edit.replace_ship(system_id, ship, (edit.player, ship[1]))
+
+
+def _sacrifice(edit: _Edit, system_id: int, ship: dict, subsequent_actions: list) -> type(None):
+    ship = ship_tuple(ship)
+    edit.remove_ship(system_id, ship)
+    edit.add_to_reserve(ship[1])
+    edit.destroy_if_abandoned(system_id)
+    for action, args in subsequent_actions:
+        _EDITS[action](edit, *args)
+
+
+def _catastrophe(edit: _Edit, system_id: int, color: str) -> type(None):
+    system = edit.system(system_id)
+    initial = color[0]
+    stars = tuple(key for key in system.stars if key[0] != initial)
+    if not stars:
+        edit.destroy_system(system_id)
+        return
+    ships = tuple(ship for ship in system.ships if ship[1][0] != initial)
+    for key in system.stars:
+        if key[0] == initial:
+            edit.add_to_reserve(key)
+    for _, key in system.ships:
+        if key[0] == initial:
+            edit.add_to_reserve(key)
+    if len(stars) != len(system.stars) or len(ships) != len(system.ships):
+        edit.set_system(system_id, make_system(system.owner, stars, ships))
+    edit.destroy_if_abandoned(system_id)
+
+
+def _setup(edit: _Edit, star_pieces: list, ship_piece: dict) -> type(None):
+    stars = tuple(piece_key(piece) for piece in star_pieces)
+    for key in stars:
+        edit.add_to_reserve(key, -1)
+    ship_key = piece_key(ship_piece)
+    edit.add_to_reserve(ship_key, -1)
+    system_id = edit.add_system(edit.player, stars, ())
+    edit.add_ship(system_id, (edit.player, ship_key))
+
+
+_EDITS = {
+    "construct": _construct,
+    "move": _move,
+    "trade": _trade,
+    "attack": _attack,
+    "sacrifice": _sacrifice,
+    "catastrophe": _catastrophe,
+    "setup": _setup
+}
+
+
+def _action(edit_function):
+    def action(state: State, *args) -> State:
+        edit = _Edit(state)
+        edit_function(edit, *args)
+        return edit.done()
+    action.__name__ = edit_function.__name__[1:]
+    action.__doc__ = "Like game.{}, returning a new State.".format(action.__name__)
+    return action
+
+
+construct = _action(_construct)
+move = _action(_move)
+trade = _action(_trade)
+attack = _action(_attack)
+sacrifice = _action(_sacrifice)
+catastrophe = _action(_catastrophe)
+setup = _action(_setup)
+
+ACTION_FUNCTIONS = {
+    "construct": construct,
+    "move": move,
+    "trade": trade,
+    "attack": attack,
+    "sacrifice": sacrifice,
+    "catastrophe": catastrophe,
+    "setup": setup
+}
+
+
+def set_current_player(state: State, player: int) -> State:
+    return state._replace(current_player=player, hash=(
+        state.hash - zobrist.TO_MOVE_KEYS[state.current_player] + zobrist.TO_MOVE_KEYS[player]) & zobrist.MASK)
+
+
+def following_player(state: State) -> int:
+    players = state.players
+    return players[(players.index(state.current_player) + 1) % len(players)]
+
+
+def apply_turn(state: State, turn: list, next_player: int=None, record: bool=False) -> State:
+    """Plays a bot turn (["action", args, ...]) as one child State, then hands the turn to
+    next_player if given.  With record, the turn is added to the history as play_game
+    does (["p<player>", turn])."""
+    edit = _Edit(state)
+    for index in range(0, len(turn), 2):
+        _EDITS[turn[index]](edit, *turn[index + 1])
+    child = edit.done()
+    if record:
+        child = push_event(child, ["p{}".format(state.current_player), turn])
+    if next_player is not None:
+        child = set_current_player(child, next_player)
+    return child
+
+
+def losers(state: State) -> list:
+    """Same rule as main.check_player_lost."""
+    lost = []
+    for player in state.players:
+        system_id = state.homeworlds.get(player)
+        if system_id is None or not any(owner == player for owner, _ in state.systems[system_id].ships):
+            lost.append(player)
+    return lost
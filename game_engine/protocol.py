@@ -0,0 +1,121 @@
+"""Messages between the engine and out-of-process bots: one JSON object per line.
+
+Bot to engine:
+    {"type": "hello", "bot": name, "games": how many games at once it will play}
+    {"type": "turn", "game": game id, "turn": ["action", args, ...], "stats": {...} (optional)}
+    {"type": "error", "game": game id, "message": "..."} (take_turn raised)
+Engine to bot:
+    {"type": "start", "game": game id, "player": the bot's player id, "players": [...],
+     "seed": seed for the bot's random numbers, or null}
+    {"type": "turn", "game": game id, "state": state, "message": "", "time_left": seconds or null}
+    {"type": "end", "game": game id, "winner": id or null, "losers": [...], "reason": "..."}
+    {"type": "error", "message": "..."}
+States are encoded with serialization.encode_game, without history.
+"""
+
+import json
+
+from game import (
+    GAMESTATE,
+)
+from serialization import (
+    decode_game,
+    encode_game,
+)
+
+
+PROTOCOL_VERSION = 1
+# longest line accepted, in bytes
+MAX_MESSAGE = 1 << 24
+
+
+class ProtocolError(Exception):
+    """A message that isn't a JSON object with a type."""
+
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def decode(line: bytes) -> dict:
+    try:
+        message = json.loads(line)
+    except ValueError as exc:
+        raise ProtocolError("Not JSON: {!r}".format(line[:200])) from exc
+    if not isinstance(message, dict) or "type" not in message:
+        raise ProtocolError("Not a message: {!r}".format(line[:200]))
+    return message
+
+
+def hello(bot: str, games: int=1) -> dict:
+    return {"type": "hello", "bot": bot, "games": games, "version": PROTOCOL_VERSION}
+
+
+def start(game_id, player: int, players: list, seed: int=None) -> dict:
+    return {"type": "start", "game": game_id, "player": player, "players": players, "seed": seed}
+
+
+def turn_request(game_id, game: GAMESTATE, message: str, time_left: float=None) -> dict:
+    return {"type": "turn", "game": game_id, "state": encode_game(game, include_history=False),
+            "message": message, "time_left": time_left}
+
+
+def turn_reply(game_id, turn: list, stats: dict=None) -> dict:
+    reply = {"type": "turn", "game": game_id, "turn": turn}
+    if stats is not None:
+        reply["stats"] = stats
+    return reply
+
+
+def end(game_id, summary: dict) -> dict:
+    return {"type": "end", "game": game_id, "winner": summary["winner"], "losers": summary["losers"],
+            "reason": summary["reason"]}
+
+
+def error(message: str, game_id=None) -> dict:
+    reply = {"type": "error", "message": message}
+    if game_id is not None:
+        reply["game"] = game_id
+    return reply
+
+
+def request_state(request: dict) -> GAMESTATE:
+    """The game state of a turn request."""
+    return decode_game(request["state"])
+
+
+##################
+# asyncio streams
+##################
+
+
+async def read_message(reader) -> dict:
+    """Next message from an asyncio StreamReader, or None at end of stream."""
+    line = await reader.readline()
+    if not line:
+        return None
+    return decode(line)
+
+
+async def write_message(writer, message: dict) -> type(None):
+    """Writes a message to an asyncio StreamWriter, waiting while its buffer is full."""
+    writer.write(encode(message))
+    await writer.drain()
+
+
+##################
+# Blocking files (pipes, stdin/stdout)
+##################
+
+
+def read_message_from(stream) -> dict:
+    """Next message from a binary file, or None at end of file."""
+    line = stream.readline(MAX_MESSAGE)
+    if not line:
+        return None
+    return decode(line)
+
+
+def write_message_to(stream, message: dict) -> type(None):
+    stream.write(encode(message))
+    stream.flush()
@@ -0,0 +1,156 @@
+"""Random access to logged games.
+
+usage: python replay.py LOG_FILE TURN
+
+Replay reads a game log (see game_log.py) through mmap.  The state after any turn is
+rebuilt from the nearest keyframe at or before it, applying only the turns in between.
+Logs are trusted, so turns are applied without validators and with schema checks off.
+scan_games reads just the header and end record of each log, to go over a large corpus
+of games without parsing their turns.
+"""
+
+from bisect import (
+    bisect_right,
+)
+import json
+import mmap
+import sys
+
+from game import (
+    GAMESTATE,
+    ACTION_METHODS,
+    following_player,
+    set_current_player,
+)
+from game_log import (
+    TRAILER_SIZE,
+)
+from serialization import (
+    decode_game,
+)
+from validation import (
+    OFF,
+    set_validation_level,
+)
+
+
+class Replay(object):
+    """An open game log.  Use as a context manager, or call close."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index = self._read_index()
+        if self.index is None:
+            self.index = self._scan_index()
+        self.header = self._record_at(0)
+        self._keyframe_turns = [turn for turn, _ in self.index["keyframes"]]
+
+    @property
+    def turn_count(self) -> int:
+        return len(self.index["turns"])
+
+    @property
+    def end(self) -> dict:
+        """The end record, or None if the game was cut short."""
+        if self.index["end"] is None:
+            return None
+        return self._record_at(self.index["end"])
+
+    def _record_at(self, offset: int) -> dict:
+        end = self._map.find(b"\n", offset)
+        return json.loads(self._map[offset:end])
+
+    def _read_index(self) -> dict:
+        """The index the trailer points at, or None if the log has no trailer."""
+        if len(self._map) < TRAILER_SIZE:
+            return None
+        try:
+            trailer = json.loads(self._map[-TRAILER_SIZE:])
+        except ValueError:
+            return None
+        if not isinstance(trailer, dict) or trailer.get("type") != "trailer":
+            return None
+        return self._record_at(trailer["index"])
+
+    def _scan_index(self) -> dict:
+        """Builds the index by reading every line, for logs cut short by a crash."""
+        index = {"type": "index", "turns": [], "keyframes": [], "end": None}
+        offset = 0
+        while True:
+            end = self._map.find(b"\n", offset)
+            if end < 0:
+                # nothing left, or a partial last line
+                break
+            record = json.loads(self._map[offset:end])
+            if record["type"] == "turn":
+                index["turns"].append(offset)
+            elif record["type"] == "keyframe":
+                index["keyframes"].append([record["turn"], offset])
+            elif record["type"] == "end":
+                index["end"] = offset
+            offset = end + 1
+        return index
+
+    def turn(self, turn_number: int) -> dict:
+        """The record of turn turn_number (1-based)."""
+        return self._record_at(self.index["turns"][turn_number - 1])
+
+    def turns(self, start: int=1, stop: int=None):
+        """Yields turn records start..stop (inclusive, 1-based)."""
+        stop = self.turn_count if stop is None else stop
+        for turn_number in range(start, stop + 1):
+            yield self.turn(turn_number)
+
+    def state_at(self, turn_number: int) -> GAMESTATE:
+        """The state after turn_number turns (0 for the start), with the next player to move.
+        The returned state has an empty history."""
+        if not 0 <= turn_number <= self.turn_count:
+            raise IndexError("Turn {} is not in this game ({} turns).".format(turn_number, self.turn_count))
+        position = bisect_right(self._keyframe_turns, turn_number) - 1
+        if position < 0:
+            raise ValueError("{} has no keyframe at or before turn {}.".format(self.path, turn_number))
+        keyframe_turn, offset = self.index["keyframes"][position]
+        game = decode_game(self._record_at(offset)["state"])
+
+        previous_level = set_validation_level(OFF)
+        try:
+            for record in self.turns(keyframe_turn + 1, turn_number):
+                actions = record["actions"]
+                for index in range(0, len(actions), 2):
+                    game = ACTION_METHODS[actions[index]](game, *actions[index + 1])
+                if record["turn"] < self.turn_count:
+                    next_player = self.turn(record["turn"] + 1)["player"]
+                else:
+                    next_player = following_player(game)
+                game = set_current_player(game, next_player)
+        finally:
+            set_validation_level(previous_level)
+        return game
+
+    def close(self) -> type(None):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def scan_games(paths: list):
+    """Yields (path, header, end record or None) for each game log."""
+    for path in paths:
+        with Replay(path) as replay:
+            yield path, replay.header, replay.end
+
+
+def main(argv: list) -> type(None):
+    with Replay(argv[0]) as replay:
+        print(replay.state_at(int(argv[1])))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
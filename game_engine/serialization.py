@@ -0,0 +1,42 @@
+"""JSON-safe forms of game states, for logs, replays and the network.
+
+JSON object keys are strings, so a game's systems (keyed by int id) are stored as a list
+of [id, system] pairs, which also keeps their order.  The undo journal of a game in the
+middle of a search is never stored.  Indexes the engine derives from the board (hashes,
+system counts, homeworlds) are rebuilt on decoding rather than stored, as some of them
+have keys JSON can't hold.
+"""
+
+import json
+
+from game import (
+    GAMESTATE,
+    History,
+    rebuild_indexes,
+)
+
+
+def encode_game(game: GAMESTATE, include_history: bool=True) -> dict:
+    """Returns a JSON-safe version of game, sharing its data (not a copy)."""
+    data = {key: value for key, value in game.items()
+            if key not in ("systems", "history", "homeworlds", "undo_journal")}
+    data["systems"] = [[system_id, {key: value for key, value in system.items() if key not in ("hash", "counts")}]
+                       for system_id, system in game["systems"].items()]
+    data["history"] = list(game["history"]) if include_history else []
+    return data
+
+
+def decode_game(data: dict) -> GAMESTATE:
+    """Returns a game from encode_game's output (after a round trip through JSON)."""
+    game = {key: value for key, value in data.items() if key not in ("systems", "history")}
+    game["systems"] = {int(system_id): system for system_id, system in data["systems"]}
+    game["history"] = History(data.get("history", []))
+    return rebuild_indexes(game)
+
+
+def dumps_game(game: GAMESTATE, include_history: bool=True) -> str:
+    return json.dumps(encode_game(game, include_history), separators=(",", ":"))
+
+
+def loads_game(text: str) -> GAMESTATE:
+    return decode_game(json.loads(text))
@@ -0,0 +1,437 @@
+"""Game server: a ladder of many concurrent matches between bots connected over sockets.
+
+usage: python server.py [--host H] [--port P] [--unix PATH] [--move-time S] [--game-time S]
+                        [--increment S] [--max-turns T] [--max-invalid-turns N]
+                        [--max-in-flight N] [--log-dir DIR]
+
+Bots connect over TCP and/or a Unix socket and speak protocol.py (see bot_client.py).  A
+bot's hello says how many games it will play at once; each of those is a seat, and the
+matchmaker pairs free seats from different connections into matches.  When a match ends
+both seats go back in the queue, so a connected bot keeps playing until it disconnects.
+
+Everything runs on one asyncio event loop, with one task per match and one reader task
+per connection.  Turns are checked with main.interpret_bot_input, as in main.play_game.
+Each match has its own Clock; the time a turn takes is measured by the server, from
+sending the request to receiving the answer.  A connection has at most --max-in-flight
+unanswered turn requests, and writes wait while its send buffer is full, so a slow bot
+holds up its own matches and nothing else.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+
+from bot_worker import (
+    BotError,
+    Clock,
+    TimeControl,
+)
+from game import (
+    create_game,
+    following_player,
+    set_current_player,
+)
+from game_log import (
+    GameLogWriter,
+)
+from main import (
+    DEFAULT_MAX_INVALID_TURNS,
+    check_player_lost,
+    interpret_bot_input,
+)
+import protocol
+from protocol import (
+    MAX_MESSAGE,
+    ProtocolError,
+    read_message,
+    write_message,
+)
+
+
+DEFAULT_PORT = 7878
+DEFAULT_MAX_TURNS = 1000
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+class BotDisconnected(Exception):
+    """The bot's connection closed while it had a turn to play."""
+
+
+class Connection(object):
+    """One connected bot.  Answers are matched to requests by game id, so a bot can play
+    several games over one connection."""
+
+    def __init__(self, reader, writer, max_in_flight: int=DEFAULT_MAX_IN_FLIGHT):
+        self.reader = reader
+        self.writer = writer
+        self.bot = None
+        self.games = 1
+        self.closed = False
+        self._pending = {}
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._send_lock = asyncio.Lock()
+
+    def __repr__(self):
+        return "Connection({!r}, {})".format(self.bot, self.writer.get_extra_info("peername"))
+
+    async def handshake(self) -> type(None):
+        hello = await read_message(self.reader)
+        if hello is None or hello["type"] != "hello" or not isinstance(hello.get("bot"), str):
+            raise ProtocolError("Expected hello, got {!r}.".format(hello))
+        self.bot = hello["bot"]
+        self.games = max(1, int(hello.get("games", 1)))
+
+    async def send(self, message: dict) -> type(None):
+        if self.closed:
+            raise BotDisconnected("bot {} disconnected".format(self.bot))
+        async with self._send_lock:
+            try:
+                await write_message(self.writer, message)
+            except (ConnectionError, OSError) as exc:
+                self.close()
+                raise BotDisconnected("bot {} disconnected: {!r}".format(self.bot, exc))
+
+    async def request_turn(self, game_id, game: dict, message: str, time_left: float=None) -> (list, float):
+        """Asks for a turn in game game_id, returns (turn, seconds taken to answer).
+        Waits at most time_left seconds for the answer, not counting the wait for a free
+        in-flight slot.  Raises asyncio.TimeoutError, BotDisconnected, or BotError if the bot
+        reports that it failed."""
+        async with self._in_flight:
+            loop = asyncio.get_running_loop()
+            answer = loop.create_future()
+            self._pending[game_id] = answer
+            start = loop.time()
+            try:
+                await self.send(protocol.turn_request(game_id, game, message, time_left))
+                turn = await asyncio.wait_for(answer, time_left)
+            finally:
+                self._pending.pop(game_id, None)
+            return turn, loop.time() - start
+
+    async def read_loop(self) -> type(None):
+        """Hands answers to the matches waiting for them, until the connection closes."""
+        try:
+            while True:
+                try:
+                    message = await read_message(self.reader)
+                except ProtocolError as exc:
+                    await self.send(protocol.error(str(exc)))
+                    continue
+                if message is None:
+                    break
+                answer = self._pending.get(message.get("game"))
+                if answer is None or answer.done():
+                    continue
+                if message["type"] == "turn":
+                    answer.set_result(message.get("turn"))
+                elif message["type"] == "error":
+                    answer.set_exception(BotError(message.get("message")))
+        except (ConnectionError, OSError, ValueError, BotDisconnected):
+            # ValueError: a line longer than MAX_MESSAGE
+            pass
+        finally:
+            self.close()
+
+    def close(self) -> type(None):
+        if self.closed:
+            return
+        self.closed = True
+        for answer in self._pending.values():
+            if not answer.done():
+                answer.set_exception(BotDisconnected("bot {} disconnected".format(self.bot)))
+        self.writer.close()
+
+
+async def play_match(connections: dict, game_id, seed: int=None, time_control: TimeControl=None,
+                     max_turns: int=DEFAULT_MAX_TURNS, max_invalid_turns: int=DEFAULT_MAX_INVALID_TURNS,
+                     log_file: str=None) -> dict:
+    """Plays one game between connected bots ({player id: Connection}), returns a summary
+    like main.play_game's, without resource stats.  Bots get no history."""
+    bots = {player: connection.bot for player, connection in connections.items()}
+    rng = random.Random(seed)
+    gamestate = create_game(players=sorted(connections))
+    gamestate = set_current_player(gamestate, rng.choice(gamestate["players"]))
+    clock = Clock(time_control, gamestate["players"]) if time_control is not None else None
+    summary = {"game": game_id, "bots": bots, "seed": seed, "first_player": gamestate["current_player"],
+               "turns": 0, "losers": [], "winner": None, "reason": "",
+               "invalid_turns": {player: 0 for player in bots}}
+
+    log = None
+    if log_file is not None:
+        log = GameLogWriter(log_file)
+        log.write_header(bots, seed, summary["first_player"], list(gamestate["players"]))
+        log.checkpoint(0, gamestate)
+
+    def forfeit(player, reason):
+        summary["losers"] = [player]
+        summary["reason"] = "player {} forfeits, {}".format(player, reason)
+
+    turn_count = 0
+    try:
+        for player, connection in connections.items():
+            try:
+                await connection.send(protocol.start(game_id, player, gamestate["players"], seed))
+            except BotDisconnected as exc:
+                forfeit(player, str(exc))
+
+        while not summary["losers"] and (max_turns is None or turn_count < max_turns):
+            player = gamestate["current_player"]
+            connection = connections[player]
+            message = ""
+            attempts = 0
+            wall = 0.0
+            # one budget for the whole move: retries after invalid turns use what is left of it
+            budget = clock.budget(player) if clock is not None else None
+            try:
+                while True:
+                    try:
+                        turn, seconds = await connection.request_turn(game_id, gamestate, message, budget)
+                    except asyncio.TimeoutError:
+                        clock.charge(player, budget)
+                        raise
+                    wall += seconds
+                    if clock is not None:
+                        clock.charge(player, seconds)
+                    if budget is not None:
+                        budget = max(0.0, budget - seconds)
+                    attempts += 1
+                    try:
+                        result = interpret_bot_input(gamestate, turn)
+                    except Exception as exc:
+                        result = (False, "Invalid turn: {!r}".format(exc))
+                    if result[0]:
+                        break
+                    summary["invalid_turns"][player] += 1
+                    if log is not None:
+                        log.write({"type": "invalid", "player": player, "actions": turn, "message": result[1]})
+                    if max_invalid_turns is not None and attempts > max_invalid_turns:
+                        forfeit(player, "too many invalid turns, last: {}".format(result[1]))
+                        break
+                    if budget == 0.0:
+                        raise asyncio.TimeoutError()
+                    message = result[1]
+            except asyncio.TimeoutError:
+                forfeit(player, "lost on time")
+                break
+            except BotDisconnected as exc:
+                forfeit(player, str(exc))
+                break
+            except BotError as exc:
+                forfeit(player, "bot raised {}".format(exc))
+                break
+            if summary["losers"]:
+                break
+            if clock is not None:
+                clock.end_move(player)
+
+            gamestate = result[1]
+            turn_count += 1
+            if log is not None:
+                log.write_turn(turn_count, player, turn, wall=wall)
+
+            # don't check for lose conditions on setup turns
+            if turn_count > len(gamestate["players"]):
+                losers = check_player_lost(gamestate)
+                if losers:
+                    summary["losers"] = losers
+                    summary["reason"] = "players {} have lost".format(losers)
+                    break
+
+            gamestate = set_current_player(gamestate, following_player(gamestate))
+            if log is not None:
+                log.checkpoint(turn_count, gamestate)
+        else:
+            if not summary["losers"]:
+                summary["reason"] = "draw after {} turns".format(turn_count)
+    finally:
+        summary["turns"] = turn_count
+        remaining = [player for player in gamestate["players"] if player not in summary["losers"]]
+        if summary["losers"] and len(remaining) == 1:
+            summary["winner"] = remaining[0]
+        if log is not None:
+            log.write_end(turn_count, summary["losers"], summary["winner"], summary["reason"] or "aborted")
+            log.close()
+
+    for connection in connections.values():
+        try:
+            await connection.send(protocol.end(game_id, summary))
+        except BotDisconnected:
+            pass
+    return summary
+
+
+class GameServer(object):
+    """Accepts bot connections and keeps their seats busy with matches."""
+
+    def __init__(self, time_control: TimeControl=None, max_turns: int=DEFAULT_MAX_TURNS,
+                 max_invalid_turns: int=DEFAULT_MAX_INVALID_TURNS, max_in_flight: int=DEFAULT_MAX_IN_FLIGHT,
+                 log_dir: str=None, seed: int=None, allow_self_play: bool=False, verbose: bool=True):
+        self.time_control = time_control
+        self.max_turns = max_turns
+        self.max_invalid_turns = max_invalid_turns
+        self.max_in_flight = max_in_flight
+        self.log_dir = log_dir
+        self.allow_self_play = allow_self_play
+        self.verbose = verbose
+        self.rng = random.Random(seed)
+        self.standings = {}
+        self.results = []
+        self.matches = set()
+        self.connections = set()
+        self._handlers = set()
+        self._game_ids = itertools.count(1)
+        self._seats = asyncio.Queue()
+        self._servers = []
+
+    async def handle_connection(self, reader, writer) -> type(None):
+        connection = Connection(reader, writer, self.max_in_flight)
+        try:
+            await connection.handshake()
+        except (ProtocolError, ConnectionError, ValueError) as exc:
+            try:
+                await write_message(writer, protocol.error(str(exc)))
+            except (ConnectionError, OSError):
+                pass
+            writer.close()
+            return
+        if self.verbose:
+            print("{!r} connected, {} seats".format(connection, connection.games), file=sys.stderr)
+        for _ in range(connection.games):
+            self._seats.put_nowait(connection)
+        self.connections.add(connection)
+        self._handlers.add(asyncio.current_task())
+        try:
+            await connection.read_loop()
+        finally:
+            self.connections.discard(connection)
+            self._handlers.discard(asyncio.current_task())
+
+    async def matchmaker(self) -> type(None):
+        """Pairs free seats from different connections, forever."""
+        waiting = []
+        while True:
+            seat = await self._seats.get()
+            waiting = [other for other in waiting if not other.closed]
+            if seat.closed:
+                continue
+            for index, other in enumerate(waiting):
+                if other is not seat or self.allow_self_play:
+                    waiting.pop(index)
+                    self._start_match(other, seat)
+                    break
+            else:
+                waiting.append(seat)
+
+    def _start_match(self, first, second) -> type(None):
+        game_id = next(self._game_ids)
+        connections = {1: first, 2: second}
+        log_file = None
+        if self.log_dir is not None:
+            log_file = os.path.join(self.log_dir, "game_{:08d}_{}_vs_{}.jsonl".format(game_id, first.bot, second.bot))
+        match = asyncio.create_task(play_match(
+            connections, game_id, seed=self.rng.getrandbits(32), time_control=self.time_control,
+            max_turns=self.max_turns, max_invalid_turns=self.max_invalid_turns, log_file=log_file))
+        self.matches.add(match)
+        match.add_done_callback(lambda task: self._match_done(task, connections))
+
+    def _match_done(self, match, connections: dict) -> type(None):
+        self.matches.discard(match)
+        if not match.cancelled() and match.exception() is None:
+            self.record(match.result())
+        elif not match.cancelled() and self.verbose:
+            print("match crashed: {!r}".format(match.exception()), file=sys.stderr)
+        for connection in connections.values():
+            if not connection.closed:
+                self._seats.put_nowait(connection)
+
+    def record(self, summary: dict) -> type(None):
+        self.results.append(summary)
+        for player, bot in summary["bots"].items():
+            row = self.standings.setdefault(bot, {"games": 0, "wins": 0, "losses": 0, "draws": 0})
+            row["games"] += 1
+            if summary["winner"] == player:
+                row["wins"] += 1
+            elif player in summary["losers"]:
+                row["losses"] += 1
+            else:
+                row["draws"] += 1
+        if self.verbose:
+            print("game {game}: {bots} - {reason}".format(**summary), file=sys.stderr)
+
+    async def start(self, host: str=None, port: int=None, unix_path: str=None) -> type(None):
+        """Starts listening on TCP (if port is given) and a Unix socket (if unix_path is given)."""
+        if port is not None:
+            self._servers.append(await asyncio.start_server(
+                self.handle_connection, host, port, limit=MAX_MESSAGE))
+        if unix_path is not None:
+            self._servers.append(await asyncio.start_unix_server(
+                self.handle_connection, unix_path, limit=MAX_MESSAGE))
+        self._matchmaker = asyncio.create_task(self.matchmaker())
+
+    async def close(self) -> type(None):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._matchmaker.cancel()
+        for match in list(self.matches):
+            match.cancel()
+        await asyncio.gather(self._matchmaker, *self.matches, return_exceptions=True)
+        for connection in list(self.connections):
+            connection.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def serve_forever(self, host: str=None, port: int=None, unix_path: str=None) -> type(None):
+        await self.start(host, port, unix_path)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.close()
+
+
+def format_standings(standings: dict) -> str:
+    lines = ["{:<20} {:>6} {:>6} {:>6} {:>6}".format("bot", "games", "wins", "losses", "draws")]
+    for bot, row in sorted(standings.items(), key=lambda item: -item[1]["wins"]):
+        lines.append("{:<20} {games:>6} {wins:>6} {losses:>6} {draws:>6}".format(bot, **row))
+    return "\n".join(lines)
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Host a ladder of games between connected bots.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="TCP port (default {} if no --unix)".format(DEFAULT_PORT))
+    parser.add_argument("--unix", default=None, help="Unix socket path")
+    parser.add_argument("--move-time", type=float, default=None, help="seconds per move")
+    parser.add_argument("--game-time", type=float, default=None, help="seconds per player per game")
+    parser.add_argument("--increment", type=float, default=0.0, help="seconds added after each move")
+    parser.add_argument("--max-turns", type=int, default=DEFAULT_MAX_TURNS)
+    parser.add_argument("--max-invalid-turns", type=int, default=DEFAULT_MAX_INVALID_TURNS)
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="unanswered turn requests allowed per connection")
+    parser.add_argument("--log-dir", default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    port = args.port
+    if port is None and args.unix is None:
+        port = DEFAULT_PORT
+    time_control = None
+    if args.move_time is not None or args.game_time is not None:
+        time_control = TimeControl(args.move_time, args.game_time, args.increment)
+    if args.log_dir is not None:
+        os.makedirs(args.log_dir, exist_ok=True)
+
+    server = GameServer(time_control, args.max_turns, args.max_invalid_turns, args.max_in_flight,
+                        args.log_dir, args.seed)
+    try:
+        asyncio.run(server.serve_forever(args.host, port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    print(format_standings(server.standings))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,279 @@
+"""Read-only views of game state, for handing the engine's own state to bots.
+
+view(game) wraps a GAMESTATE without copying anything: every lookup goes to the real
+state, and the dicts and lists it reaches are wrapped in turn as they are looked up.
+Views support the reading side of dict, list and set (game["systems"][id]["ships"],
+game["reserve"].items(), len, iteration, membership, ==); anything that would change the
+state raises ReadOnlyError.
+
+Dict and list views are dict and list subclasses, so isinstance checks (the schema
+decorators in validation.py and py_types) accept them, but their own storage is always
+empty; only the overridden methods are meaningful.
+
+A bot that needs a state it can change, to search it in place, takes thaw(game): a plain
+deep copy, by default without the history.  copy.deepcopy and pickle of a view also give
+plain dicts and lists.  json does not see list views' items; thaw before encoding.
+"""
+
+from collections.abc import (
+    ItemsView,
+    KeysView,
+    Set,
+    ValuesView,
+)
+import copy
+
+
+class ReadOnlyError(TypeError):
+    """A change was attempted through a read-only view."""
+
+
+def _read_only(self, *args, **kwargs):
+    raise ReadOnlyError("{} is read-only; use state_view.thaw for a copy that can be changed.".format(
+        type(self).__name__))
+
+
+def _wrap(value):
+    value_type = type(value)
+    if value_type is dict:
+        return DictView(value)
+    if isinstance(value, list):
+        if hasattr(value, "pending_validation"):
+            return HistoryView(value)
+        return ListView(value)
+    if value_type is set:
+        return SetView(value)
+    if value_type is tuple and any(type(item) in (dict, list, set) for item in value):
+        return tuple(_wrap(item) for item in value)
+    return value
+
+
+def _plain(data):
+    return data
+
+
+class DictView(dict):
+    __slots__ = ("_data", "_views")
+
+    def __init__(self, data: dict):
+        self._data = data
+        # wrapped values by key, so repeated lookups don't wrap again
+        self._views = {}
+
+    def __getitem__(self, key):
+        views = self._views
+        if key in views:
+            return views[key]
+        value = self._data[key]
+        wrapped = _wrap(value)
+        if wrapped is not value:
+            views[key] = wrapped
+        return wrapped
+
+    def get(self, key, default=None):
+        if key in self._data:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __reversed__(self):
+        return reversed(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return KeysView(self)
+
+    def values(self):
+        return ValuesView(self)
+
+    def items(self):
+        return ItemsView(self)
+
+    def __eq__(self, other):
+        if isinstance(other, DictView):
+            other = other._data
+        return self._data == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "DictView({!r})".format(self._data)
+
+    def copy(self) -> dict:
+        """A shallow, changeable copy, holding views."""
+        return {key: self[key] for key in self._data}
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._data, memo)
+
+    def __reduce_ex__(self, protocol):
+        return (_plain, (self._data,))
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _read_only
+
+
+class ListView(list):
+    __slots__ = ("_data",)
+
+    def __init__(self, data: list):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [_wrap(item) for item in self._data[index]]
+        return _wrap(self._data[index])
+
+    def __iter__(self):
+        for item in self._data:
+            yield _wrap(item)
+
+    def __reversed__(self):
+        for item in reversed(self._data):
+            yield _wrap(item)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, item):
+        return item in self._data
+
+    def index(self, item, *args):
+        return self._data.index(item, *args)
+
+    def count(self, item):
+        return self._data.count(item)
+
+    def __eq__(self, other):
+        if isinstance(other, ListView):
+            other = other._data
+        return self._data == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __mul__(self, count):
+        return list(self) * count
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return "ListView({!r})".format(self._data)
+
+    def copy(self) -> list:
+        """A shallow, changeable copy, holding views."""
+        return list(self)
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._data, memo)
+
+    def __reduce_ex__(self, protocol):
+        return (_plain, (self._data,))
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+
+
+class HistoryView(ListView):
+    """A view of a game.History.  Schema checks of the view go through History's record of
+    what has been checked, as they do for the state itself, instead of checking every event
+    again.  Marking events checked isn't a change to the game, so the view allows it."""
+    __slots__ = ()
+
+    @property
+    def item_schema(self):
+        return self._data.item_schema
+
+    @property
+    def validated(self) -> int:
+        return self._data.validated
+
+    def pending_validation(self):
+        return self._data.pending_validation()
+
+    def mark_validated(self) -> type(None):
+        self._data.mark_validated()
+
+
+class SetView(Set):
+    """Sets in the state only hold immutable values, so nothing below them is wrapped."""
+    __slots__ = ("_data",)
+
+    def __init__(self, data: set):
+        self._data = data
+
+    def __contains__(self, item):
+        return item in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "SetView({!r})".format(self._data)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._data, memo)
+
+    def __reduce_ex__(self, protocol):
+        return (_plain, (self._data,))
+
+
+_VIEWS = (DictView, ListView, SetView)
+
+
+def view(game: dict) -> DictView:
+    """A read-only view of game (or of any part of it)."""
+    return _wrap(game)
+
+
+def is_view(value) -> bool:
+    return isinstance(value, _VIEWS)
+
+
+def thaw(game, history: bool=False):
+    """A plain deep copy of a view (or of plain state), which can be changed.
+    A GAMESTATE's history is left empty unless history is True."""
+    data = game._data if isinstance(game, _VIEWS) else game
+    if history or not isinstance(data, dict) or "history" not in data:
+        return copy.deepcopy(data)
+    # one memo, so objects shared between parts of the state stay shared
+    memo = {}
+    return {key: type(value)() if key == "history" else copy.deepcopy(value, memo)
+            for key, value in data.items()}
+
+
+def unwrap(value):
+    """value with every view in it replaced by a plain deep copy, for turns that bots
+    built out of pieces of a view (a ship from game["systems"][id]["ships"], say)."""
+    if isinstance(value, _VIEWS):
+        return copy.deepcopy(value._data)
+    value_type = type(value)
+    if value_type is list:
+        return [unwrap(item) for item in value]
+    if value_type is tuple:
+        return tuple(unwrap(item) for item in value)
+    if value_type is dict:
+        return {key: unwrap(item) for key, item in value.items()}
+    return value
@@ -0,0 +1,73 @@
+"""Running counts of what is in each system, so validators don't scan ship and star lists.
+
+Every system carries system["counts"]:
+    "ships":         {(owner, color, size): number of such ships}
+    "owners":        {owner: number of ships}
+    "owner_colors":  {(owner, color): number of ships}
+    "owner_sizes":   {(owner, size): number of ships}
+    "colors":        {color: number of ships and stars}
+    "star_sizes":    {size: number of stars}
+    "overpopulated": set of colors with 4 or more ships and stars
+Keys whose count drops to 0 are removed, so `key in counts[...]` means "there is one".
+
+Like the zobrist hash, the counts are kept current by the primitives at the bottom of
+game.py; recount builds them from scratch for states made some other way.  Their keys
+are tuples, so serialization.py leaves them out and rebuilds them.
+"""
+
+OVERPOPULATION = 4
+
+
+def new_counts() -> dict:
+    return {"ships": {}, "owners": {}, "owner_colors": {}, "owner_sizes": {}, "colors": {}, "star_sizes": {},
+            "overpopulated": set()}
+
+
+def _bump(counter: dict, key, delta: int) -> int:
+    count = counter.get(key, 0) + delta
+    if count:
+        counter[key] = count
+    else:
+        del counter[key]
+    return count
+
+
+def _bump_color(counts: dict, color: str, delta: int) -> type(None):
+    if _bump(counts["colors"], color, delta) >= OVERPOPULATION:
+        counts["overpopulated"].add(color)
+    else:
+        counts["overpopulated"].discard(color)
+
+
+def add_ship(counts: dict, ship: dict, delta: int=1) -> type(None):
+    """Counts ship in (delta=1) or out (delta=-1)."""
+    owner = ship["owner"]
+    color = ship["piece"]["color"]
+    size = ship["piece"]["size"]
+    _bump(counts["ships"], (owner, color, size), delta)
+    _bump(counts["owners"], owner, delta)
+    _bump(counts["owner_colors"], (owner, color), delta)
+    _bump(counts["owner_sizes"], (owner, size), delta)
+    _bump_color(counts, color, delta)
+
+
+def add_star(counts: dict, piece: dict, delta: int=1) -> type(None):
+    """Counts a star piece in (delta=1) or out (delta=-1)."""
+    _bump(counts["star_sizes"], piece["size"], delta)
+    _bump_color(counts, piece["color"], delta)
+
+
+def count_system(system: dict) -> dict:
+    counts = new_counts()
+    for piece in system["star"]["pieces"]:
+        add_star(counts, piece)
+    for ship in system["ships"]:
+        add_ship(counts, ship)
+    return counts
+
+
+def recount(game: dict) -> dict:
+    """Computes every system's "counts" from scratch."""
+    for system in game["systems"].values():
+        system["counts"] = count_system(system)
+    return game
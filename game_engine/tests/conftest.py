@@ -0,0 +1,7 @@
+"""The engine's modules import each other by bare name (from game import ...), as they do
+when run from game_engine/; put that directory on the path for the tests."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,24 @@
+"""Scores the alpha-beta search gives turns that end the game."""
+
+from bots.alphabeta import (
+    WIN,
+    end_value,
+)
+
+
+def test_win_and_loss():
+    assert end_value(1, [2], [1, 2], 3) == WIN - 3
+    assert end_value(2, [2], [1, 2], 3) == -(WIN - 3)
+
+
+def test_quicker_wins_score_higher():
+    assert end_value(1, [2], [1, 2], 1) > end_value(1, [2], [1, 2], 5)
+
+
+def test_everyone_losing_is_a_draw():
+    assert end_value(1, [1, 2], [1, 2], 3) == 0
+    assert end_value(2, [2, 1], [1, 2], 3) == 0
+
+
+def test_losing_with_others_left_is_a_loss():
+    assert end_value(1, [1, 2], [1, 2, 3], 3) == -(WIN - 3)
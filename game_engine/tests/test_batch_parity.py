@@ -0,0 +1,186 @@
+"""batch.py re-implements game.py's rules as NumPy masks and actions; these tests keep the
+two in step.
+
+Positions are sampled from seeded random games played with game.py and loaded into a
+BatchGame, one per row.  In every row the legality masks must allow exactly the turns
+game.generate_legal_turns gives, sacrifices and setups aside, and the state random_step
+leaves must be the one game.apply_turn gives for one of those turns.  Batch states don't
+keep ship order, so states are compared with ships and stars sorted within each system.
+"""
+
+from collections import (
+    Counter,
+)
+import copy
+import functools
+import random
+
+import numpy as np
+import pytest
+
+import batch
+from compact import (
+    COLOR_ORDER,
+    piece_to_dict,
+)
+import game
+from validation import (
+    OFF,
+    set_validation_level,
+)
+
+
+SEEDS = 12
+STATES_PER_SEED = 12
+SACRIFICE_LIMIT = 1
+DESTRUCTIVE_CHANCE = 0.2
+MIN_PLIES = 4
+SAMPLE_CHANCE = 0.3
+
+
+@pytest.fixture(autouse=True)
+def no_schema_checks():
+    previous_level = set_validation_level(OFF)
+    yield
+    set_validation_level(previous_level)
+
+
+def random_turn(slow: dict, rng: random.Random) -> list:
+    """A random legal turn.  The action is picked first, and sacrifices and catastrophes
+    only now and then, so that games run long enough for fleets to meet."""
+    by_action = {}
+    for action, args in game.generate_legal_turns(slow, SACRIFICE_LIMIT):
+        by_action.setdefault(action, []).append(args)
+    if not by_action:
+        return None
+    actions = sorted(by_action)
+    if rng.random() >= DESTRUCTIVE_CHANCE:
+        actions = [action for action in actions if action not in ("sacrifice", "catastrophe")] or actions
+    action = rng.choice(actions)
+    return [action, list(rng.choice(by_action[action]))]
+
+
+@functools.lru_cache(maxsize=None)
+def sample_states(seed: int) -> tuple:
+    """Positions from random games, SAMPLE_CHANCE of those at least MIN_PLIES in, before
+    anyone has lost.  Shared between tests, which mustn't change them."""
+    rng = random.Random(seed)
+    states = []
+    while len(states) < STATES_PER_SEED:
+        slow = game.create_game(first_player=rng.choice([1, 2]))
+        for ply in range(60):
+            turn = random_turn(slow, rng)
+            if turn is None:
+                break
+            game.apply_turn(slow, turn, game.following_player(slow))
+            if ply >= 1 and game_over(slow):
+                break
+            if ply >= MIN_PLIES and rng.random() < SAMPLE_CHANCE:
+                states.append(copy.deepcopy(slow))
+    return tuple(states[:STATES_PER_SEED])
+
+
+def game_over(slow: dict) -> bool:
+    return any(slow["homeworlds"].get(player) is None or
+               player not in slow["systems"][slow["homeworlds"][player]]["counts"]["owners"]
+               for player in slow["players"])
+
+
+def ship_key(ship: dict) -> tuple:
+    return (ship["owner"], ship["piece"]["color"], ship["piece"]["size"])
+
+
+def turn_key(action: str, args) -> tuple:
+    """A hashable form of a turn, with ships as (owner, color, size)."""
+    if action == "construct":
+        return (action, args[0], args[1])
+    if action == "move":
+        target = args[2]
+        if isinstance(target, dict):
+            target = ("new", target["new_piece"]["color"], target["new_piece"]["size"])
+        return (action, args[0], ship_key(args[1]), target)
+    if action == "trade":
+        return (action, args[0], ship_key(args[1]), args[2])
+    if action == "attack":
+        return (action, args[0], ship_key(args[1]))
+    if action == "catastrophe":
+        return (action, args[0], args[1])
+    raise ValueError(action)
+
+
+def masked_turns(fast: batch.BatchGame, row: int) -> list:
+    """Every turn the masks allow in row, in game.py's format."""
+    ids = fast.system_ids[row]
+    player = fast.players[fast.current[row]]
+
+    def ship(owner: int, piece: int) -> dict:
+        return {"owner": owner, "piece": piece_to_dict(int(piece))}
+
+    turns = []
+    for slot, color in zip(*np.nonzero(fast.construct_mask()[row])):
+        turns.append(["construct", (int(ids[slot]), COLOR_ORDER[color])])
+    for slot, piece, target in zip(*np.nonzero(fast.move_mask()[row])):
+        turns.append(["move", (int(ids[slot]), ship(player, piece), int(ids[target]))])
+    for slot, piece, star in zip(*np.nonzero(fast.move_new_mask()[row])):
+        turns.append(["move", (int(ids[slot]), ship(player, piece), {"new_piece": piece_to_dict(int(star))})])
+    for slot, piece, color in zip(*np.nonzero(fast.trade_mask()[row])):
+        turns.append(["trade", (int(ids[slot]), ship(player, piece), COLOR_ORDER[color])])
+    for slot, owner, piece in zip(*np.nonzero(fast.attack_mask()[row])):
+        turns.append(["attack", (int(ids[slot]), ship(fast.players[owner], piece))])
+    for slot, color in zip(*np.nonzero(fast.catastrophe_mask()[row])):
+        turns.append(["catastrophe", (int(ids[slot]), COLOR_ORDER[color])])
+    return turns
+
+
+def legal_turns(slow: dict) -> list:
+    return [[action, args] for action, args in game.generate_legal_turns(slow, 0) if action != "sacrifice"]
+
+
+def state_key(slow: dict) -> tuple:
+    """slow without ship and star order (which batch states don't keep)."""
+    systems = tuple(sorted(
+        (system_id, system["star"]["owner"],
+         tuple(sorted((piece["color"], piece["size"]) for piece in system["star"]["pieces"])),
+         tuple(sorted(ship_key(ship) for ship in system["ships"])))
+        for system_id, system in slow["systems"].items()))
+    return (systems, tuple(sorted(slow["reserve"].items())), slow["system_count"], slow["current_player"],
+            slow["hash"])
+
+
+@pytest.mark.parametrize("seed", range(SEEDS))
+def test_round_trip(seed):
+    states = sample_states(seed)
+    fast = batch.from_gamestates(states)
+    for row, slow in enumerate(states):
+        assert state_key(batch.to_gamestate(fast, row)) == state_key(slow)
+
+
+@pytest.mark.parametrize("seed", range(SEEDS))
+def test_masks_allow_the_legal_turns(seed):
+    states = sample_states(seed)
+    fast = batch.from_gamestates(states)
+    for row, slow in enumerate(states):
+        expected = Counter(turn_key(action, args) for action, args in legal_turns(slow))
+        assert Counter(turn_key(action, args) for action, args in masked_turns(fast, row)) == expected
+
+
+@pytest.mark.parametrize("seed", range(SEEDS))
+def test_random_step_plays_a_legal_turn(seed):
+    states = sample_states(seed)
+    fast = batch.from_gamestates(states)
+    fast.random_step(np.random.default_rng(seed))
+    for row, slow in enumerate(states):
+        successors = set()
+        for turn in legal_turns(slow) or [[]]:
+            after = copy.deepcopy(slow)
+            game.apply_turn(after, copy.deepcopy(turn), game.following_player(after))
+            successors.add(state_key(after))
+        assert state_key(batch.to_gamestate(fast, row)) in successors
+
+
+def test_positions_cover_every_masked_action():
+    seen = set()
+    for seed in range(SEEDS):
+        for slow in sample_states(seed):
+            seen.update(action for action, _ in legal_turns(slow))
+    assert seen == {"construct", "move", "trade", "attack", "catastrophe"}
@@ -0,0 +1,36 @@
+"""The benchmark suite covers every action, and a comparison never passes over a missing row."""
+
+import pytest
+
+import benchmark
+from benchmark import (
+    compare,
+    sample_positions,
+)
+from game import (
+    ACTION_METHODS,
+)
+
+
+def test_every_action_has_cases():
+    states, cases = sample_positions(10, per_state=5)
+    assert len(states) >= 10
+    assert set(cases) == set(ACTION_METHODS)
+    for action, found in cases.items():
+        assert len(found) >= 5, action
+
+
+def test_sampling_raises_instead_of_leaving_actions_out(monkeypatch):
+    monkeypatch.setattr(benchmark, "MAX_STATES", 3)
+    with pytest.raises(RuntimeError):
+        sample_positions(1, per_state=50)
+
+
+def test_missing_benchmark_is_a_regression():
+    baseline = {"results": {"off": {"validate_attack": {"per_second": 100.0},
+                                    "validate_move": {"per_second": 100.0}},
+                            "full": {"validate_move": {"per_second": 100.0}}}}
+    current = {"results": {"off": {"validate_move": {"per_second": 100.0}}}}
+    rows, regressions = compare(current, baseline)
+    assert [(level, name) for level, name, _, _, _ in rows] == [("off", "validate_attack"), ("off", "validate_move")]
+    assert [(level, name) for level, name, _, _, _ in regressions] == [("off", "validate_attack")]
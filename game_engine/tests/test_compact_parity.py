@@ -0,0 +1,82 @@
+"""compact.py re-implements game.py's rules on its own state; these tests keep the two in step.
+
+Seeded random games are played on both engines at once.  At every position both must
+generate the same legal turns, in the same order, and after every turn both must hold the
+same state (reserve, systems with their ship order, system ids and counts).
+"""
+
+import copy
+import json
+import random
+
+import pytest
+
+import compact
+import game
+from validation import (
+    OFF,
+    set_validation_level,
+)
+
+
+GAMES = 40
+MAX_PLIES = 60
+SACRIFICE_LIMIT = 3
+
+
+@pytest.fixture(autouse=True)
+def no_schema_checks():
+    previous_level = set_validation_level(OFF)
+    yield
+    set_validation_level(previous_level)
+
+
+def dict_turn(turn: list) -> list:
+    action, args = turn
+    return [action, list(compact.args_to_dict(action, args))]
+
+
+def normalized(turn: list) -> str:
+    return json.dumps(turn, sort_keys=True, default=list)
+
+
+def play_both(seed: int):
+    """Yields (compact game, GAMESTATE) before every turn of a random game."""
+    rng = random.Random(seed)
+    fast = compact.new_game()
+    slow = compact.to_gamestate(fast)
+    for ply in range(MAX_PLIES):
+        yield fast, slow
+        turn = compact.random_turn(fast, rng)
+        if turn is None:
+            return
+        turn = dict_turn(turn)
+        compact.apply_turn(fast, copy.deepcopy(turn))
+        game.apply_turn(slow, copy.deepcopy(turn), game.following_player(slow))
+        fast.current_player = slow["current_player"]
+        # setups don't end the game
+        if ply >= 1 and compact.losers(fast):
+            yield fast, slow
+            return
+
+
+@pytest.mark.parametrize("seed", range(GAMES))
+def test_same_legal_turns(seed):
+    for fast, slow in play_both(seed):
+        expected = [normalized(turn) for turn in game.generate_legal_turns(slow)]
+        assert [normalized(dict_turn(turn)) for turn in compact.legal_turns(fast)] == expected
+
+
+@pytest.mark.parametrize("seed", range(0, GAMES, 4))
+def test_same_limited_sacrifices(seed):
+    for fast, slow in play_both(seed):
+        expected = [normalized(turn) for turn in game.generate_legal_turns(slow, SACRIFICE_LIMIT)]
+        assert [normalized(dict_turn(turn))
+                for turn in compact.legal_turns(fast, sacrifice_limit=SACRIFICE_LIMIT)] == expected
+
+
+@pytest.mark.parametrize("seed", range(GAMES))
+def test_same_state_after_every_turn(seed):
+    for fast, slow in play_both(seed):
+        assert compact.from_gamestate(slow) == fast
+        assert compact.to_gamestate(fast)["hash"] == slow["hash"]
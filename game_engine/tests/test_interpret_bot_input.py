@@ -0,0 +1,30 @@
+"""interpret_bot_input either plays a whole turn or, if any action is illegal, none of it."""
+
+import copy
+
+from game import (
+    create_game,
+    generate_legal_turns,
+)
+from main import (
+    interpret_bot_input,
+)
+
+
+def test_rejected_turn_leaves_state_unchanged():
+    game = create_game()
+    before = copy.deepcopy(game)
+    action, args = next(iter(generate_legal_turns(game)))
+    valid, _ = interpret_bot_input(game, [action, args, "construct", [99, "red"]])
+    assert not valid
+    assert game == before
+
+
+def test_accepted_turn_is_applied():
+    game = create_game()
+    before = copy.deepcopy(game)
+    action, args = next(iter(generate_legal_turns(game)))
+    valid, result = interpret_bot_input(game, [action, args])
+    assert valid
+    assert result is game
+    assert game != before
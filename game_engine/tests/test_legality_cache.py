@@ -0,0 +1,89 @@
+"""The legality cache must never answer for one position with a verdict from another, even
+when their zobrist hashes (game["hash"]) are equal."""
+
+import copy
+import random
+
+import pytest
+
+from game import (
+    ACTION_VALIDATORS,
+    apply_turn,
+    create_game,
+    following_player,
+    generate_legal_turns,
+)
+from legality_cache import (
+    LegalityCache,
+)
+from main import (
+    check_player_lost,
+)
+
+
+def random_state(seed: int, plies: int=12) -> dict:
+    """A position up to plies turns into a random game, before anyone has lost."""
+    rng = random.Random(seed)
+    game = create_game()
+    for ply in range(plies):
+        turns = list(generate_legal_turns(game))
+        if not turns:
+            break
+        after = copy.deepcopy(game)
+        apply_turn(after, rng.choice(turns), following_player(after))
+        # setups don't end the game
+        if ply >= 1 and check_player_lost(after):
+            break
+        game = after
+    return game
+
+
+def candidates(*games) -> list:
+    return [(action, args) for game in games for action, args in generate_legal_turns(game)]
+
+
+def assert_no_shared_verdicts(first: dict, second: dict) -> int:
+    """Asks a cache about first, then about second; every answer for second must be what
+    the validators say about it.  Returns how many answers differ between the two."""
+    assert first["hash"] == second["hash"]
+    cache = LegalityCache()
+    differing = 0
+    for action, args in candidates(first, second):
+        before = cache.validate(first, action, args)
+        after = cache.validate(second, action, args)
+        assert after == ACTION_VALIDATORS[action](second, args)
+        differing += before[0] != after[0]
+    return differing
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_renumbered_systems_dont_share_verdicts(seed):
+    first = random_state(seed)
+    second = copy.deepcopy(first)
+    # zobrist hashes leave system ids out; move one of the mover's systems to a new id
+    system_id = min(system_id for system_id, system in first["systems"].items()
+                    if any(ship["owner"] == first["current_player"] for ship in system["ships"]))
+    new_id = 100
+    second["systems"][new_id] = second["systems"].pop(system_id)
+    second["homeworlds"] = {player: new_id if homeworld == system_id else homeworld
+                            for player, homeworld in second["homeworlds"].items()}
+    assert assert_no_shared_verdicts(first, second)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_colliding_hashes_dont_share_verdicts(seed):
+    first = random_state(seed)
+    second = random_state(seed + 100)
+    second["hash"] = first["hash"]
+    assert assert_no_shared_verdicts(first, second)
+
+
+def test_unchanged_position_hits():
+    game = random_state(0)
+    cache = LegalityCache()
+    turns = candidates(game)
+    for action, args in turns:
+        cache.validate(game, action, args)
+    for action, args in turns:
+        assert cache.validate(game, action, args) == ACTION_VALIDATORS[action](game, args)
+    assert cache.hits == len(turns)
@@ -0,0 +1,118 @@
+"""persistent.py re-implements game.py's actions on immutable States; these tests keep the
+two in step.
+
+Seeded random games are played through game.apply_turn and, from the same turns, through
+the persistent actions.  After every turn the State must convert to the same GAMESTATE
+(systems with their ship order, reserve, homeworlds, counts), with the same hash, and the
+States it was built from must be unchanged.
+"""
+
+import copy
+import random
+
+import pytest
+
+import game
+import persistent
+from validation import (
+    OFF,
+    set_validation_level,
+)
+
+
+GAMES = 40
+MAX_PLIES = 80
+SACRIFICE_LIMIT = 4
+DESTRUCTIVE_CHANCE = 0.2
+
+
+@pytest.fixture(autouse=True)
+def no_schema_checks():
+    previous_level = set_validation_level(OFF)
+    yield
+    set_validation_level(previous_level)
+
+
+def random_turn(slow: dict, rng: random.Random) -> list:
+    """A random legal turn.  The action is picked first, and sacrifices and catastrophes
+    only now and then, so that games run long enough for fleets to meet (uniformly random
+    turns are nearly all sacrifices, which soon end the game)."""
+    by_action = {}
+    for action, args in game.generate_legal_turns(slow, SACRIFICE_LIMIT):
+        by_action.setdefault(action, []).append(args)
+    if not by_action:
+        return None
+    actions = sorted(by_action)
+    if rng.random() >= DESTRUCTIVE_CHANCE:
+        actions = [action for action in actions if action not in ("sacrifice", "catastrophe")] or actions
+    action = rng.choice(actions)
+    return [action, list(rng.choice(by_action[action]))]
+
+
+def without_history(slow: dict) -> dict:
+    return {key: value for key, value in slow.items() if key != "history"}
+
+
+def play_both(seed: int):
+    """Yields (GAMESTATE, State, the State before, the turn played) after every turn of a
+    random game."""
+    rng = random.Random(seed)
+    slow = game.create_game(first_player=rng.choice([1, 2]))
+    state = persistent.from_gamestate(slow)
+    for ply in range(MAX_PLIES):
+        turn = random_turn(slow, rng)
+        if turn is None:
+            return
+        before = state
+        state = persistent.apply_turn(state, copy.deepcopy(turn), persistent.following_player(state))
+        game.apply_turn(slow, copy.deepcopy(turn), game.following_player(slow))
+        yield slow, state, before, turn
+        # setups don't end the game
+        if ply >= 1 and persistent.losers(state):
+            return
+
+
+def assert_same(slow: dict, state: persistent.State) -> type(None):
+    assert without_history(persistent.to_gamestate(state)) == without_history(slow)
+    assert state.hash == slow["hash"]
+    assert state.reserve == tuple(slow["reserve"][key] for key in persistent.PIECE_KEYS)
+    assert state.homeworlds == slow["homeworlds"]
+
+
+@pytest.mark.parametrize("seed", range(GAMES))
+def test_same_state_after_every_turn(seed):
+    for slow, state, _, _ in play_both(seed):
+        assert_same(slow, state)
+
+
+@pytest.mark.parametrize("seed", range(GAMES))
+def test_same_state_action_by_action(seed):
+    for slow, _, before, turn in play_both(seed):
+        child = before
+        for index in range(0, len(turn), 2):
+            child = persistent.ACTION_FUNCTIONS[turn[index]](child, *copy.deepcopy(turn[index + 1]))
+        child = persistent.set_current_player(child, slow["current_player"])
+        assert_same(slow, child)
+
+
+@pytest.mark.parametrize("seed", range(0, GAMES, 4))
+def test_parents_are_unchanged(seed):
+    snapshots = []
+    for _, state, _, _ in play_both(seed):
+        snapshots.append((state, without_history(persistent.to_gamestate(state))))
+    for state, snapshot in snapshots:
+        assert without_history(persistent.to_gamestate(state)) == snapshot
+
+
+def test_recorded_history():
+    rng = random.Random(0)
+    slow = game.create_game()
+    state = persistent.from_gamestate(slow)
+    turns = []
+    for _ in range(6):
+        turn = random_turn(slow, rng)
+        turns.append(["p{}".format(state.current_player), turn])
+        state = persistent.apply_turn(state, copy.deepcopy(turn), persistent.following_player(state), record=True)
+        game.apply_turn(slow, copy.deepcopy(turn), game.following_player(slow))
+    assert persistent.history_events(state) == turns
+    assert list(persistent.to_gamestate(state)["history"]) == turns
@@ -0,0 +1,83 @@
+"""Views of a long game are schema checked as cheaply as the game itself: checks of a view
+of the history only look at events that haven't been checked yet, like checks of the state."""
+
+import random
+import time
+
+import pytest
+from py_types.runtime import (
+    SchemaError,
+)
+
+from game import (
+    create_game,
+    generate_legal_turns,
+)
+from state_view import (
+    ReadOnlyError,
+    view,
+)
+from validation import (
+    FULL,
+    OFF,
+    set_validation_level,
+)
+
+
+HISTORY_LENGTH = 20000
+
+
+@pytest.fixture
+def long_game():
+    """A new game with HISTORY_LENGTH unchecked events in its history, checked at "full"."""
+    game = create_game()
+    rng = random.Random(0)
+    events = [["p1", [action, list(args)]] for action, args in rng.sample(list(generate_legal_turns(game)), 8)]
+    previous_level = set_validation_level(OFF)
+    while len(game["history"]) < HISTORY_LENGTH:
+        game["history"].extend(events)
+    set_validation_level(FULL)
+    yield game
+    set_validation_level(previous_level)
+
+
+def best_time(function, repeat: int=5) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def test_view_checks_history_once(long_game):
+    state = view(long_game)
+    list(generate_legal_turns(state))
+    assert long_game["history"].validated == len(long_game["history"])
+    # an event the check already passed isn't looked at again
+    list.__setitem__(long_game["history"], 0, "not an event")
+    list(generate_legal_turns(state))
+
+
+def test_view_checks_new_events(long_game):
+    state = view(long_game)
+    list(generate_legal_turns(state))
+    list.append(long_game["history"], "not an event")
+    with pytest.raises(SchemaError):
+        list(generate_legal_turns(state))
+
+
+def test_view_of_long_game_checks_as_fast_as_state(long_game):
+    state = view(long_game)
+    # the first check covers the whole history, whichever of the two makes it
+    list(generate_legal_turns(long_game))
+    plain = best_time(lambda: list(generate_legal_turns(long_game)))
+    viewed = best_time(lambda: list(generate_legal_turns(state)))
+    # the view's own overhead is a small constant; checking 20k events again is not
+    assert viewed < plain * 10 + 0.002
+
+
+def test_history_view_is_read_only(long_game):
+    with pytest.raises(ReadOnlyError):
+        view(long_game)["history"].append(["p1", ["setup", []]])
@@ -0,0 +1,87 @@
+"""validation_level changes the validation level for the current thread only."""
+
+import threading
+
+import pytest
+from py_types.runtime import (
+    SchemaError,
+)
+
+from bots import (
+    alphabeta,
+)
+from game import (
+    create_game,
+    generate_legal_turns,
+)
+from validation import (
+    BOUNDARY,
+    FULL,
+    OFF,
+    checks_boundary,
+    get_validation_level,
+    set_validation_level,
+    validation_level,
+)
+
+
+@pytest.fixture(autouse=True)
+def full_checks():
+    previous_level = set_validation_level(FULL)
+    yield
+    set_validation_level(previous_level)
+
+
+def test_block_sets_and_restores_level():
+    with validation_level(OFF):
+        assert get_validation_level() == OFF
+        assert not checks_boundary()
+        with validation_level(BOUNDARY):
+            assert get_validation_level() == BOUNDARY
+        assert get_validation_level() == OFF
+    assert get_validation_level() == FULL
+
+
+def test_block_skips_schema_checks():
+    with validation_level(OFF):
+        # a state without its hash only fails the schema
+        game = create_game()
+        del game["hash"]
+        list(generate_legal_turns(game))
+        with pytest.raises(SchemaError):
+            with validation_level(FULL):
+                list(generate_legal_turns(game))
+
+
+def test_other_threads_keep_their_level():
+    entered = threading.Event()
+    checked = threading.Event()
+    seen = []
+
+    def other_game():
+        entered.wait()
+        seen.append(get_validation_level())
+        checked.set()
+
+    thread = threading.Thread(target=other_game)
+    thread.start()
+    with validation_level(OFF):
+        entered.set()
+        checked.wait()
+    thread.join()
+    assert seen == [FULL]
+
+
+def test_search_leaves_engine_level_alone(monkeypatch):
+    seen = []
+    evaluate = alphabeta.evaluate
+
+    def evaluate_and_look(game, player):
+        seen.append(get_validation_level())
+        return evaluate(game, player)
+
+    monkeypatch.setattr(alphabeta, "evaluate", evaluate_and_look)
+    game = create_game()
+    alphabeta.search(game, move_time=0.2, max_depth=1)
+    assert seen and set(seen) == {OFF}
+    assert get_validation_level() == FULL
@@ -0,0 +1,175 @@
+"""Self-play tournaments between bots, spread over all cores.
+
+usage: python tournament.py BOT [BOT ...] [--games N] [--mode round_robin|gauntlet]
+                            [--seed S] [--workers W] [--max-turns T] [--log-dir DIR]
+                            [--move-time S] [--game-time S] [--increment S]
+                            [--max-invalid-turns N] [--no-history] [--warm-bots]
+
+round_robin plays every pair of bots against each other, gauntlet plays the first bot
+against each of the others.  Each pairing plays --games games, swapping seats every game.
+Every game gets its own seed derived from --seed and its index, so a tournament can be
+replayed exactly, and its own log file in --log-dir.
+Time controls are enforced as in main.play_game.  --no-history keeps game histories
+out of memory; the streamed logs are then the only record of each game.
+--warm-bots runs every bot in its own process, kept between games (see bot_pool.py):
+each tournament worker keeps a pool, so bots start once per worker, not once per game.
+"""
+
+import argparse
+from concurrent.futures import (
+    ProcessPoolExecutor,
+)
+from itertools import (
+    combinations,
+)
+import os
+import random
+import subprocess
+import sys
+
+from bot_pool import (
+    BotPool,
+)
+from bot_worker import (
+    TimeControl,
+)
+from main import (
+    DEFAULT_MAX_INVALID_TURNS,
+    play_game,
+)
+
+
+ROUND_ROBIN = "round_robin"
+GAUNTLET = "gauntlet"
+DEFAULT_MAX_TURNS = 1000
+
+
+def game_seed(seed: int, index: int) -> int:
+    """Seed for game number index of a tournament seeded with seed."""
+    return random.Random("{}:{}".format(seed, index)).getrandbits(32)
+
+
+def schedule(bots: list, games: int, mode: str=ROUND_ROBIN, seed: int=0, log_dir: str=None) -> list:
+    """Returns the games of a tournament as dicts of play_game keyword arguments."""
+    if mode == ROUND_ROBIN:
+        pairings = list(combinations(bots, 2))
+    elif mode == GAUNTLET:
+        pairings = [(bots[0], opponent) for opponent in bots[1:]]
+    else:
+        raise ValueError("Unknown tournament mode {!r}, expected {} or {}.".format(mode, ROUND_ROBIN, GAUNTLET))
+
+    specs = []
+    for bot_a, bot_b in pairings:
+        for game in range(games):
+            first, second = (bot_a, bot_b) if game % 2 == 0 else (bot_b, bot_a)
+            index = len(specs)
+            log_file = None
+            if log_dir is not None:
+                log_file = os.path.join(log_dir, "game_{:06d}_{}_vs_{}.jsonl".format(index, first, second))
+            specs.append({"first_bot": first, "second_bot": second, "seed": game_seed(seed, index),
+                          "log_file": log_file})
+    return specs
+
+
+# this worker process' bot processes, with --warm-bots
+_pool = None
+
+
+def _play(spec: dict) -> dict:
+    global _pool
+    if spec.pop("warm_bots", False):
+        if _pool is None:
+            # bot processes exit when their stdin closes, with this worker
+            _pool = BotPool(stderr=subprocess.DEVNULL)
+        spec["pool"] = _pool
+    return play_game(verbose=False, **spec)
+
+
+def summarize(results: list) -> dict:
+    """Win/loss/draw, turn counts and bot CPU time/peak memory per bot, from play_game summaries."""
+    table = {}
+    for result in results:
+        for player, bot in result["bots"].items():
+            row = table.setdefault(bot, {"games": 0, "wins": 0, "losses": 0, "draws": 0, "turns": 0,
+                                         "cpu": 0.0, "max_rss_kb": None})
+            row["games"] += 1
+            row["turns"] += result["turns"]
+            used = result["resources"][player]
+            row["cpu"] += used["cpu"]
+            if used["max_rss_kb"] is not None:
+                row["max_rss_kb"] = max(row["max_rss_kb"] or 0, used["max_rss_kb"])
+            if result["winner"] == player:
+                row["wins"] += 1
+            elif player in result["losers"]:
+                row["losses"] += 1
+            else:
+                row["draws"] += 1
+    for row in table.values():
+        row["mean_turns"] = row["turns"] / row["games"]
+    return table
+
+
+def run_tournament(bots: list, games: int, mode: str=ROUND_ROBIN, seed: int=0, workers: int=None,
+                   max_turns: int=DEFAULT_MAX_TURNS, log_dir: str="tournament_logs",
+                   time_control: TimeControl=None, max_invalid_turns: int=DEFAULT_MAX_INVALID_TURNS,
+                   keep_history: bool=True, warm_bots: bool=False) -> dict:
+    """Plays a tournament across a process pool (all cores by default).
+    Returns {"games": [play_game summaries, in schedule order], "bots": summarize(...)}."""
+    if log_dir is not None:
+        os.makedirs(log_dir, exist_ok=True)
+    specs = schedule(bots, games, mode, seed, log_dir)
+    for spec in specs:
+        spec["max_turns"] = max_turns
+        spec["time_control"] = time_control
+        spec["max_invalid_turns"] = max_invalid_turns
+        spec["keep_history"] = keep_history
+        spec["warm_bots"] = warm_bots
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        results = list(pool.map(_play, specs))
+
+    return {"games": results, "bots": summarize(results)}
+
+
+def format_table(table: dict) -> str:
+    lines = ["{:<24} {:>6} {:>6} {:>6} {:>6} {:>10} {:>9}".format(
+        "bot", "games", "wins", "losses", "draws", "mean turns", "cpu (s)")]
+    for bot, row in sorted(table.items(), key=lambda item: -item[1]["wins"]):
+        lines.append("{:<24} {:>6} {:>6} {:>6} {:>6} {:>10.1f} {:>9.2f}".format(
+            bot, row["games"], row["wins"], row["losses"], row["draws"], row["mean_turns"], row["cpu"]))
+    return "\n".join(lines)
+
+
+def main(argv: list) -> type(None):
+    parser = argparse.ArgumentParser(description="Play a self-play tournament between bots.")
+    parser.add_argument("bots", nargs="+", help="bot module names in bots/")
+    parser.add_argument("--games", type=int, default=10, help="games per pairing")
+    parser.add_argument("--mode", choices=(ROUND_ROBIN, GAUNTLET), default=ROUND_ROBIN)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="processes to use, all cores by default")
+    parser.add_argument("--max-turns", type=int, default=DEFAULT_MAX_TURNS, help="turns before a game is drawn")
+    parser.add_argument("--log-dir", default="tournament_logs")
+    parser.add_argument("--move-time", type=float, default=None, help="seconds per move")
+    parser.add_argument("--game-time", type=float, default=None, help="seconds per player per game")
+    parser.add_argument("--increment", type=float, default=0.0, help="seconds added per move")
+    parser.add_argument("--max-invalid-turns", type=int, default=DEFAULT_MAX_INVALID_TURNS,
+                        help="invalid turns in a row before a bot forfeits")
+    parser.add_argument("--no-history", action="store_true",
+                        help="don't keep game histories in memory, only in the logs")
+    parser.add_argument("--warm-bots", action="store_true",
+                        help="run bots in their own processes, reused across games")
+    args = parser.parse_args(argv)
+
+    if len(args.bots) < 2:
+        parser.error("need at least two bots")
+    time_control = None
+    if args.move_time is not None or args.game_time is not None:
+        time_control = TimeControl(args.move_time, args.game_time, args.increment)
+    result = run_tournament(args.bots, args.games, args.mode, args.seed, args.workers, args.max_turns,
+                            args.log_dir, time_control, args.max_invalid_turns,
+                            not args.no_history, args.warm_bots)
+    print(format_table(result["bots"]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
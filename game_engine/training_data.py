@@ -0,0 +1,319 @@
+"""Training data for evaluation models: positions as fixed-size arrays, labelled with outcomes.
+
+usage: python training_data.py DIRECTORY LOG_FILE...
+
+Adds every position of the games in the logs (see game_log.py) to the dataset in
+DIRECTORY, creating it if needed.  Unfinished and aborted games are skipped.  play_game
+(see main.py) can also add positions to a DatasetWriter as it plays.
+
+Each position is one row of uint8 features, for P players and S = MAX_SYSTEMS system slots:
+    reserve     12            pieces left, by piece (numbered as in compact.py)
+    systems     S * (12 + 12P + P + 1), per slot:
+        stars   12            star pieces, as counts
+        ships   P * 12        ships of each player, as counts per piece
+        owner   P + 1         one-hot: neutral, then each player's homeworld
+    to move     P             one-hot
+Players are in the order of game["players"].  Systems fill the slots in canonical order
+(see canonical.py), so rows don't depend on system ids or ship order; unused slots are all
+zero.  Its label is the outcome for the player to move: 1 won, 0 drawn, -1 lost.
+
+A dataset is a directory of shards, each a features_NNNNN.npy (rows, feature size) and
+labels_NNNNN.npy (rows,) pair of plain .npy files, and index.json listing them with their
+row counts.  Rows are appended to the last shard until it holds shard_rows rows.  Shards
+are written with a fixed-size header that is rewritten in place on flush, so they stay
+valid .npy files as they grow and can be opened with np.load(path, mmap_mode="r") while
+rows are still being added; a writer that crashes leaves them valid up to its last flush.
+Positions of a game are held until the game ends (its label isn't known before), so only
+one game per writer is ever in memory.
+"""
+
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+from batch import (
+    MAX_SYSTEMS,
+)
+from canonical import (
+    canonical_form,
+)
+import compact
+from compact import (
+    OWNER_SHIFT,
+    PIECE_COUNT,
+    PIECE_MASK,
+    CompactGame,
+)
+from replay import (
+    Replay,
+)
+
+
+SHARD_ROWS = 1 << 16
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+FEATURE_TYPE = np.uint8
+LABEL_TYPE = np.int8
+WIN, DRAW, LOSS = 1, 0, -1
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# fixed, so the header can be rewritten in place as rows are added
+NPY_HEADER_SIZE = 128
+
+
+def system_size(player_count: int) -> int:
+    return PIECE_COUNT + player_count * PIECE_COUNT + player_count + 1
+
+
+def feature_size(player_count: int, max_systems: int=MAX_SYSTEMS) -> int:
+    return PIECE_COUNT + max_systems * system_size(player_count) + player_count
+
+
+def encode_position(game, max_systems: int=MAX_SYSTEMS, out: np.ndarray=None) -> np.ndarray:
+    """Features of a GAMESTATE or compact game, into out if given (it must be zeroed)."""
+    if not isinstance(game, CompactGame):
+        game = compact.from_gamestate(game)
+    players = game.players
+    player_index = {player: index for index, player in enumerate(players)}
+    if len(game.systems) > max_systems:
+        raise ValueError("{} systems don't fit in {} slots.".format(len(game.systems), max_systems))
+    if out is None:
+        out = np.zeros(feature_size(len(players), max_systems), dtype=FEATURE_TYPE)
+
+    out[:PIECE_COUNT] = game.reserve
+    _, ids = canonical_form(game)
+    slot_size = system_size(len(players))
+    owner_start = PIECE_COUNT + len(players) * PIECE_COUNT
+    for slot in range(len(game.systems)):
+        system = game.systems[ids.from_canonical(slot + 1)]
+        start = PIECE_COUNT + slot * slot_size
+        for piece in system.stars:
+            out[start + piece] += 1
+        for ship in system.ships:
+            out[start + PIECE_COUNT + player_index[ship >> OWNER_SHIFT] * PIECE_COUNT + (ship & PIECE_MASK)] += 1
+        out[start + owner_start + (player_index[system.owner] + 1 if system.owner in player_index else 0)] = 1
+    out[PIECE_COUNT + max_systems * slot_size + player_index[game.current_player]] = 1
+    return out
+
+
+def outcome(player: int, winner: int, losers: list) -> int:
+    if winner == player:
+        return WIN
+    if player in losers:
+        return LOSS
+    return DRAW
+
+
+##################
+# Shards
+##################
+
+
+def _npy_header(shape: tuple, dtype) -> bytes:
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(np.dtype(dtype).str, shape)
+    header = header.ljust(NPY_HEADER_SIZE - len(NPY_MAGIC) - 3) + "\n"
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class _ShardFile(object):
+    """An .npy file open for appending rows of row_shape."""
+
+    def __init__(self, path: str, row_shape: tuple, dtype, rows: int=0):
+        self.path = path
+        self.row_shape = row_shape
+        self.dtype = np.dtype(dtype)
+        self.rows = rows
+        self.row_bytes = int(np.prod(row_shape, dtype=int)) * self.dtype.itemsize
+        if os.path.exists(path):
+            self._file = open(path, "r+b")
+            # drop rows written after the last flush; they were never in the header
+            self._file.truncate(NPY_HEADER_SIZE + rows * self.row_bytes)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, "w+b")
+            self._file.write(_npy_header((0,) + row_shape, self.dtype))
+
+    def append(self, rows: np.ndarray) -> type(None):
+        self._file.write(np.ascontiguousarray(rows, dtype=self.dtype).tobytes())
+        self.rows += len(rows)
+
+    def flush(self) -> type(None):
+        self._file.flush()
+        self._file.seek(0)
+        self._file.write(_npy_header((self.rows,) + self.row_shape, self.dtype))
+        self._file.seek(0, os.SEEK_END)
+        self._file.flush()
+
+    def close(self) -> type(None):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+def _read_index(directory: str) -> dict:
+    with open(os.path.join(directory, INDEX_FILE), "r", encoding="utf-8") as index:
+        return json.load(index)
+
+
+class DatasetWriter(object):
+    """Appends labelled positions to the dataset in directory.  Use as a context manager,
+    or call close.
+
+    For each game: add_position(game) before every turn, then end_game(winner, losers) once
+    it is over (or abandon_game to drop it).  Rows are written when their game ends and
+    made visible to readers every flush_games games and on close."""
+
+    def __init__(self, directory: str, players: tuple=(1, 2), max_systems: int=MAX_SYSTEMS,
+                 shard_rows: int=SHARD_ROWS, flush_games: int=16):
+        self.directory = directory
+        self.flush_games = flush_games
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, INDEX_FILE)):
+            self.index = _read_index(directory)
+            if self.index["players"] != len(players) or self.index["max_systems"] != max_systems:
+                raise ValueError("{} holds {} player positions with {} systems.".format(
+                    directory, self.index["players"], self.index["max_systems"]))
+        else:
+            self.index = {"version": INDEX_VERSION, "players": len(players), "max_systems": max_systems,
+                          "feature_size": feature_size(len(players), max_systems),
+                          "shard_rows": shard_rows, "rows": 0, "games": 0, "shards": []}
+        self.max_systems = max_systems
+        self._features = None
+        self._labels = None
+        self._game = []
+        self._unflushed = 0
+
+    @property
+    def rows(self) -> int:
+        return self.index["rows"]
+
+    def _open_shard(self) -> type(None):
+        shards = self.index["shards"]
+        if not shards or shards[-1]["rows"] >= self.index["shard_rows"]:
+            number = len(shards)
+            shards.append({"features": "features_{:05d}.npy".format(number),
+                           "labels": "labels_{:05d}.npy".format(number), "rows": 0})
+        shard = shards[-1]
+        self._features = _ShardFile(os.path.join(self.directory, shard["features"]),
+                                    (self.index["feature_size"],), FEATURE_TYPE, shard["rows"])
+        self._labels = _ShardFile(os.path.join(self.directory, shard["labels"]), (), LABEL_TYPE, shard["rows"])
+
+    def _close_shard(self) -> type(None):
+        if self._features is not None:
+            self._features.close()
+            self._labels.close()
+            self._features = self._labels = None
+
+    def add_position(self, game) -> type(None):
+        """Records game (a GAMESTATE or compact game, with the player to move set)."""
+        current_player = game.current_player if isinstance(game, CompactGame) else game["current_player"]
+        self._game.append((encode_position(game, self.max_systems), current_player))
+
+    def abandon_game(self) -> type(None):
+        self._game = []
+
+    def end_game(self, winner: int, losers: list) -> type(None):
+        """Writes the recorded positions, labelled with the outcome for the player to move."""
+        positions, self._game = self._game, []
+        if not positions:
+            return
+        features = np.stack([position for position, _ in positions])
+        labels = np.array([outcome(player, winner, losers) for _, player in positions], dtype=LABEL_TYPE)
+        written = 0
+        while written < len(features):
+            if self._features is None or self.index["shards"][-1]["rows"] >= self.index["shard_rows"]:
+                self._close_shard()
+                self._open_shard()
+            shard = self.index["shards"][-1]
+            count = min(len(features) - written, self.index["shard_rows"] - shard["rows"])
+            self._features.append(features[written:written + count])
+            self._labels.append(labels[written:written + count])
+            shard["rows"] += count
+            written += count
+        self.index["rows"] += len(features)
+        self.index["games"] += 1
+        self._unflushed += 1
+        if self._unflushed >= self.flush_games:
+            self.flush()
+
+    def add_log(self, path: str) -> bool:
+        """Adds every position of the game in a log; False if it was skipped."""
+        with Replay(path) as replay:
+            end = replay.end
+            if end is None or end["reason"] == "aborted":
+                return False
+            state = compact.from_gamestate(replay.state_at(0))
+            for record in replay.turns():
+                state.current_player = record["player"]
+                self.add_position(state)
+                compact.apply_turn(state, record["actions"])
+        self.end_game(end["winner"], end["losers"])
+        return True
+
+    def flush(self) -> type(None):
+        """Makes the rows written so far visible: shard headers first, then the index."""
+        if self._features is not None:
+            self._features.flush()
+            self._labels.flush()
+        temporary = os.path.join(self.directory, INDEX_FILE + ".tmp")
+        with open(temporary, "w", encoding="utf-8") as index:
+            json.dump(self.index, index, indent=1)
+        os.replace(temporary, os.path.join(self.directory, INDEX_FILE))
+        self._unflushed = 0
+
+    def close(self) -> type(None):
+        self.flush()
+        self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Dataset(object):
+    """A dataset directory, read through memory maps."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index = _read_index(directory)
+
+    def __len__(self):
+        return self.index["rows"]
+
+    def shard(self, number: int) -> (np.ndarray, np.ndarray):
+        """(features, labels) of a shard, memory mapped, cut to the rows the index lists."""
+        shard = self.index["shards"][number]
+        features = np.load(os.path.join(self.directory, shard["features"]), mmap_mode="r")
+        labels = np.load(os.path.join(self.directory, shard["labels"]), mmap_mode="r")
+        return features[:shard["rows"]], labels[:shard["rows"]]
+
+    def shards(self):
+        for number in range(len(self.index["shards"])):
+            yield self.shard(number)
+
+    def batches(self, batch_size: int):
+        """Yields (features, labels) batches of up to batch_size rows, in order.  Batches
+        are views of the memory maps; they don't cross shards."""
+        for features, labels in self.shards():
+            for start in range(0, len(labels), batch_size):
+                yield features[start:start + batch_size], labels[start:start + batch_size]
+
+
+def main(argv: list) -> int:
+    if len(argv) < 2:
+        print(__doc__, file=sys.stderr)
+        return 2
+    with DatasetWriter(argv[0]) as writer:
+        added = sum(writer.add_log(path) for path in argv[1:])
+        print("added {} of {} games; {} now has {} positions from {} games".format(
+            added, len(argv) - 1, argv[0], writer.rows, writer.index["games"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,306 @@
+"""Compiled schema checking and engine-wide validation levels.
+
+py_types' schema decorator re-interprets the annotation on every call.  Here each schema
+is compiled once into a tree of small closures, cached, and reused by every function
+annotated with it.  Schemas keep the same meaning they have for py_types:
+    - a dict checks each key against its value schema,
+    - a list or tuple of one schema checks every member of an iterable against it
+      (only new members, for append-only containers like game.History),
+    - a longer list or tuple checks a fixed-length sequence position by position,
+    - a SchemaOr passes if any of its schemas pass,
+    - anything else is checked with isinstance.
+Types that define `allowed_values` (see game.Color) are checked by set membership
+instead of running their validators.
+
+The validation level controls where checks happen:
+    "off"      - nothing is checked.
+    "boundary" - only untrusted input is checked: bot turns, by main.check_bot_input
+                 (see checks_boundary), which reports a malformed turn to the bot
+                 instead of raising.
+    "full"     - every schema-decorated function checks its arguments and return value.
+The starting level is read from the HOMEWORLDS_VALIDATION environment variable and
+defaults to "full".  set_validation_level changes it for the whole process; inside a
+`with validation_level(level):` block, only the current thread (or asyncio task) sees
+level, so code like a bot's search can turn checks off without turning them off for
+games running alongside it.
+"""
+
+from collections.abc import (
+    Iterable,
+)
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+
+from py_types.runtime import (
+    SchemaOr,
+    SchemaError,
+)
+
+
+OFF = "off"
+BOUNDARY = "boundary"
+FULL = "full"
+VALIDATION_LEVELS = (OFF, BOUNDARY, FULL)
+
+_level = os.environ.get("HOMEWORLDS_VALIDATION", FULL)
+if _level not in VALIDATION_LEVELS:
+    raise ValueError("HOMEWORLDS_VALIDATION must be one of {}, got {!r}.".format(VALIDATION_LEVELS, _level))
+
+
+# level set by validation_level for the current context, or None
+_local_level = contextvars.ContextVar("validation_level", default=None)
+# validation_level blocks open in any thread; while there are none, checks skip the lookup
+_local_blocks = 0
+_local_blocks_lock = threading.Lock()
+
+
+def _check_level(level: str) -> type(None):
+    if level not in VALIDATION_LEVELS:
+        raise ValueError("Validation level must be one of {}, got {!r}.".format(VALIDATION_LEVELS, level))
+
+
+def set_validation_level(level: str) -> str:
+    """Set the engine-wide validation level.  Returns the previous level."""
+    global _level
+    _check_level(level)
+    previous = _level
+    _level = level
+    return previous
+
+
+@contextlib.contextmanager
+def validation_level(level: str):
+    """Checks at level in the current thread (or asyncio task) until the block ends.
+    The engine-wide level, and what every other thread sees, is left alone."""
+    global _local_blocks
+    _check_level(level)
+    with _local_blocks_lock:
+        _local_blocks += 1
+    token = _local_level.set(level)
+    try:
+        yield
+    finally:
+        _local_level.reset(token)
+        with _local_blocks_lock:
+            _local_blocks -= 1
+
+
+def get_validation_level() -> str:
+    """The level in effect here: validation_level's, inside its block, else the engine-wide one."""
+    if _local_blocks:
+        return _local_level.get() or _level
+    return _level
+
+
+def checks_boundary() -> bool:
+    """Returns True if untrusted (bot) input should be checked at the current level."""
+    return get_validation_level() != OFF
+
+
+##################
+# Schema compilation
+##################
+
+# id(form) -> (form, checker).  The form is kept alive so its id can't be reused.
+_COMPILED = {}
+
+
+def compile_schema(form):
+    """Returns a cached checker for form.
+    A checker takes a value and returns None if it matches, or a
+    (key_path, value, expected) tuple describing the first mismatch.
+    """
+    cached = _COMPILED.get(id(form))
+    if cached is not None:
+        return cached[1]
+
+    checker = _compile(form)
+    _COMPILED[id(form)] = (form, checker)
+    return checker
+
+
+def _compile(form):
+    if isinstance(form, dict):
+        return _compile_dict(form)
+    if isinstance(form, SchemaOr):
+        return _compile_or(form)
+    if isinstance(form, (list, tuple)):
+        if len(form) == 1:
+            return _compile_homogeneous(form)
+        return _compile_heterogeneous(form)
+    if form is dict:
+        return _compile_type(dict)
+    return _compile_type(form)
+
+
+def _compile_type(form):
+    registered = getattr(form, "_registered_types", None)
+    if registered is not None and object in registered:
+        # py_types' Any
+        return lambda data: None
+
+    allowed = getattr(form, "allowed_values", None)
+    if allowed is not None:
+        allowed = frozenset(allowed)
+        member_types = tuple(registered)
+
+        def check_allowed(data):
+            if isinstance(data, member_types) and data in allowed:
+                return None
+            return ([], data, form)
+        return check_allowed
+
+    def check_type(data):
+        if isinstance(data, form):
+            return None
+        return ([], data, form)
+    return check_type
+
+
+def _compile_dict(form):
+    none_ok = {}
+    fields = []
+    for key, value in form.items():
+        sub_check = compile_schema(value)
+        none_ok[key] = sub_check(None) is None
+        fields.append((key, sub_check))
+    fields = tuple(fields)
+
+    def check_dict(data):
+        if not isinstance(data, dict):
+            return ([], data, dict)
+        for key, sub_check in fields:
+            if key not in data:
+                if none_ok[key]:
+                    continue
+                return ([key], data, form[key])
+            failure = sub_check(data[key])
+            if failure is not None:
+                failure[0].insert(0, key)
+                return failure
+        return None
+    return check_dict
+
+
+def _compile_or(form):
+    sub_checks = tuple(compile_schema(sch) for sch in form.schemas)
+
+    def check_or(data):
+        for sub_check in sub_checks:
+            if sub_check(data) is None:
+                return None
+        return ([], data, form)
+    return check_or
+
+
+def _compile_homogeneous(form):
+    item_check = compile_schema(form[0])
+    # Bare type members (int, str, Color...) don't need the generic per-item call.
+    item_form = form[0]
+    is_plain_type = isinstance(item_form, type) and getattr(item_form, "_registered_types", None) is None
+
+    def check_homogeneous(data):
+        if not isinstance(data, Iterable) or isinstance(data, str):
+            return ([], data, form)
+        # Append-only containers (see game.History) only need their new items checked.
+        incremental = getattr(data, "item_schema", None) is item_form
+        start, items = data.pending_validation() if incremental else (0, data)
+        if is_plain_type:
+            for index, item in enumerate(items, start):
+                if not isinstance(item, item_form):
+                    return ([index], item, item_form)
+        else:
+            for index, item in enumerate(items, start):
+                failure = item_check(item)
+                if failure is not None:
+                    failure[0].insert(0, index)
+                    return failure
+        if incremental:
+            data.mark_validated()
+        return None
+    return check_homogeneous
+
+
+def _compile_heterogeneous(form):
+    item_checks = tuple(compile_schema(sch) for sch in form)
+    length = len(form)
+
+    def check_heterogeneous(data):
+        if not isinstance(data, Iterable) or isinstance(data, str):
+            return ([], data, form)
+        try:
+            if len(data) != length:
+                return ([], data, form)
+        except TypeError:
+            return ([], data, form)
+        for index, item_check in enumerate(item_checks):
+            failure = item_check(data[index])
+            if failure is not None:
+                failure[0].insert(0, index)
+                return failure
+        return None
+    return check_heterogeneous
+
+
+def check_schema(form, data, function=None, name="value"):
+    """Raise SchemaError if data does not match form."""
+    failure = compile_schema(form)(data)
+    if failure is not None:
+        key_path, value, expected = failure
+        raise SchemaError(function, data, name, key_path, value, expected)
+
+
+##################
+# Decorators
+##################
+
+
+def _checked(function, levels):
+    annotations = function.__annotations__
+    arg_names = function.__code__.co_varnames[:function.__code__.co_argcount]
+    arg_checks = tuple((name, compile_schema(annotations[name])) if name in annotations else (name, None)
+                       for name in arg_names)
+    kwarg_checks = {name: check for name, check in arg_checks if check is not None}
+    return_check = compile_schema(annotations["return"]) if "return" in annotations else None
+
+    def raise_failure(name, arg, failure):
+        key_path, value, expected = failure
+        raise SchemaError(function, arg, name, key_path, value, expected) from None
+
+    @functools.wraps(function)
+    def checked_function(*args, **kwargs):
+        if (_local_level.get() or _level if _local_blocks else _level) not in levels:
+            return function(*args, **kwargs)
+
+        for (name, check), arg in zip(arg_checks, args):
+            if check is not None:
+                failure = check(arg)
+                if failure is not None:
+                    raise_failure(name, arg, failure)
+        for name, arg in kwargs.items():
+            check = kwarg_checks.get(name)
+            if check is not None:
+                failure = check(arg)
+                if failure is not None:
+                    raise_failure(name, arg, failure)
+
+        result = function(*args, **kwargs)
+
+        if return_check is not None:
+            failure = return_check(result)
+            if failure is not None:
+                raise_failure("return", result, failure)
+        return result
+
+    checked_function.unchecked = function
+    return checked_function
+
+
+def schema(function):
+    """Drop-in replacement for py_types' schema decorator using compiled checkers.
+    Only checks at the "full" validation level."""
+    return _checked(function, (FULL,))
+
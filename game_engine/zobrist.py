@@ -0,0 +1,74 @@
+"""Zobrist-style 64 bit position hashes.
+
+A position is hashed as:
+    - each system: the sum of a random key per ship (owner and piece) and per star piece,
+      plus a key for the star's owner.  Sums rather than XORs, so identical ships in a
+      system don't cancel out.
+    - the game: the sum of mix(system hash) over all systems, plus count * key for every
+      piece in the reserve, plus a key for the player to move.
+
+System ids, system_count, ship order and history don't take part, so equal positions reached
+in different ways hash the same.  Every term is a sum, so game.py updates the hash in O(1)
+as pieces come and go (see the primitives at the bottom of game.py).
+"""
+
+import random
+
+
+MASK = (1 << 64) - 1
+MAX_OWNERS = 16
+PIECE_KEYS = tuple(color + str(size) for color in "gbyr" for size in (1, 2, 3))
+
+_rng = random.Random(0x486f6d65776f726c)
+
+
+def _key():
+    return _rng.getrandbits(64)
+
+
+SHIP_KEYS = {(owner, piece_key): _key() for owner in range(MAX_OWNERS) for piece_key in PIECE_KEYS}
+STAR_KEYS = {piece_key: _key() for piece_key in PIECE_KEYS}
+STAR_OWNER_KEYS = [_key() for _ in range(MAX_OWNERS)]
+RESERVE_KEYS = {piece_key: _key() for piece_key in PIECE_KEYS}
+TO_MOVE_KEYS = [_key() for _ in range(MAX_OWNERS)]
+
+
+def mix(value: int) -> int:
+    """splitmix64 finalizer, so systems combine non-linearly."""
+    value = (value ^ (value >> 30)) * 0xbf58476d1ce4e5b9 & MASK
+    value = (value ^ (value >> 27)) * 0x94d049bb133111eb & MASK
+    return value ^ (value >> 31)
+
+
+def piece_key(piece: dict) -> str:
+    return piece["color"][0] + str(piece["size"])
+
+
+def ship_key(ship: dict) -> int:
+    return SHIP_KEYS[ship["owner"], piece_key(ship["piece"])]
+
+
+def star_key(piece: dict) -> int:
+    return STAR_KEYS[piece_key(piece)]
+
+
+def system_hash(system: dict) -> int:
+    value = STAR_OWNER_KEYS[system["star"]["owner"]]
+    for piece in system["star"]["pieces"]:
+        value += star_key(piece)
+    for ship in system["ships"]:
+        value += ship_key(ship)
+    return value & MASK
+
+
+def rehash(game: dict) -> dict:
+    """Computes game["hash"] and every system's "hash" from scratch.
+    Needed for states that weren't built by the engine's action methods."""
+    value = TO_MOVE_KEYS[game["current_player"]]
+    for key, count in game["reserve"].items():
+        value += count * RESERVE_KEYS[key]
+    for system in game["systems"].values():
+        system["hash"] = system_hash(system)
+        value += mix(system["hash"])
+    game["hash"] = value & MASK
+    return game